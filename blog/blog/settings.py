@@ -209,10 +209,73 @@ MEDIA_ROOT = os.path.join(BASE_DIR, "media/")
 # 图片的统一路由
 MEDIA_URL = "/media/"
 
-
-
-
-
-
-
-
+# 首页文章列表每页条数上限，防止客户端传入过大的page_size
+ARTICLE_PAGE_SIZE_MAX = 50
+# 分类文章总数的缓存时间(秒)，用于游标分页模式下计算近似总页数
+ARTICLE_COUNT_CACHE_TIMEOUT = 300
+# 浏览量写回数据库时每条UPDATE语句更新的文章数量
+ARTICLE_VIEWS_FLUSH_BATCH = 500
+# 趋势排行：分数的半衰期(小时)、统计窗口(小时)、一条评论相当于多少次浏览
+TRENDING_HALF_LIFE_HOURS = 6
+TRENDING_WINDOW_HOURS = 48
+TRENDING_COMMENT_WEIGHT = 5
+# 趋势排行：每个分类发布的文章数量、每批计算的文章数量
+TRENDING_TOP_N = 100
+TRENDING_BATCH_SIZE = 1000
+# 匿名用户整页缓存的超时时间(秒)，文章和评论写入时会按标签提前清除
+PAGE_CACHE_TIMEOUT = 300
+# 片段缓存：提前重算的倾向、重算锁的超时时间(秒)、过期后旧值的保留时间(秒)
+FRAGMENT_CACHE_BETA = 1.0
+FRAGMENT_CACHE_LOCK_TIMEOUT = 10
+FRAGMENT_CACHE_STALE_TIMEOUT = 60
+# 热门文章侧边栏的缓存时间(秒)
+HOT_ARTICLES_CACHE_TIMEOUT = 30
+# 文章对象缓存：redis缓存时间(秒)、每个进程本地缓存的有效时间(秒，不超过redis缓存时间)、最大条目数和最大字节数
+ARTICLE_CACHE_TIMEOUT = 600
+ARTICLE_LOCAL_CACHE_TIMEOUT = 30
+ARTICLE_CACHE_MAX_ENTRIES = 1000
+ARTICLE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+# 文章正文压缩存储：是否压缩、超过多少字节才压缩、zlib压缩级别
+ARTICLE_CONTENT_COMPRESS = True
+ARTICLE_CONTENT_COMPRESS_MIN_BYTES = 1024
+ARTICLE_CONTENT_COMPRESS_LEVEL = 6
+# 文章标签：每篇文章最多的标签数量、标签云展示的标签数量和缓存时间(秒)
+ARTICLE_TAGS_MAX = 5
+TAG_CLOUD_SIZE = 30
+TAG_CLOUD_CACHE_TIMEOUT = 300
+# 全文检索：分词函数、BM25参数、每次检索最多返回的文章数量
+SEARCH_TOKENIZER = "home.tokenizers.bigram_tokenize"
+SEARCH_BM25_K1 = 1.2
+SEARCH_BM25_B = 0.75
+SEARCH_MAX_RESULTS = 1000
+# 标题自动补全最多返回的条数
+SUGGEST_LIMIT = 8
+# 相关文章：每篇文章保存的相关文章数量、词表最多的词数、词出现的最少文章数和最大文章比例、每批计算的文章数量
+RELATED_TOP_K = 5
+RELATED_MAX_FEATURES = 50000
+RELATED_MIN_DF = 2
+RELATED_MAX_DF = 0.5
+RELATED_CHUNK_SIZE = 1000
+# 相关文章：一次相似度矩阵乘法结果的最大元素数，文章越多每次乘法的行数越少，内存占用不随文章数增长
+RELATED_PRODUCT_MAX_ENTRIES = 2000000
+# 验证码池：每种图片格式池中最多保存的验证码数量、生产进程每秒最多生成的数量、检查池中数量的间隔(秒)
+CAPTCHA_POOL_SIZE = 500
+CAPTCHA_POOL_REFILL_RATE = 50
+CAPTCHA_POOL_CHECK_INTERVAL = 1
+# 生产进程补充失败(如redis不可用)后的最长等待时间(秒)，等待时间从检查间隔开始逐次翻倍
+CAPTCHA_POOL_MAX_BACKOFF = 60
+# 生产进程并行生成验证码使用的进程数
+CAPTCHA_POOL_WORKERS = 1
+# 验证码绘制方式：pil，或numpy(噪点、曲线用numpy计算)，两者生成的图片相同，整张验证码的生成速度没有差别
+CAPTCHA_BACKEND = "pil"
+# 验证码图片格式：默认格式(所有浏览器都支持)，以及请求头Accept中明确声明支持时按顺序优先使用的格式
+CAPTCHA_FORMAT = "JPEG"
+CAPTCHA_FORMATS = ("WEBP",)
+# 验证码图片编码参数：JPEG和WEBP的质量，PNG调色板的颜色数
+CAPTCHA_JPEG_QUALITY = 50
+CAPTCHA_WEBP_QUALITY = 50
+CAPTCHA_PNG_COLORS = 16
+# 应用前面可信的反向代理层数，大于0时从X-Forwarded-For中获取客户端ip，否则只使用REMOTE_ADDR
+TRUSTED_PROXY_COUNT = 0
+# 视图执行的SQL语句超出预算时抛出异常，否则只记录警告日志，测试时开启，见utils.testing
+QUERY_BUDGET_STRICT = False
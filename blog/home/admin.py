@@ -2,5 +2,14 @@ from django.contrib import admin
 from home.models import ArticleCategory
 
 
+class ArticleCategoryAdmin(admin.ModelAdmin):
+    list_display = ("title", "article_count", "created")
+    readonly_fields = ("article_count",)
+
+    def save_model(self, request, obj, form, change):
+        # 修改分类时只保存表单中修改过的字段，文章数量由信号原子地更新，不能用读取时的值覆盖
+        obj.save(update_fields=form.changed_data if change else None)
+
+
 # 注册模型类
-admin.site.register(ArticleCategory)
+admin.site.register(ArticleCategory, ArticleCategoryAdmin)
@@ -0,0 +1,63 @@
+"""文章分类的进程内缓存
+
+分类数据几乎不会变化，每个进程在内存中缓存一份不可变的(id, title)元组列表。
+redis中保存分类数据的版本号，分类保存或删除时由信号递增版本号，
+各个进程每次请求只读取一次版本号，发现版本变化后重新加载分类。
+"""
+from collections import namedtuple
+import logging
+import threading
+
+from django_redis import get_redis_connection
+
+from home.models import ArticleCategory
+
+logger = logging.getLogger("django")
+
+# 分类数据版本号
+CATEGORY_VERSION_KEY = "category:version"
+
+CategoryItem = namedtuple("CategoryItem", ["id", "title"])
+
+# 当前进程缓存的(版本号, 分类元组)
+_cached = (None, None)
+_lock = threading.Lock()
+
+
+def get_categories():
+    """获取所有分类，返回CategoryItem元组"""
+    global _cached
+    version, categories = _cached
+    try:
+        current = int(get_redis_connection("default").get(CATEGORY_VERSION_KEY) or 0)
+    except Exception as e:
+        logger.error(e)
+        # redis不可用时继续使用本地缓存
+        current = version
+    if categories is not None and current == version:
+        return categories
+    with _lock:
+        categories = tuple(CategoryItem(id, title)
+                           for id, title in ArticleCategory.objects.order_by("id").values_list("id", "title"))
+        _cached = (current, categories)
+    return categories
+
+
+def find_category(categories, category_id):
+    """根据id在分类元组中查找分类，不存在时返回None"""
+    try:
+        category_id = int(category_id)
+    except (TypeError, ValueError):
+        return None
+    for category in categories:
+        if category.id == category_id:
+            return category
+    return None
+
+
+def bump_category_version():
+    """递增分类数据版本号，使所有进程的分类缓存失效"""
+    try:
+        get_redis_connection("default").incr(CATEGORY_VERSION_KEY)
+    except Exception as e:
+        logger.error(e)
@@ -0,0 +1,259 @@
+"""文章浏览量计数
+
+详情页的每次访问只在redis的hash中累加浏览量，
+再由flush_article_views命令定时把累计的增量用一条UPDATE批量写回数据库，
+避免每次访问都保存整行文章数据，也避免并发访问时丢失计数。
+写回时不清除文章对象缓存，redis中记录每篇文章累计写回的浏览量，
+缓存的文章对象保存缓存时的累计值，展示时补上之后写回的部分。
+
+独立访客使用redis的HyperLogLog按天统计(每篇文章约12KB)，
+由rollup_unique_views命令合并到文章的总访客HyperLogLog中并写入unique_views字段。
+"""
+import datetime
+import hashlib
+import logging
+import uuid
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, When, F
+from django.utils import timezone
+from django_redis import get_redis_connection
+from redis.exceptions import ResponseError, WatchError
+
+from home.leaderboard import HOT_ARTICLES_KEY
+from home.models import Article, ViewFlush
+from home.trending import hour_key, hourly_views_ttl
+
+logger = logging.getLogger("django")
+
+# 待写回数据库的浏览量增量 {article_id: delta}
+PENDING_VIEWS_KEY = "article:views:pending"
+# 正在写回数据库的浏览量增量
+FLUSHING_VIEWS_KEY = "article:views:flushing"
+# 正在写回的批次id
+FLUSH_ID_KEY = "article:views:flush_id"
+# 数据库中批次id的保留时间
+VIEW_FLUSH_RETENTION = datetime.timedelta(days=7)
+# 累计已写回数据库的浏览量 {article_id: total}
+FLUSHED_VIEWS_KEY = "article:views:flushed"
+# 文章每天的独立访客HyperLogLog
+DAILY_VISITORS_KEY = "article:uv:%s:%s"
+# 文章全部的独立访客HyperLogLog
+TOTAL_VISITORS_KEY = "article:uv:%s"
+# 每天有访客的文章id集合
+DAILY_VISITED_KEY = "article:uv:visited:%s"
+# 每天的访客数据保留时间，超出后仍未汇总的数据会丢失
+DAILY_VISITORS_TTL = 3 * 24 * 3600
+
+
+def day_of(moment):
+    return moment.astimezone(datetime.timezone.utc).strftime("%Y%m%d")
+
+
+def client_ip(request):
+    """获取客户端ip
+
+    X-Forwarded-For可以由客户端任意伪造，只有配置了settings.TRUSTED_PROXY_COUNT时才使用：
+    每层可信代理在末尾追加它收到请求的地址，从右数第TRUSTED_PROXY_COUNT个即为客户端ip。
+    """
+    proxies = settings.TRUSTED_PROXY_COUNT
+    forwarded = request.META.get("HTTP_X_FORWARDED_FOR")
+    if proxies and forwarded:
+        addresses = [address.strip() for address in forwarded.split(",")]
+        return addresses[-min(proxies, len(addresses))]
+    return request.META.get("REMOTE_ADDR", "")
+
+
+def visitor_hash(request):
+    """根据session或ip+浏览器标识生成访客标识，不在redis中保存原始ip"""
+    if request.session.session_key:
+        raw = "s:" + request.session.session_key
+    else:
+        raw = "ip:%s:%s" % (client_ip(request), request.META.get("HTTP_USER_AGENT", ""))
+    return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+
+def record_view(article_id, visitor):
+    """记录一次文章浏览
+
+    :param article_id: 文章id
+    :param visitor: 访客标识，见visitor_hash
+    :return: (尚未写回数据库的浏览量增量, 累计已写回数据库的浏览量, 当前独立访客数)
+    """
+    now = timezone.now()
+    today = day_of(now)
+    yesterday = day_of(now - datetime.timedelta(days=1))
+    try:
+        redis_conn = get_redis_connection("default")
+        pipeline = redis_conn.pipeline()
+        pipeline.hincrby(PENDING_VIEWS_KEY, article_id, 1)
+        pipeline.hget(FLUSHING_VIEWS_KEY, article_id)
+        pipeline.hget(FLUSHED_VIEWS_KEY, article_id)
+        # 记录独立访客，并统计包含尚未汇总的最近两天在内的访客数
+        daily_key = DAILY_VISITORS_KEY % (article_id, today)
+        pipeline.pfadd(daily_key, visitor)
+        pipeline.pfcount(TOTAL_VISITORS_KEY % article_id, daily_key, DAILY_VISITORS_KEY % (article_id, yesterday))
+        pipeline.expire(daily_key, DAILY_VISITORS_TTL)
+        pipeline.sadd(DAILY_VISITED_KEY % today, article_id)
+        pipeline.expire(DAILY_VISITED_KEY % today, DAILY_VISITORS_TTL)
+        # 同时更新热门文章排行和趋势排行使用的小时浏览量
+        pipeline.zincrby(HOT_ARTICLES_KEY, 1, article_id)
+        key = hour_key(now)
+        pipeline.hincrby(key, article_id, 1)
+        pipeline.expire(key, hourly_views_ttl())
+        pending, flushing, flushed, _, unique = pipeline.execute()[:5]
+    except Exception as e:
+        logger.error(e)
+        return 0, None, None
+    return pending + int(flushing or 0), int(flushed or 0), unique
+
+
+def flushed_views_checkpoint(article_id):
+    """获取文章累计已写回的浏览量，以及是否正在写回
+
+    读取数据库前后各调用一次，结果相同且没有正在写回时，读到的浏览量与累计写回量一致。
+    :return: (累计已写回数据库的浏览量, 是否正在写回)，redis不可用时返回None
+    """
+    try:
+        pipeline = get_redis_connection("default").pipeline()
+        pipeline.hget(FLUSHED_VIEWS_KEY, article_id)
+        pipeline.exists(FLUSHING_VIEWS_KEY)
+        flushed, flushing = pipeline.execute()
+    except Exception as e:
+        logger.error(e)
+        return None
+    return int(flushed or 0), bool(flushing)
+
+
+def pending_views(article_id):
+    """获取文章尚未写回数据库的浏览量增量"""
+    try:
+        redis_conn = get_redis_connection("default")
+        pipeline = redis_conn.pipeline()
+        pipeline.hget(PENDING_VIEWS_KEY, article_id)
+        pipeline.hget(FLUSHING_VIEWS_KEY, article_id)
+        pending, flushing = pipeline.execute()
+    except Exception as e:
+        logger.error(e)
+        return 0
+    return int(pending or 0) + int(flushing or 0)
+
+
+def pending_views_all():
+    """获取所有文章尚未写回数据库的浏览量增量 {article_id: delta}"""
+    redis_conn = get_redis_connection("default")
+    pipeline = redis_conn.pipeline()
+    pipeline.hgetall(PENDING_VIEWS_KEY)
+    pipeline.hgetall(FLUSHING_VIEWS_KEY)
+    result = {}
+    for views in pipeline.execute():
+        for id, delta in views.items():
+            result[int(id)] = result.get(int(id), 0) + int(delta)
+    return result
+
+
+def flush_views(batch_size=None):
+    """将redis中累计的浏览量批量写回数据库
+
+    先把待写回的hash重命名为写回中的hash并分配批次id，之后的访问会累加到新的hash中，
+    写回失败时事务回滚并保留写回中的hash，下次执行时重新处理。
+    批次id与浏览量在同一个数据库事务中写入：事务提交后redis的收尾失败时，
+    下次执行发现批次已经写回，只重做收尾，不会重复累加浏览量。
+    事务提交后在同一个redis事务中累加已写回的浏览量并删除写回中的hash，展示的浏览量不会重复或减少。
+    :return: 写回的浏览量总数
+    """
+    batch_size = batch_size or settings.ARTICLE_VIEWS_FLUSH_BATCH
+    redis_conn = get_redis_connection("default")
+    if not redis_conn.exists(FLUSHING_VIEWS_KEY):
+        try:
+            redis_conn.rename(PENDING_VIEWS_KEY, FLUSHING_VIEWS_KEY)
+        except ResponseError:
+            # 没有待写回的浏览量
+            return 0
+    # 重命名后分配批次id，重命名后进程退出时下次执行再分配
+    redis_conn.set(FLUSH_ID_KEY, uuid.uuid4().hex, nx=True)
+    flush_id = redis_conn.get(FLUSH_ID_KEY)
+    if flush_id is None:
+        # 其他进程刚刚完成了这一批的写回
+        return 0
+    flush_id = flush_id.decode()
+    deltas = [(int(id), int(delta)) for id, delta in redis_conn.hgetall(FLUSHING_VIEWS_KEY).items()]
+    try:
+        # 所有批次在同一个事务中写入，失败时全部回滚，重试时不会重复累加已写入的批次
+        with transaction.atomic():
+            # 批次id唯一，已经写回的批次在这里失败，并发写回同一批次时等待先写入的事务结束
+            ViewFlush.objects.create(flush_id=flush_id)
+            for start in range(0, len(deltas), batch_size):
+                batch = deltas[start:start + batch_size]
+                # 一条UPDATE语句更新一批文章：total_views = CASE id WHEN ... THEN total_views + delta END
+                Article.objects.filter(id__in=[id for id, _ in batch]).update(
+                    total_views=Case(
+                        *[When(id=id, then=F("total_views") + delta) for id, delta in batch],
+                        default=F("total_views")
+                    )
+                )
+            # 只需要保留最近的批次id，用于发现收尾失败的批次
+            ViewFlush.objects.filter(created__lt=timezone.now() - VIEW_FLUSH_RETENTION).delete()
+            transaction.on_commit(lambda: finish_flush(redis_conn, flush_id, deltas))
+    except IntegrityError:
+        # 这一批已经写回数据库，上次写回后redis的收尾没有完成
+        finish_flush(redis_conn, flush_id, deltas)
+        return 0
+    return sum(delta for _, delta in deltas)
+
+
+def finish_flush(redis_conn, flush_id, deltas):
+    """写回事务提交后，累加已写回的浏览量并删除写回中的hash和批次id
+
+    批次id已经不是flush_id时说明其他进程已经完成收尾，不再重复累加。
+    """
+    with redis_conn.pipeline() as pipeline:
+        try:
+            pipeline.watch(FLUSH_ID_KEY)
+            current = pipeline.get(FLUSH_ID_KEY)
+            if current is None or current.decode() != flush_id:
+                return
+            pipeline.multi()
+            for id, delta in deltas:
+                pipeline.hincrby(FLUSHED_VIEWS_KEY, id, delta)
+            pipeline.delete(FLUSHING_VIEWS_KEY, FLUSH_ID_KEY)
+            pipeline.execute()
+        except WatchError:
+            # 其他进程同时完成了收尾
+            pass
+
+
+def rollup_unique_views(days=3, batch_size=None):
+    """将最近几天的独立访客HyperLogLog合并到文章的总访客中，并写入unique_views字段
+
+    HyperLogLog的合并是幂等的，当天的数据可以反复合并，
+    之前几天的数据合并后删除。
+    :return: 更新的文章数量
+    """
+    batch_size = batch_size or settings.ARTICLE_VIEWS_FLUSH_BATCH
+    now = timezone.now()
+    today = day_of(now)
+    redis_conn = get_redis_connection("default")
+    updated = 0
+    for i in range(days):
+        day = day_of(now - datetime.timedelta(days=i))
+        ids = sorted(int(id) for id in redis_conn.smembers(DAILY_VISITED_KEY % day))
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start:start + batch_size]
+            pipeline = redis_conn.pipeline()
+            for id in batch:
+                pipeline.pfmerge(TOTAL_VISITORS_KEY % id, TOTAL_VISITORS_KEY % id, DAILY_VISITORS_KEY % (id, day))
+                pipeline.pfcount(TOTAL_VISITORS_KEY % id)
+            counts = pipeline.execute()[1::2]
+            Article.objects.filter(id__in=batch).update(
+                unique_views=Case(*[When(id=id, then=count) for id, count in zip(batch, counts)],
+                                  default=F("unique_views"))
+            )
+            # 展示的独立访客数使用redis中的实时统计值，不需要清除文章对象缓存
+            updated += len(batch)
+            if day != today:
+                redis_conn.delete(*[DAILY_VISITORS_KEY % (id, day) for id in batch])
+        if day != today:
+            redis_conn.delete(DAILY_VISITED_KEY % day)
+    return updated
@@ -0,0 +1,94 @@
+"""压缩存储的文本字段
+
+长文章(尤其是包含大段代码的文章)使tb_article的行很大，占用buffer pool和备份空间。
+CompressedTextField在数据库中以二进制保存，第一个字节是标记：
+b"\x00"表示其后是未压缩的utf-8文本，b"\x01"表示其后是zlib压缩的utf-8文本。
+超过settings.ARTICLE_CONTENT_COMPRESS_MIN_BYTES的文本才压缩，
+从数据库读出的字节在第一次访问字段时才解码，不访问正文的请求不产生解压开销。
+"""
+import zlib
+
+from django.conf import settings
+from django.db import models
+from django.db.models.query_utils import DeferredAttribute
+
+PLAIN = b"\x00"
+ZLIB = b"\x01"
+
+
+def encode_text(text):
+    """将文本编码为带标记字节的二进制"""
+    data = text.encode("utf-8")
+    if settings.ARTICLE_CONTENT_COMPRESS and len(data) >= settings.ARTICLE_CONTENT_COMPRESS_MIN_BYTES:
+        compressed = zlib.compress(data, settings.ARTICLE_CONTENT_COMPRESS_LEVEL)
+        # 压缩后没有变小时按原文保存
+        if len(compressed) < len(data):
+            return ZLIB + compressed
+    return PLAIN + data
+
+
+def decode_text(value):
+    """将数据库中的值解码为文本，兼容转换前未带标记的旧数据"""
+    if value is None or isinstance(value, str):
+        return value
+    data = bytes(value)
+    if data[:1] == ZLIB:
+        return zlib.decompress(data[1:]).decode("utf-8")
+    if data[:1] == PLAIN:
+        return data[1:].decode("utf-8")
+    return data.decode("utf-8")
+
+
+def is_encoded(value):
+    """数据库中的值是否已经是带标记字节的格式"""
+    return isinstance(value, (bytes, memoryview)) and bytes(value[:1]) in (PLAIN, ZLIB)
+
+
+class CompressedTextAttribute(DeferredAttribute):
+    """第一次访问时才解码字段值，解码结果保存在实例上"""
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        value = super().__get__(instance, cls)
+        if isinstance(value, (bytes, memoryview)):
+            value = instance.__dict__[self.field_name] = decode_text(value)
+        return value
+
+    def __set__(self, instance, value):
+        # 定义__set__使其成为数据描述符，读取已加载的值时也会经过__get__
+        instance.__dict__[self.field_name] = value
+
+
+class CompressedTextField(models.TextField):
+    """以二进制保存、超过阈值时zlib压缩的文本字段，对模型和表单表现为普通文本"""
+    def get_internal_type(self):
+        # 数据库列类型与BinaryField相同(MySQL中为longblob)
+        return "BinaryField"
+
+    def contribute_to_class(self, cls, name, **kwargs):
+        super().contribute_to_class(cls, name, **kwargs)
+        setattr(cls, self.attname, CompressedTextAttribute(self.attname))
+
+    def to_python(self, value):
+        return decode_text(value)
+
+    def get_prep_value(self, value):
+        if value is None:
+            return None
+        if isinstance(value, (bytes, memoryview)):
+            # 从数据库读出后未被访问过的值，原样写回
+            return bytes(value)
+        return encode_text(str(value))
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        value = self.get_prep_value(value)
+        if value is not None:
+            return connection.Database.Binary(value)
+        return value
+
+    def pre_save(self, model_instance, add):
+        # 直接取实例上保存的值，避免未访问的正文在保存时先解压再压缩
+        return model_instance.__dict__.get(self.attname)
+
+    def value_to_string(self, obj):
+        return decode_text(self.value_from_object(obj))
@@ -0,0 +1,107 @@
+"""防击穿的页面片段缓存
+
+热门缓存key过期时，所有进程会同时重新计算并压垮数据库。这里的缓存：
+1.提前概率重算(XFetch)：越接近过期时间、重算越耗时，越可能由某个请求提前重算；
+2.重算时使用redis短锁，只有拿到锁的进程重算，其他进程继续返回旧值，锁按令牌释放；
+3.过期后旧值仍保留一段时间，供等待重算的请求使用。
+命中、未命中、重算、返回旧值的次数在进程内累计，定期汇总到redis中。
+"""
+import logging
+import math
+import random
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django_redis import get_redis_connection
+
+from home.stats import StatsCounter
+
+logger = logging.getLogger("django")
+
+# 命中(hit)、未命中(miss)、重算(rebuild)、返回旧值(stale)的次数
+counter = StatsCounter("fragment:stats")
+
+# 比较并删除：锁的值仍是自己的令牌时才删除。重算超过锁的有效时间后锁可能已被其他进程持有
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+def _should_rebuild(entry, beta):
+    """XFetch：now - delta * beta * ln(rand) >= expiry 时提前重算"""
+    return time.time() - entry["delta"] * beta * math.log(random.random() or 1e-12) >= entry["expiry"]
+
+
+def _build(key, builder, timeout):
+    start = time.time()
+    value = builder()
+    delta = time.time() - start
+    # 过期后旧值继续保留一段时间，供其他进程在重算期间使用
+    cache.set(key, {"value": value, "delta": delta, "expiry": time.time() + timeout},
+              timeout + settings.FRAGMENT_CACHE_STALE_TIMEOUT)
+    return value
+
+
+def _acquire_lock(lock_key):
+    """获取重算锁，成功时返回锁的令牌，锁已被其他进程持有时返回None"""
+    token = uuid.uuid4().hex
+    if get_redis_connection("default").set(lock_key, token, nx=True, ex=settings.FRAGMENT_CACHE_LOCK_TIMEOUT):
+        return token
+    return None
+
+
+def _release_lock(lock_key, token):
+    """释放自己持有的重算锁"""
+    try:
+        get_redis_connection("default").eval(RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+    except Exception as e:
+        logger.error(e)
+
+
+def get_or_build(key, builder, timeout, beta=None):
+    """读取缓存的片段，需要时重新计算
+
+    :param key: 缓存key
+    :param builder: 计算片段的无参函数，返回值需要能被pickle
+    :param timeout: 缓存有效时间(秒)
+    :param beta: 提前重算的倾向，越大越早重算，默认使用settings.FRAGMENT_CACHE_BETA
+    """
+    beta = settings.FRAGMENT_CACHE_BETA if beta is None else beta
+    try:
+        entry = cache.get(key)
+    except Exception as e:
+        logger.error(e)
+        return builder()
+    if entry is not None and not _should_rebuild(entry, beta):
+        counter.incr("hit")
+        return entry["value"]
+    # 需要重算：只有拿到锁的进程重算
+    lock_key = "fragment:lock:%s" % key
+    try:
+        token = _acquire_lock(lock_key)
+    except Exception as e:
+        logger.error(e)
+        return entry["value"] if entry is not None else builder()
+    if token is not None:
+        try:
+            counter.incr("rebuild" if entry is not None else "miss")
+            return _build(key, builder, timeout)
+        finally:
+            _release_lock(lock_key, token)
+    if entry is not None:
+        # 其他进程正在重算，先返回旧值
+        counter.incr("stale")
+        return entry["value"]
+    # 没有旧值可用，只能自己计算，但不写入缓存
+    counter.incr("miss")
+    return builder()
+
+
+def invalidate(key):
+    """删除缓存的片段"""
+    cache.delete(key)
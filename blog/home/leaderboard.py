@@ -0,0 +1,99 @@
+"""热门文章排行
+
+文章浏览量同时累加到redis的有序集合中，详情页的热门文章侧边栏
+通过一次ZREVRANGE获取文章id，再按id查询标题，不再对tb_article全表排序。
+排行尚未初始化时(如redis数据清空后)由一个请求根据数据库中的浏览量初始化排行，
+之后排行中的文章不足时直接使用排行，不再每次查询数据库。
+"""
+import logging
+
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from home.fragment_cache import get_or_build
+from home.models import Article
+
+logger = logging.getLogger("django")
+
+# 热门文章有序集合 {article_id: total_views}
+HOT_ARTICLES_KEY = "article:hot"
+# 缓存的热门文章列表
+HOT_ARTICLES_FRAGMENT = "fragment:hot:%s"
+# 排行已根据数据库初始化的标记
+HOT_ARTICLES_READY_KEY = "article:hot:ready"
+# 初始化排行的锁，只由一个请求初始化
+HOT_ARTICLES_SEED_LOCK = "article:hot:seeding"
+HOT_ARTICLES_SEED_LOCK_TIMEOUT = 300
+
+
+def get_hot_articles(limit):
+    """获取浏览量最高的limit篇文章，结果缓存一段时间，由一个进程负责重算"""
+    return get_or_build(HOT_ARTICLES_FRAGMENT % limit, lambda: load_hot_articles(limit),
+                        settings.HOT_ARTICLES_CACHE_TIMEOUT)
+
+
+def load_hot_articles(limit):
+    """获取浏览量最高的limit篇文章，只查询id和标题"""
+    try:
+        redis_conn = get_redis_connection("default")
+        ids, ready = read_hot_ids(redis_conn, limit)
+        if not ready and redis_conn.set(HOT_ARTICLES_SEED_LOCK, 1, nx=True, ex=HOT_ARTICLES_SEED_LOCK_TIMEOUT):
+            # 排行尚未初始化，由拿到锁的请求根据数据库初始化
+            try:
+                rebuild_hot_articles()
+            finally:
+                redis_conn.delete(HOT_ARTICLES_SEED_LOCK)
+            ids, ready = read_hot_ids(redis_conn, limit)
+    except Exception as e:
+        logger.error(e)
+        ids, ready = [], False
+    if not ready and len(ids) < limit:
+        # redis不可用或其他请求正在初始化排行，直接查询数据库
+        return list(Article.objects.only("id", "title").order_by("-total_views")[:limit])
+    articles = {article.id: article for article in Article.objects.filter(id__in=ids).only("id", "title").order_by()}
+    # 清理已删除的文章
+    missing = [id for id in ids if id not in articles]
+    if missing:
+        redis_conn.zrem(HOT_ARTICLES_KEY, *missing)
+    return [articles[id] for id in ids if id in articles]
+
+
+def read_hot_ids(redis_conn, limit):
+    """读取排行中的前limit篇文章id，返回(文章id列表, 排行是否已经初始化)"""
+    pipeline = redis_conn.pipeline()
+    pipeline.zrevrange(HOT_ARTICLES_KEY, 0, limit - 1)
+    pipeline.exists(HOT_ARTICLES_READY_KEY)
+    ids, ready = pipeline.execute()
+    return [int(id) for id in ids], bool(ready)
+
+
+def rebuild_hot_articles(batch_size=1000):
+    """根据数据库中的浏览量重建热门文章排行
+
+    先写入临时的有序集合，完成后再重命名替换，重建过程中不影响读取。
+    :return: 写入排行的文章数量
+    """
+    # 避免循环导入
+    from home.counters import pending_views_all
+    redis_conn = get_redis_connection("default")
+    tmp_key = HOT_ARTICLES_KEY + ":rebuild"
+    redis_conn.delete(tmp_key)
+    # 尚未写回数据库的浏览量也要计入
+    pending = pending_views_all()
+    count = 0
+    mapping = {}
+    for id, total_views in Article.objects.order_by().values_list("id", "total_views").iterator():
+        mapping[id] = total_views + pending.get(id, 0)
+        if len(mapping) >= batch_size:
+            redis_conn.zadd(tmp_key, mapping)
+            count += len(mapping)
+            mapping = {}
+    if mapping:
+        redis_conn.zadd(tmp_key, mapping)
+        count += len(mapping)
+    if count:
+        redis_conn.rename(tmp_key, HOT_ARTICLES_KEY)
+    else:
+        redis_conn.delete(HOT_ARTICLES_KEY)
+    redis_conn.set(HOT_ARTICLES_READY_KEY, 1)
+    return count
@@ -0,0 +1,119 @@
+import random
+import time
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.db import connections, models
+from django.utils import timezone
+
+from home.models import ArticleCategory, Article, Comment
+from home.pagination import keyset_order
+from users.models import User
+
+BENCH_MOBILE = "10000000000"
+BENCH_CATEGORY = "__bench__"
+
+
+def fk_index(model, index):
+    """联合索引以外键列开头时，返回该外键列的单列索引，否则返回None"""
+    field = model._meta.get_field(index.fields[0].lstrip("-"))
+    if not field.is_relation:
+        return None
+    return models.Index(fields=[field.name], name="bench_%s_fk_idx" % field.column[:16])
+
+
+class Command(BaseCommand):
+    help = "在临时创建的测试数据库中生成测试数据，对比有无联合索引时文章/评论列表查询的执行计划和耗时"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=10000, help="生成的文章数量")
+        parser.add_argument("--comments", type=int, default=2000, help="测试文章的评论数量")
+        parser.add_argument("--runs", type=int, default=200, help="每条查询执行的次数")
+        parser.add_argument("--database", default="default",
+                            help="在该数据库配置对应的测试数据库(test_前缀)中执行，结束后删除测试数据库")
+
+    def handle(self, *args, **options):
+        # 与运行测试相同，创建独立的测试数据库并执行迁移，不修改正式数据库中的索引和数据
+        connection = connections[options["database"]]
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.bench(connection, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def bench(self, connection, options):
+        using = connection.alias
+        author, category, article = self.seed(using, options["rows"], options["comments"])
+        articles = Article.objects.using(using)
+        deep_article = articles.filter(category=category).order_by("-created", "-id")[options["rows"] // 2]
+        queries = {
+            "分类文章列表": lambda: keyset_order(articles.listing().filter(category=category))[:10],
+            "分类文章深分页": lambda: keyset_order(articles.listing().filter(
+                category=category, created__lt=deep_article.created))[:10],
+            "作者文章列表": lambda: articles.listing().filter(author=author).order_by("-created")[:10],
+            "文章评论列表": lambda: Comment.objects.using(using).filter(article=article).order_by("-created")[:5],
+        }
+        indexes = [(Article, index) for index in Article._meta.indexes] + \
+                  [(Comment, index) for index in Comment._meta.indexes]
+        # MySQL InnoDB的外键必须有索引，Django不会为已有联合索引覆盖的外键单独建索引，
+        # 直接删除联合索引会报错1553。先为外键列建立单列索引，恢复联合索引后再删除
+        fk_indexes = [(model, fk_index(model, index)) for model, index in indexes]
+        fk_indexes = [(model, index) for model, index in fk_indexes if index is not None]
+        added = []
+        removed = []
+        try:
+            # 先删除联合索引测试，再恢复索引测试
+            with connection.schema_editor() as editor:
+                for model, index in fk_indexes:
+                    editor.add_index(model, index)
+                    added.append((model, index))
+                for model, index in indexes:
+                    editor.remove_index(model, index)
+                    removed.append((model, index))
+            self.report("无联合索引", queries, options["runs"])
+        finally:
+            # 无论测试是否成功都恢复已删除的索引，并删除临时的外键索引
+            with connection.schema_editor() as editor:
+                for model, index in removed:
+                    editor.add_index(model, index)
+                for model, index in added:
+                    editor.remove_index(model, index)
+        self.report("有联合索引", queries, options["runs"])
+
+    def seed(self, using, rows, comments):
+        """生成测试分类、作者、文章和评论"""
+        author = User.objects.db_manager(using).create(mobile=BENCH_MOBILE, username=BENCH_MOBILE)
+        category = ArticleCategory.objects.using(using).create(title=BENCH_CATEGORY)
+        now = timezone.now()
+        batch = []
+        for i in range(rows):
+            batch.append(Article(
+                author=author, category=category, title="bench %d" % i, sumary="bench",
+                content="bench " * 200, created=now - datetime.timedelta(seconds=random.randint(0, 86400 * 365))
+            ))
+            if len(batch) >= 1000:
+                Article.objects.using(using).bulk_create(batch)
+                batch = []
+        Article.objects.using(using).bulk_create(batch)
+        article = Article.objects.using(using).filter(category=category).first()
+        Comment.objects.using(using).bulk_create(
+            [Comment(article=article, user=author, content="bench") for _ in range(comments)])
+        self.stdout.write("已生成文章%d篇，评论%d条" % (rows, comments))
+        return author, category, article
+
+    def report(self, title, queries, runs):
+        self.stdout.write("==== %s ====" % title)
+        for name, build in queries.items():
+            self.stdout.write("-- %s" % name)
+            self.stdout.write(build().explain())
+            costs = []
+            for _ in range(runs):
+                queryset = build()
+                start = time.perf_counter()
+                list(queryset)
+                costs.append((time.perf_counter() - start) * 1000)
+            costs.sort()
+            p50 = costs[len(costs) // 2]
+            p99 = costs[min(len(costs) - 1, int(len(costs) * 0.99))]
+            self.stdout.write("p50: %.3fms  p99: %.3fms" % (p50, p99))
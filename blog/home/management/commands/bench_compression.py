@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from home.fields import encode_text, decode_text
+from home.models import Article
+
+
+class Command(BaseCommand):
+    help = "统计文章正文压缩节省的存储空间，以及读取时的解码耗时"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=1000, help="参与统计的文章数量")
+        parser.add_argument("--runs", type=int, default=20, help="每篇文章解码的次数")
+
+    def handle(self, *args, **options):
+        # 读取数据库中的原始值，不经过字段解码
+        rows = list(Article.objects.order_by("-id").values_list("content", flat=True)[:options["limit"]])
+        if not rows:
+            self.stdout.write("没有文章")
+            return
+        texts = [decode_text(raw) for raw in rows]
+        plain_bytes = sum(len(text.encode("utf-8")) for text in texts)
+        stored_bytes = sum(len(raw) for raw in rows)
+        compressed = sum(1 for raw in rows if bytes(raw[:1]) == b"\x01")
+        self.stdout.write("文章数：%d，其中压缩存储：%d" % (len(rows), compressed))
+        self.stdout.write("原文：%d字节  存储：%d字节  节省：%.1f%%" % (
+            plain_bytes, stored_bytes, (1 - stored_bytes / plain_bytes) * 100 if plain_bytes else 0))
+
+        start = time.perf_counter()
+        encoded = [encode_text(text) for text in texts]
+        self.stdout.write("编码耗时：%.3fms/篇" % ((time.perf_counter() - start) * 1000 / len(texts)))
+        costs = []
+        for value in encoded:
+            start = time.perf_counter()
+            for _ in range(options["runs"]):
+                decode_text(value)
+            costs.append((time.perf_counter() - start) * 1000 / options["runs"])
+        costs.sort()
+        p50 = costs[len(costs) // 2]
+        p99 = costs[min(len(costs) - 1, int(len(costs) * 0.99))]
+        self.stdout.write("解码耗时 p50: %.3fms  p99: %.3fms" % (p50, p99))
@@ -0,0 +1,88 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from home.search import SearchIndex, article_terms
+from home.tokenizers import tokenize
+
+BENCH_PREFIX = "search:bench"
+# 常用汉字和英文技术词汇，用于生成测试文章
+CHINESE = "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些然前外天政四日那社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没结解问意建月公无系军很情者最立代想已通并提直题党程展五果料象员革位入常文总次品式活设及管特件长求老头基资边流路级少图山统接知较将组见计别她手角期根论运农指几九区强放决西被干做必战先回则任取据处理府研质"
+ENGLISH = ["python", "django", "redis", "mysql", "cache", "index", "query", "numpy", "docker", "nginx",
+           "linux", "git", "http", "api", "orm", "celery", "vue", "javascript", "css", "html"]
+
+
+class Command(BaseCommand):
+    help = "生成测试文章写入独立的索引，统计建索引耗时、内存占用和检索耗时"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--docs", type=int, default=100000, help="生成的文章数量")
+        parser.add_argument("--length", type=int, default=300, help="每篇文章正文的平均字数")
+        parser.add_argument("--queries", type=int, default=200, help="每类查询执行的次数")
+        parser.add_argument("--keep", action="store_true", help="保留生成的测试索引")
+
+    def handle(self, *args, **options):
+        index = SearchIndex(BENCH_PREFIX)
+        index.clear()
+        redis_conn = index.redis
+        memory_before = redis_conn.info("memory")["used_memory"]
+        start = time.perf_counter()
+        batch = []
+        for id in range(1, options["docs"] + 1):
+            batch.append((id, article_terms(self.document(options["length"]))))
+            if len(batch) >= 500:
+                index.index_many(batch)
+                batch = []
+        if batch:
+            index.index_many(batch)
+        cost = time.perf_counter() - start
+        memory = redis_conn.info("memory")["used_memory"] - memory_before
+        self.stdout.write("文章数：%d  建索引耗时：%.1fs  索引内存：%.1fMB" % (
+            options["docs"], cost, memory / 1024 / 1024))
+        try:
+            queries = {
+                "单个词": lambda: random.choice(ENGLISH),
+                "两个汉字": lambda: self.words(2),
+                "短句": lambda: self.words(6) + " " + random.choice(ENGLISH),
+            }
+            for name, build in queries.items():
+                costs = []
+                hits = 0
+                for _ in range(options["queries"]):
+                    query = build()
+                    start = time.perf_counter()
+                    hits += len(index.search(query, 10))
+                    costs.append((time.perf_counter() - start) * 1000)
+                costs.sort()
+                p50 = costs[len(costs) // 2]
+                p99 = costs[min(len(costs) - 1, int(len(costs) * 0.99))]
+                self.stdout.write("%s  词数：%d  p50: %.3fms  p99: %.3fms  平均结果数：%.1f" % (
+                    name, len(tokenize(build())), p50, p99, hits / options["queries"]))
+        finally:
+            if not options["keep"]:
+                index.clear()
+
+    def words(self, count):
+        return "".join(random.choice(CHINESE) for _ in range(count))
+
+    def document(self, length):
+        """生成一篇由随机汉字和英文单词组成的测试文章"""
+        parts = []
+        size = 0
+        target = random.randint(length // 2, length * 3 // 2)
+        while size < target:
+            if random.random() < 0.1:
+                parts.append(" %s " % random.choice(ENGLISH))
+            else:
+                parts.append(self.words(random.randint(2, 8)))
+            size += len(parts[-1])
+        return BenchDocument(self.words(12), self.words(30), "<p>%s</p>" % "".join(parts))
+
+
+class BenchDocument:
+    """与Article具有相同检索字段的测试文章"""
+    def __init__(self, title, sumary, content):
+        self.title = title
+        self.sumary = sumary
+        self.content = content
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from home import fragment_cache, object_cache
+
+
+class Command(BaseCommand):
+    help = "查看片段缓存和文章对象缓存的命中统计(各进程每10秒汇总一次)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reset", action="store_true", help="查看后清空统计")
+
+    def handle(self, *args, **options):
+        self.report("片段缓存", fragment_cache.counter, ("hit", "miss", "rebuild", "stale"), ("hit", "stale"))
+        self.report("文章对象缓存", object_cache.counter, ("local_hit", "redis_hit", "miss"), ("local_hit", "redis_hit"))
+        if options["reset"]:
+            fragment_cache.counter.reset()
+            object_cache.counter.reset()
+
+    def report(self, title, counter, events, hits):
+        result = counter.totals()
+        self.stdout.write("==== %s ====" % title)
+        for name in events:
+            self.stdout.write("%s: %d" % (name, result.get(name, 0)))
+        total = sum(result.values())
+        if total:
+            self.stdout.write("命中率: %.2f%%" % (sum(result.get(name, 0) for name in hits) * 100.0 / total))
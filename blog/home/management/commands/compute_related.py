@@ -0,0 +1,25 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from home.related import compute_related, compute_related_incremental
+
+
+class Command(BaseCommand):
+    help = "根据TF-IDF余弦相似度计算每篇文章的相关文章，建议每天全量计算一次，每10分钟增量计算一次"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=settings.RELATED_CHUNK_SIZE,
+                            help="每批计算的文章数量")
+        parser.add_argument("--incremental", action="store_true",
+                            help="只计算上次计算之后新增的文章")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        if options["incremental"]:
+            count = compute_related_incremental(options["batch_size"])
+            self.stdout.write("增量计算完成，新文章数：%d，耗时：%.1fs" % (count, time.perf_counter() - start))
+        else:
+            count = compute_related(options["batch_size"])
+            self.stdout.write("全量计算完成，文章数：%d，耗时：%.1fs" % (count, time.perf_counter() - start))
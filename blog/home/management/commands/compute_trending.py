@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from home.trending import compute_trending
+
+
+class Command(BaseCommand):
+    help = "计算带时间衰减的文章趋势分数，发布每个分类的趋势排行，建议通过crontab每10分钟执行一次"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=settings.TRENDING_BATCH_SIZE,
+                            help="每批计算的文章数量")
+        parser.add_argument("--top", type=int, default=settings.TRENDING_TOP_N,
+                            help="每个分类发布的文章数量")
+
+    def handle(self, *args, **options):
+        count = compute_trending(options["batch_size"], options["top"])
+        self.stdout.write("趋势排行已发布，分类数：%d" % count)
@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from home.counters import flush_views
+
+
+class Command(BaseCommand):
+    help = "将redis中累计的文章浏览量批量写回数据库，建议通过crontab每分钟执行一次"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=settings.ARTICLE_VIEWS_FLUSH_BATCH,
+                            help="每条UPDATE语句更新的文章数量")
+
+    def handle(self, *args, **options):
+        total = flush_views(options["batch_size"])
+        self.stdout.write("写回浏览量：%d" % total)
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from home.leaderboard import rebuild_hot_articles
+
+
+class Command(BaseCommand):
+    help = "根据数据库中的文章浏览量重建redis中的热门文章排行"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000,
+                            help="每次写入redis的文章数量")
+
+    def handle(self, *args, **options):
+        count = rebuild_hot_articles(options["batch_size"])
+        self.stdout.write("热门文章排行已重建，文章数：%d" % count)
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from home.models import Article
+from home.search import search_index, article_terms
+
+
+class Command(BaseCommand):
+    help = "根据数据库中的文章重建redis中的全文检索索引"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=200, help="每批处理的文章数量")
+
+    def handle(self, *args, **options):
+        search_index.clear()
+        queryset = Article.objects.only("id", "title", "sumary", "content").order_by("id")
+        last_id = 0
+        total = 0
+        while True:
+            # 按主键范围分批，避免一次性加载全部正文
+            batch = list(queryset.filter(id__gt=last_id)[:options["batch_size"]])
+            if not batch:
+                break
+            search_index.index_many([(article.id, article_terms(article)) for article in batch])
+            last_id = batch[-1].id
+            total += len(batch)
+        self.stdout.write("全文检索索引已重建，文章数：%d" % total)
@@ -0,0 +1,32 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from home.models import Article
+from home.suggest import rebuild_suggestions, suggest
+
+
+class Command(BaseCommand):
+    help = "根据数据库中的文章标题重建redis中的自动补全索引"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="每次写入redis的文章数量")
+        parser.add_argument("--bench", type=int, default=0, help="重建后用随机标题前缀测试补全的次数")
+
+    def handle(self, *args, **options):
+        count = rebuild_suggestions(Article.objects.order_by("id"), options["batch_size"])
+        self.stdout.write("自动补全索引已重建，文章数：%d" % count)
+        if options["bench"] and count:
+            titles = list(Article.objects.order_by("?").values_list("title", flat=True)[:1000])
+            costs = []
+            for _ in range(options["bench"]):
+                title = random.choice(titles)
+                prefix = title[:random.randint(1, min(len(title), 4))]
+                start = time.perf_counter()
+                suggest(prefix)
+                costs.append((time.perf_counter() - start) * 1000)
+            costs.sort()
+            p50 = costs[len(costs) // 2]
+            p99 = costs[min(len(costs) - 1, int(len(costs) * 0.99))]
+            self.stdout.write("补全耗时 p50: %.3fms  p99: %.3fms" % (p50, p99))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from home.models import ArticleCategory, Article, ArticleTag
+
+
+class Command(BaseCommand):
+    help = "重新统计每个分类和标签的文章数量，修正article_count字段的偏差"
+
+    def handle(self, *args, **options):
+        actual = dict(Article.objects.filter(category__isnull=False).order_by()
+                      .values_list("category_id").annotate(total=Count("id")))
+        fixed = 0
+        for id, title, article_count in ArticleCategory.objects.values_list("id", "title", "article_count"):
+            total = actual.get(id, 0)
+            if total != article_count:
+                ArticleCategory.objects.filter(id=id).update(article_count=total)
+                self.stdout.write("分类[%s]文章数量 %d -> %d" % (title, article_count, total))
+                fixed += 1
+        self.stdout.write("已修正分类数：%d" % fixed)
+
+        actual = dict(Article.tag_set.through.objects.order_by()
+                      .values_list("articletag_id").annotate(total=Count("id")))
+        fixed = 0
+        for id, name, article_count in ArticleTag.objects.values_list("id", "name", "article_count"):
+            total = actual.get(id, 0)
+            if total != article_count:
+                ArticleTag.objects.filter(id=id).update(article_count=total)
+                self.stdout.write("标签[%s]文章数量 %d -> %d" % (name, article_count, total))
+                fixed += 1
+        self.stdout.write("已修正标签数：%d" % fixed)
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from home.models import Article
+from home.object_cache import invalidate_articles
+from home.page_cache import purge_tags, article_tag
+from home.render import render_content
+
+
+class Command(BaseCommand):
+    help = "按id分批预渲染已有文章的正文，写入content_html字段"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=200, help="每批处理的文章数量")
+        parser.add_argument("--all", action="store_true", help="重新渲染所有文章，默认只处理未渲染的文章")
+
+    def handle(self, *args, **options):
+        queryset = Article.objects.only("id", "content").order_by("id")
+        if not options["all"]:
+            queryset = queryset.filter(content_html="")
+        last_id = 0
+        total = 0
+        while True:
+            # 按主键范围分批，避免OFFSET和一次性加载全部正文
+            batch = list(queryset.filter(id__gt=last_id)[:options["batch_size"]])
+            if not batch:
+                break
+            for article in batch:
+                article.content_html = render_content(article.content)
+            Article.objects.bulk_update(batch, ["content_html"])
+            ids = [article.id for article in batch]
+            invalidate_articles(*ids)
+            purge_tags(*[article_tag(id) for id in ids])
+            last_id = ids[-1]
+            total += len(batch)
+            self.stdout.write("已渲染%d篇文章" % total)
+        self.stdout.write("渲染完成，共%d篇文章" % total)
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from home.counters import rollup_unique_views
+
+
+class Command(BaseCommand):
+    help = "汇总redis中按天统计的文章独立访客并写入数据库，建议通过crontab每小时执行一次"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=3,
+                            help="汇总最近几天的访客数据")
+        parser.add_argument("--batch-size", type=int, default=settings.ARTICLE_VIEWS_FLUSH_BATCH,
+                            help="每条UPDATE语句更新的文章数量")
+
+    def handle(self, *args, **options):
+        count = rollup_unique_views(options["days"], options["batch_size"])
+        self.stdout.write("独立访客已汇总，文章数：%d" % count)
@@ -0,0 +1,18 @@
+# Generated by Django 2.2 on 2026-10-18 19:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0003_comment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='unique_views',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
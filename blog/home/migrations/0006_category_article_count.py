@@ -0,0 +1,29 @@
+# Generated by Django 2.2 on 2026-10-18 20:05
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def init_article_count(apps, schema_editor):
+    """根据已有文章初始化分类的文章数量"""
+    ArticleCategory = apps.get_model('home', 'ArticleCategory')
+    Article = apps.get_model('home', 'Article')
+    counts = Article.objects.filter(category__isnull=False).order_by().values('category_id').annotate(total=Count('id'))
+    for row in counts:
+        ArticleCategory.objects.filter(id=row['category_id']).update(article_count=row['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0005_article_comment_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='articlecategory',
+            name='article_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(init_article_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 2.2 on 2026-10-18 21:40
+
+from django.db import migrations
+import home.fields
+
+FIELDS = ('content', 'content_html')
+BATCH_SIZE = 500
+
+
+def convert_rows(apps, convert):
+    """按主键分批读取文章正文的原始值，转换后逐行写回"""
+    Article = apps.get_model('home', 'Article')
+    last_id = 0
+    while True:
+        rows = list(Article.objects.filter(id__gt=last_id).order_by('id')
+                    .values_list('id', *FIELDS)[:BATCH_SIZE])
+        if not rows:
+            break
+        for row in rows:
+            values = {}
+            for name, value in zip(FIELDS, row[1:]):
+                value = convert(value) if value is not None else None
+                if value is not None:
+                    values[name] = value
+            if values:
+                Article.objects.filter(id=row[0]).update(**values)
+        last_id = rows[-1][0]
+
+
+def compress_content(apps, schema_editor):
+    """将转换列类型后的旧文本按需压缩，并加上标记字节"""
+    def convert(value):
+        if home.fields.is_encoded(value):
+            return None
+        return home.fields.decode_text(value)
+    convert_rows(apps, convert)
+
+
+def decompress_content(apps, schema_editor):
+    """回滚前将正文还原为不带标记字节的utf-8文本"""
+    def convert(value):
+        if not home.fields.is_encoded(value):
+            return None
+        return home.fields.decode_text(value).encode('utf-8')
+    convert_rows(apps, convert)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0007_article_content_html'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='article',
+            name='content',
+            field=home.fields.CompressedTextField(),
+        ),
+        migrations.AlterField(
+            model_name='article',
+            name='content_html',
+            field=home.fields.CompressedTextField(blank=True, default=''),
+        ),
+        migrations.RunPython(compress_content, decompress_content),
+    ]
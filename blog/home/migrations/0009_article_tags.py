@@ -0,0 +1,80 @@
+# Generated by Django 2.2 on 2026-10-18 22:10
+
+import re
+
+from django.db import migrations, models
+from django.db.models import Count
+import django.utils.timezone
+
+BATCH_SIZE = 500
+
+
+def split_existing_tags(apps, schema_editor):
+    """将文章已有的标签字符串拆分写入标签表和索引表，并统计每个标签的文章数量"""
+    Article = apps.get_model('home', 'Article')
+    ArticleTag = apps.get_model('home', 'ArticleTag')
+    Through = Article.tag_set.through
+    tag_ids = {}
+    last_id = 0
+    while True:
+        rows = list(Article.objects.filter(id__gt=last_id).exclude(tags='').order_by('id')
+                    .values_list('id', 'tags')[:BATCH_SIZE])
+        if not rows:
+            break
+        links = []
+        for article_id, tags in rows:
+            names = []
+            for name in re.split(r'[,，;；、\s]+', tags):
+                name = name.strip()[:20]
+                if name and name.lower() not in [n.lower() for n in names]:
+                    names.append(name)
+            for name in names:
+                key = name.lower()
+                if key not in tag_ids:
+                    tag_ids[key] = ArticleTag.objects.get_or_create(name=name)[0].id
+                links.append(Through(article_id=article_id, articletag_id=tag_ids[key]))
+            Article.objects.filter(id=article_id).update(tags=','.join(names))
+        Through.objects.bulk_create(links, ignore_conflicts=True)
+        last_id = rows[-1][0]
+    counts = Through.objects.order_by().values('articletag_id').annotate(total=Count('id'))
+    for row in counts:
+        ArticleTag.objects.filter(id=row['articletag_id']).update(article_count=row['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0008_compress_article_content'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArticleTag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=20, unique=True)),
+                ('article_count', models.PositiveIntegerField(default=0)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': '标签管理',
+                'verbose_name_plural': '标签管理',
+                'db_table': 'tb_tag',
+            },
+        ),
+        migrations.AlterField(
+            model_name='article',
+            name='tags',
+            field=models.CharField(blank=True, max_length=120),
+        ),
+        migrations.AddIndex(
+            model_name='articletag',
+            index=models.Index(fields=['article_count'], name='tag_article_count_idx'),
+        ),
+        migrations.AddField(
+            model_name='article',
+            name='tag_set',
+            field=models.ManyToManyField(blank=True, db_table='tb_article_tag', related_name='articles', to='home.ArticleTag'),
+        ),
+        migrations.RunPython(split_existing_tags, migrations.RunPython.noop),
+    ]
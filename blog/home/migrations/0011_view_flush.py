@@ -0,0 +1,27 @@
+# Generated by Django 2.2 on 2026-10-18 23:40
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0010_related_article'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ViewFlush',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('flush_id', models.CharField(max_length=32, unique=True)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': '浏览量写回记录',
+                'verbose_name_plural': '浏览量写回记录',
+                'db_table': 'tb_view_flush',
+            },
+        ),
+    ]
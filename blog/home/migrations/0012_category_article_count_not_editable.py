@@ -0,0 +1,18 @@
+# Generated by Django 2.2 on 2026-10-18 23:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0011_view_flush'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='articlecategory',
+            name='article_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -2,6 +2,8 @@ from django.db import models
 from django.utils import timezone
 from users.models import User
 
+from home.fields import CompressedTextField
+
 
 class ArticleCategory(models.Model):
     """文章分类"""
@@ -9,6 +11,9 @@ class ArticleCategory(models.Model):
     title = models.CharField(max_length=100, blank=True)
     # 创建时间
     created = models.DateTimeField(default=timezone.now)
+    # 分类下的文章数量，文章新增、删除、修改分类时更新，避免列表分页时COUNT(*)
+    # 不允许在后台编辑，后台保存分类时不能用表单中的旧值覆盖
+    article_count = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.title
@@ -19,6 +24,34 @@ class ArticleCategory(models.Model):
         verbose_name_plural = verbose_name
 
 
+class ArticleTag(models.Model):
+    """文章标签"""
+    # 标签名称
+    name = models.CharField(max_length=20, unique=True)
+    # 标签下的文章数量，设置文章标签和删除文章时更新，用于标签云和标签列表分页
+    article_count = models.PositiveIntegerField(default=0)
+    # 创建时间
+    created = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        db_table = "tb_tag"
+        verbose_name = "标签管理"
+        verbose_name_plural = verbose_name
+        # 标签云按文章数量排序
+        indexes = [
+            models.Index(fields=["article_count"], name="tag_article_count_idx"),
+        ]
+
+
+class ArticleQuerySet(models.QuerySet):
+    def listing(self):
+        """文章列表使用的查询：关联查询分类，不加载正文"""
+        return self.select_related("category").defer("content", "content_html")
+
+
 class Article(models.Model):
     """文章"""
     # 定义文章作者author,author通过models.ForeignKey外键与内建的User模型关联在一起
@@ -28,16 +61,22 @@ class Article(models.Model):
     avatar = models.ImageField(upload_to="article/%Y%m%d", blank=True)
     # 文章栏目的“一对多”外键
     category = models.ForeignKey(ArticleCategory, null=True, blank=True, on_delete=models.CASCADE, related_name="article")
-    # 文章标签
-    tags = models.CharField(max_length=20, blank=True)
+    # 文章标签，逗号分隔的标签名称，用于列表页直接展示
+    tags = models.CharField(max_length=120, blank=True)
+    # 文章标签的多对多索引表，按标签浏览文章时使用
+    tag_set = models.ManyToManyField(ArticleTag, blank=True, related_name="articles", db_table="tb_article_tag")
     # 文章标题
     title = models.CharField(max_length=100, null=False, blank=False)
     # 概要
     sumary = models.CharField(max_length=200, null=False, blank=False)
-    # 文章正文
-    content = models.TextField()
+    # 文章正文，较长时压缩存储
+    content = CompressedTextField()
+    # 过滤并高亮后的文章正文，保存文章时生成，详情页直接输出
+    content_html = CompressedTextField(blank=True, default="")
     # 浏览量
     total_views = models.PositiveIntegerField(default=0)
+    # 独立访客数，由redis中的HyperLogLog定时汇总写入
+    unique_views = models.PositiveIntegerField(default=0)
     # 文章评论数 PositiveIntegerField-正整数
     comments_count = models.PositiveIntegerField(default=0)
     # 文章创建时间 参数default=timezone.now 指定其在创建数据时将默认写入当前时间
@@ -45,6 +84,8 @@ class Article(models.Model):
     # 文章更新时间 参数auto_now=True 指定每次数据更新时自动写入当前时间
     updated = models.DateTimeField(auto_now=True)
 
+    objects = ArticleQuerySet.as_manager()
+
     # 内部类class Meta 用于给model定义元数据
     class Meta:
         # ordering 指定模型返回的数据的排列顺序 -created 表明数据应该以创建时间倒序排列
@@ -52,12 +93,22 @@ class Article(models.Model):
         db_table = "tb_article"
         verbose_name = "文章管理"
         verbose_name_plural = verbose_name
+        # 分类文章列表、作者文章列表按创建时间排序的联合索引
+        indexes = [
+            models.Index(fields=["category", "created"], name="article_category_created_idx"),
+            models.Index(fields=["author", "created"], name="article_author_created_idx"),
+        ]
 
     # 函数__str__定义当调用对象的str()方法时的返回值内容，最常见的就是在Django管理后台中作为对象的显示值
     def __str__(self):
         # 将文章标题返回
         return self.title
 
+    @property
+    def tag_names(self):
+        """文章的标签名称列表"""
+        return [name for name in self.tags.split(",") if name]
+
 
 class Comment(models.Model):
     # 评论内容
@@ -77,40 +128,39 @@ class Comment(models.Model):
         db_table = "tb_comment"
         verbose_name = "评论管理"
         verbose_name_plural = verbose_name
+        # 文章评论列表按创建时间排序的联合索引
+        indexes = [
+            models.Index(fields=["article", "created"], name="comment_article_created_idx"),
+        ]
+
+
+class RelatedArticle(models.Model):
+    """相关文章，由compute_related命令根据TF-IDF余弦相似度离线计算"""
+    # 文章
+    article = models.ForeignKey(Article, on_delete=models.CASCADE, related_name="related_set")
+    # 相关的文章
+    related = models.ForeignKey(Article, on_delete=models.CASCADE, related_name="+")
+    # 余弦相似度
+    score = models.FloatField()
+    # 排名，从0开始
+    rank = models.PositiveSmallIntegerField()
 
+    class Meta:
+        db_table = "tb_related_article"
+        verbose_name = "相关文章"
+        verbose_name_plural = verbose_name
+        # 详情页按文章id和排名查询相关文章
+        unique_together = (("article", "rank"),)
 
 
+class ViewFlush(models.Model):
+    """已写回数据库的浏览量批次，与浏览量在同一个事务中写入，重复写回同一批次时跳过，见home.counters"""
+    # 批次id
+    flush_id = models.CharField(max_length=32, unique=True)
+    # 写回时间
+    created = models.DateTimeField(default=timezone.now)
 
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+    class Meta:
+        db_table = "tb_view_flush"
+        verbose_name = "浏览量写回记录"
+        verbose_name_plural = verbose_name
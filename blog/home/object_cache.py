@@ -0,0 +1,199 @@
+"""文章对象的两级缓存
+
+详情页每次请求都要按id查询文章。这里在默认的redis缓存前面再加一层进程内LRU缓存：
+进程内缓存 -> redis缓存 -> 数据库，逐级读取并回填。
+进程内缓存保存pickle后的字节，按条目数和总字节数限制内存占用，每次读取都返回新的对象。
+作者只缓存页面用到的id和用户名，密码哈希等其他字段不会写入redis和进程内缓存。
+文章修改后通过redis的发布订阅通知所有进程删除本地缓存。
+读取redis或数据库之后、写入本地缓存之前收到的失效通知会使这次写入作废，
+本地缓存的条目另有较短的有效时间，漏掉的通知或redis中的旧数据最多影响这段时间。
+浏览量写回数据库时不清除缓存，文章对象的flushed_views记录缓存时累计已写回的浏览量，
+详情页据此补上缓存之后写回的浏览量，见home.counters。
+"""
+from collections import OrderedDict
+import logging
+import pickle
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django_redis import get_redis_connection
+
+from home.counters import flushed_views_checkpoint
+from home.models import Article
+from home.stats import StatsCounter
+from users.models import User
+
+logger = logging.getLogger("django")
+
+# redis中缓存的文章对象
+ARTICLE_KEY = "article:obj:%s"
+# 文章缓存失效通知频道，消息内容为逗号分隔的文章id
+INVALIDATE_CHANNEL = "article:obj:invalidate"
+# 缓存的作者字段
+AUTHOR_FIELDS = ("id", "username")
+
+# 进程内命中(local_hit)、redis命中(redis_hit)、查询数据库(miss)的次数
+counter = StatsCounter("article:obj:stats")
+
+
+class LRUCache:
+    """按条目数和总字节数限制大小的进程内LRU缓存，值为bytes，条目在timeout秒后过期"""
+    def __init__(self, max_entries, max_bytes, timeout):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.size = 0
+        # 删除或清空的次数，见version
+        self._version = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= time.monotonic():
+                # 过期的条目按未命中处理
+                self._pop(key)
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def version(self):
+        """当前的版本号，读取redis或数据库之前获取，写入时传给set"""
+        return self._version
+
+    def set(self, key, value, version=None):
+        """写入缓存，version之后有过删除或清空时不写入，避免写入删除之前读到的旧数据"""
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if version is not None and version != self._version:
+                return
+            self._pop(key)
+            self._data[key] = (time.monotonic() + self.timeout, value)
+            self.size += len(value)
+            # 超出条目数或总字节数时淘汰最久未使用的条目
+            while len(self._data) > self.max_entries or self.size > self.max_bytes:
+                _, (_, evicted) = self._data.popitem(last=False)
+                self.size -= len(evicted)
+
+    def delete(self, key):
+        with self._lock:
+            self._version += 1
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._version += 1
+            self._data.clear()
+            self.size = 0
+
+    def _pop(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+
+    def __len__(self):
+        return len(self._data)
+
+
+_local = LRUCache(settings.ARTICLE_CACHE_MAX_ENTRIES, settings.ARTICLE_CACHE_MAX_BYTES,
+                  min(settings.ARTICLE_LOCAL_CACHE_TIMEOUT, settings.ARTICLE_CACHE_TIMEOUT))
+_subscriber = None
+_subscriber_lock = threading.Lock()
+
+
+def _listen():
+    """订阅失效通知，删除本地缓存的文章；连接断开后清空本地缓存并重新订阅"""
+    while True:
+        try:
+            pubsub = get_redis_connection("default").pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(INVALIDATE_CHANNEL)
+            # 断线期间可能错过通知，重新订阅后清空本地缓存
+            _local.clear()
+            for message in pubsub.listen():
+                for id in message["data"].decode().split(","):
+                    _local.delete(int(id))
+        except Exception as e:
+            logger.error(e)
+            time.sleep(1)
+
+
+def _ensure_subscriber():
+    """在当前进程中启动订阅线程"""
+    global _subscriber
+    if _subscriber is not None and _subscriber.is_alive():
+        return
+    with _subscriber_lock:
+        if _subscriber is None or not _subscriber.is_alive():
+            _subscriber = threading.Thread(target=_listen, name="article-cache-invalidation", daemon=True)
+            _subscriber.start()
+
+
+def get_article(id):
+    """按id获取文章(含作者和分类)，文章不存在时抛出Article.DoesNotExist"""
+    id = int(id)
+    _ensure_subscriber()
+    data = _local.get(id)
+    if data is not None:
+        counter.incr("local_hit")
+    else:
+        # 之后收到的失效通知会使写入本地缓存作废
+        version = _local.version()
+        key = ARTICLE_KEY % id
+        try:
+            data = cache.get(key)
+        except Exception as e:
+            logger.error(e)
+        if data is not None:
+            counter.incr("redis_hit")
+        else:
+            counter.incr("miss")
+            article, cacheable = load_article(id)
+            data = pickle.dumps(article, pickle.HIGHEST_PROTOCOL)
+            if not cacheable:
+                return article
+            try:
+                cache.set(key, data, settings.ARTICLE_CACHE_TIMEOUT)
+            except Exception as e:
+                logger.error(e)
+        _local.set(id, data, version)
+    return pickle.loads(data)
+
+
+def load_article(id):
+    """从数据库查询文章，返回(文章, 是否可以缓存)
+
+    查询期间有浏览量写回时，无法确定读到的浏览量是否包含这次写回的部分，结果不缓存
+    """
+    before = flushed_views_checkpoint(id)
+    article = Article.objects.select_related("author", "category")\
+        .defer(*["author__" + field.name for field in User._meta.concrete_fields
+                 if field.name not in AUTHOR_FIELDS])\
+        .get(id=id)
+    after = flushed_views_checkpoint(id)
+    article.flushed_views = after[0] if after else 0
+    return article, after is not None and after == before and not after[1]
+
+
+def invalidate_articles(*ids):
+    """删除文章的缓存，并通知所有进程删除本地缓存"""
+    if not ids:
+        return
+    for id in ids:
+        _local.delete(int(id))
+    try:
+        cache.delete_many([ARTICLE_KEY % id for id in ids])
+        get_redis_connection("default").publish(INVALIDATE_CHANNEL, ",".join(str(id) for id in ids))
+    except Exception as e:
+        logger.error(e)
+
+
+def local_stats():
+    """当前进程本地缓存的占用情况"""
+    return {"entries": len(_local), "bytes": _local.size}
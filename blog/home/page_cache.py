@@ -0,0 +1,134 @@
+"""匿名用户的整页缓存
+
+首页和详情页的大部分访问来自未登录用户，页面按路径和规范化后的查询参数缓存在默认的redis缓存中。
+每个缓存页面记录其依赖的标签(文章、分类)，文章或评论写入时按标签精确清除受影响的页面，
+超时时间只作为兜底。
+"""
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django_redis import get_redis_connection
+
+from home.pagination import parse_positive_int
+
+logger = logging.getLogger("django")
+
+# 参与缓存key计算的查询参数，带有其他参数的请求不使用缓存
+CACHE_PARAMS = ("cat_id", "tag", "page_num", "page_size", "id")
+# 标识对象的整数参数，非法时视图返回404，请求不使用缓存
+ID_PARAMS = ("cat_id", "id")
+# 分页参数，非法时视图使用默认值，与不传参数使用同一个缓存
+PAGE_PARAMS = ("page_num", "page_size")
+# 随页面一起缓存的响应头
+CACHED_HEADERS = ("ETag", "Last-Modified", "Cache-Control", "Vary")
+# 缓存页面 page:<path>?<query>
+PAGE_KEY = "page:%s?%s"
+# 依赖某个标签的缓存页面集合
+TAG_KEY = "page:tag:%s"
+
+
+def article_tag(article_id):
+    return "article:%s" % article_id
+
+
+def category_tag(category_id):
+    return "category:%s" % category_id
+
+
+def tag_tag(tag_id):
+    """文章标签列表页的缓存标签"""
+    return "tag:%s" % tag_id
+
+
+def page_key(request):
+    """计算请求的缓存key，请求不可缓存时返回None"""
+    if request.method != "GET" or request.user.is_authenticated:
+        return None
+    if any(name not in CACHE_PARAMS for name in request.GET):
+        return None
+    # 规范化参数值，page=1、page=01、page=abc等写法不会各自生成一个缓存
+    params = []
+    for name in CACHE_PARAMS:
+        value = request.GET.get(name, "").strip()
+        if not value:
+            continue
+        if name in ID_PARAMS or name in PAGE_PARAMS:
+            maximum = settings.ARTICLE_PAGE_SIZE_MAX if name == "page_size" else None
+            value = parse_positive_int(value, 0, maximum)
+            if not value:
+                if name in ID_PARAMS:
+                    return None
+                continue
+        params.append("%s=%s" % (name, value))
+    return PAGE_KEY % (request.path, "&".join(params))
+
+
+def get_cached_page(request):
+    """获取缓存的页面，没有缓存时返回None"""
+    key = page_key(request)
+    if key is None:
+        return None
+    try:
+        cached = cache.get(key)
+    except Exception as e:
+        logger.error(e)
+        return None
+    if not isinstance(cached, dict):
+        return None
+    response = HttpResponse(cached["content"], content_type=cached["content_type"])
+    for header, value in cached["headers"].items():
+        response[header] = value
+    return response
+
+
+def cache_page_response(request, response, tags):
+    """缓存页面，并记录页面依赖的标签
+
+    使用了CSRF令牌的页面不缓存，否则第一个访客的令牌会发给之后的所有访客。
+    """
+    key = page_key(request)
+    if key is None or response.status_code != 200 or request.META.get("CSRF_COOKIE_USED"):
+        return
+    timeout = settings.PAGE_CACHE_TIMEOUT
+    try:
+        cache.set(key, {
+            "content": response.content,
+            "content_type": response["Content-Type"],
+            # 保留条件请求使用的验证头
+            "headers": {header: response[header] for header in CACHED_HEADERS if response.has_header(header)},
+        }, timeout)
+        pipeline = get_redis_connection("default").pipeline()
+        for tag in tags:
+            pipeline.sadd(TAG_KEY % tag, key)
+            pipeline.expire(TAG_KEY % tag, timeout)
+        pipeline.execute()
+    except Exception as e:
+        logger.error(e)
+
+
+def purge_tags(*tags):
+    """清除依赖这些标签的所有缓存页面
+
+    在事务中调用时等到事务提交后再清除：提交前清除的页面可能被并发请求按旧数据重新缓存，
+    事务回滚时也不需要清除。不在事务中时立即清除。
+    """
+    transaction.on_commit(lambda: _purge_tags(tags))
+
+
+def _purge_tags(tags):
+    try:
+        redis_conn = get_redis_connection("default")
+        pipeline = redis_conn.pipeline()
+        for tag in tags:
+            pipeline.smembers(TAG_KEY % tag)
+            pipeline.delete(TAG_KEY % tag)
+        keys = set()
+        for members in pipeline.execute()[::2]:
+            keys.update(member.decode() for member in members)
+        if keys:
+            cache.delete_many(keys)
+    except Exception as e:
+        logger.error(e)
@@ -0,0 +1,86 @@
+"""文章列表分页工具
+
+offset分页(Paginator)每次都要执行COUNT(*)和OFFSET查询，页码越靠后越慢。
+这里提供基于(created, id)的游标分页(keyset pagination)，
+与Article.Meta.ordering保持一致，任意页都只需要一次走索引的范围查询。
+"""
+import base64
+import binascii
+
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+
+class InvalidCursor(ValueError):
+    """游标参数格式错误"""
+    pass
+
+
+class CountedPaginator(Paginator):
+    """使用已知数据总数的分页器，不再执行COUNT(*)"""
+    def __init__(self, object_list, per_page, count, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self._count = count
+
+    @cached_property
+    def count(self):
+        return self._count
+
+
+def parse_positive_int(value, default, maximum=None):
+    """将查询参数转换为正整数，非法时使用默认值，并限制最大值"""
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        value = default
+    if value < 1:
+        value = default
+    if maximum is not None:
+        value = min(value, maximum)
+    return value
+
+
+def encode_cursor(article):
+    """根据文章的(created, id)生成游标字符串"""
+    raw = "{}|{}".format(article.created.isoformat(), article.id)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """解析游标字符串，返回(created, id)"""
+    padding = "=" * (-len(cursor) % 4)
+    try:
+        raw = base64.urlsafe_b64decode(cursor + padding).decode()
+        created, id = raw.rsplit("|", 1)
+        created = parse_datetime(created)
+        id = int(id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor(cursor)
+    if created is None:
+        raise InvalidCursor(cursor)
+    return created, id
+
+
+def keyset_order(queryset):
+    """游标分页使用的排序：创建时间倒序，id作为相同时间的决胜字段"""
+    return queryset.order_by("-created", "-id")
+
+
+def keyset_page(queryset, cursor, page_size):
+    """获取游标之后的一页数据
+
+    :param queryset: 文章查询集
+    :param cursor: 上一页最后一条数据的游标，None表示从第一条开始
+    :param page_size: 每页条数
+    :return: (本页数据列表, 下一页游标)，没有下一页时游标为None
+    """
+    queryset = keyset_order(queryset)
+    if cursor:
+        created, id = decode_cursor(cursor)
+        queryset = queryset.filter(Q(created__lt=created) | Q(created=created, id__lt=id))
+    # 多取一条用于判断是否还有下一页
+    items = list(queryset[:page_size + 1])
+    next_cursor = encode_cursor(items[page_size - 1]) if len(items) > page_size else None
+    return items[:page_size], next_cursor
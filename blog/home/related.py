@@ -0,0 +1,234 @@
+"""相关文章的离线计算
+
+compute_related命令定时执行：
+1.第一遍按主键分批读取文章，统计每个词出现的文章数，得到词表和IDF；
+2.第二遍分批把文章转换为L2归一化的TF-IDF稀疏向量；
+3.每次取一批文章与全部文章做稀疏矩阵乘法得到余弦相似度，立即只保留每篇文章的前K篇。
+  乘积最多有 行数 × 文章数 个元素，每次乘法的行数按文章数计算，
+  乘积不超过settings.RELATED_PRODUCT_MAX_ENTRIES个元素，内存占用不随文章数增长。
+结果写入tb_related_article表，详情页按文章id一次查询。
+词表和IDF保存在redis中，增量模式只计算新文章的向量，流式地与已有文章比较，
+并把新文章插入到相似度足够高的已有文章的相关列表中。
+"""
+from collections import Counter
+import logging
+import pickle
+
+from django.conf import settings
+from django.db import transaction
+from django_redis import get_redis_connection
+import numpy as np
+from scipy import sparse
+
+from home.models import Article, RelatedArticle
+from home.search import article_terms
+
+logger = logging.getLogger("django")
+
+# 词表、IDF以及计算时最大的文章id
+RELATED_MODEL_KEY = "related:model"
+
+
+def iter_documents(queryset, batch_size):
+    """按主键分批读取文章，返回(文章id列表, 加权词频列表)"""
+    queryset = queryset.only("id", "title", "sumary", "content").order_by("id")
+    last_id = 0
+    while True:
+        batch = list(queryset.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            break
+        yield [article.id for article in batch], [article_terms(article) for article in batch]
+        last_id = batch[-1].id
+
+
+def build_vocabulary(queryset, batch_size):
+    """统计词出现的文章数，返回(词表{词: 列号}, IDF数组, 文章数, 最大文章id)"""
+    df = Counter()
+    docs = 0
+    max_id = 0
+    for ids, terms_list in iter_documents(queryset, batch_size):
+        for terms in terms_list:
+            df.update(terms.keys())
+        docs += len(ids)
+        max_id = ids[-1]
+    # 去掉只在极少数文章中出现的词和几乎所有文章都包含的词
+    max_df = max(settings.RELATED_MAX_DF * docs, settings.RELATED_MIN_DF)
+    candidates = [(term, count) for term, count in df.items() if settings.RELATED_MIN_DF <= count <= max_df]
+    candidates.sort(key=lambda item: -item[1])
+    candidates = candidates[:settings.RELATED_MAX_FEATURES]
+    vocabulary = {term: i for i, (term, _) in enumerate(candidates)}
+    counts = np.array([count for _, count in candidates], dtype=np.float64)
+    idf = (np.log((1 + docs) / (1 + counts)) + 1).astype(np.float32)
+    return vocabulary, idf, docs, max_id
+
+
+def vectorize(terms_list, vocabulary, idf):
+    """将文章的词频转换为L2归一化的TF-IDF稀疏矩阵，每行一篇文章"""
+    indptr = [0]
+    indices = []
+    data = []
+    for terms in terms_list:
+        for term, tf in terms.items():
+            column = vocabulary.get(term)
+            if column is not None:
+                indices.append(column)
+                # 词频取对数，避免长文章中的高频词权重过大
+                data.append(1 + np.log(tf))
+        indptr.append(len(indices))
+    matrix = sparse.csr_matrix((np.array(data, dtype=np.float32), indices, indptr),
+                               shape=(len(terms_list), len(vocabulary)), dtype=np.float32)
+    matrix = matrix.multiply(idf).tocsr()
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.diags(1 / norms).dot(matrix).tocsr().astype(np.float32)
+
+
+def product_rows(columns):
+    """与columns篇文章做矩阵乘法时每次的行数，乘积元素数不超过settings.RELATED_PRODUCT_MAX_ENTRIES"""
+    return max(1, settings.RELATED_PRODUCT_MAX_ENTRIES // max(columns, 1))
+
+
+def top_k(row_ids, row_scores, k, exclude=None):
+    """从一行相似度中取得分最高的k篇文章 [(文章id, 得分)]"""
+    mask = row_scores > 0
+    if exclude is not None:
+        mask &= row_ids != exclude
+    row_ids = row_ids[mask]
+    row_scores = row_scores[mask]
+    if len(row_scores) > k:
+        top = np.argpartition(-row_scores, k - 1)[:k]
+    else:
+        top = np.arange(len(row_scores))
+    top = top[np.argsort(-row_scores[top], kind="stable")]
+    return [(int(row_ids[i]), float(row_scores[i])) for i in top]
+
+
+def merge_top_k(current, candidates, k):
+    """合并两个相关文章列表，同一篇文章保留较高的得分"""
+    best = dict(current)
+    for id, score in candidates:
+        if score > best.get(id, 0):
+            best[id] = score
+    return sorted(best.items(), key=lambda item: -item[1])[:k]
+
+
+def save_related(neighbours):
+    """写入相关文章，替换这些文章原来的相关文章
+
+    :param neighbours: {文章id: [(相关文章id, 得分)]}
+    """
+    with transaction.atomic():
+        RelatedArticle.objects.filter(article_id__in=list(neighbours)).delete()
+        RelatedArticle.objects.bulk_create([
+            RelatedArticle(article_id=id, related_id=related_id, score=score, rank=rank)
+            for id, items in neighbours.items()
+            for rank, (related_id, score) in enumerate(items)
+        ])
+
+
+def save_model(vocabulary, idf, max_id):
+    get_redis_connection("default").set(RELATED_MODEL_KEY, pickle.dumps(
+        {"vocabulary": vocabulary, "idf": idf, "max_id": max_id}, pickle.HIGHEST_PROTOCOL))
+
+
+def load_model():
+    data = get_redis_connection("default").get(RELATED_MODEL_KEY)
+    return pickle.loads(data) if data else None
+
+
+def compute_related(batch_size=None):
+    """全量计算所有文章的相关文章
+
+    :return: 计算的文章数量
+    """
+    batch_size = batch_size or settings.RELATED_CHUNK_SIZE
+    k = settings.RELATED_TOP_K
+    queryset = Article.objects.all()
+    vocabulary, idf, docs, max_id = build_vocabulary(queryset, batch_size)
+    if not docs:
+        return 0
+    ids = []
+    blocks = []
+    for batch_ids, terms_list in iter_documents(queryset, batch_size):
+        ids.extend(batch_ids)
+        blocks.append(vectorize(terms_list, vocabulary, idf))
+    ids = np.array(ids, dtype=np.int64)
+    matrix = sparse.vstack(blocks).tocsr()
+    transposed = matrix.T.tocsc()
+    rows = min(batch_size, product_rows(len(ids)))
+    for start in range(0, len(ids), batch_size):
+        neighbours = {}
+        for row_start in range(start, min(start + batch_size, len(ids)), rows):
+            # 几行文章与全部文章的余弦相似度(稀疏矩阵)，每行立即只保留前K篇
+            scores = matrix[row_start:min(row_start + rows, start + batch_size)].dot(transposed).tocsr()
+            for i in range(scores.shape[0]):
+                row = slice(scores.indptr[i], scores.indptr[i + 1])
+                neighbours[int(ids[row_start + i])] = top_k(ids[scores.indices[row]], scores.data[row], k,
+                                                            exclude=ids[row_start + i])
+        save_related(neighbours)
+    save_model(vocabulary, idf, max_id)
+    return len(ids)
+
+
+def compute_related_incremental(batch_size=None):
+    """只计算上次计算之后新增文章的相关文章，并更新受影响的已有文章
+
+    没有保存的词表时执行全量计算。
+    :return: 计算的新文章数量
+    """
+    batch_size = batch_size or settings.RELATED_CHUNK_SIZE
+    k = settings.RELATED_TOP_K
+    model = load_model()
+    if model is None:
+        return compute_related(batch_size)
+    vocabulary, idf = model["vocabulary"], model["idf"]
+    new_ids = []
+    new_terms = []
+    for batch_ids, terms_list in iter_documents(Article.objects.filter(id__gt=model["max_id"]), batch_size):
+        new_ids.extend(batch_ids)
+        new_terms.extend(terms_list)
+    if not new_ids:
+        return 0
+    new_ids = np.array(new_ids, dtype=np.int64)
+    new_matrix = vectorize(new_terms, vocabulary, idf)
+    new_neighbours = {int(id): [] for id in new_ids}
+    # 已有文章中可能需要加入新文章的候选 {文章id: [(新文章id, 得分)]}
+    candidates = {}
+    # 流式读取全部文章(包含新文章)，与新文章计算相似度，乘积为 新文章数 × 每批文章数 的稠密矩阵
+    stream_size = min(batch_size, product_rows(len(new_ids)))
+    for batch_ids, terms_list in iter_documents(Article.objects.all(), stream_size):
+        batch_ids = np.array(batch_ids, dtype=np.int64)
+        scores = new_matrix.dot(vectorize(terms_list, vocabulary, idf).T).toarray()
+        for i, id in enumerate(new_ids):
+            new_neighbours[int(id)] = merge_top_k(
+                new_neighbours[int(id)], top_k(batch_ids, scores[i], k, exclude=id), k)
+        for j, id in enumerate(batch_ids):
+            if id > model["max_id"]:
+                continue
+            items = top_k(new_ids, scores[:, j], k)
+            if items:
+                candidates[int(id)] = items
+    save_related(new_neighbours)
+    # 新文章的得分超过已有文章当前相关列表中的得分时插入
+    affected = list(candidates)
+    for start in range(0, len(affected), batch_size):
+        chunk = affected[start:start + batch_size]
+        current = {id: [] for id in chunk}
+        for article_id, related_id, score in RelatedArticle.objects.filter(article_id__in=chunk)\
+                .order_by("article_id", "rank").values_list("article_id", "related_id", "score"):
+            current[article_id].append((related_id, score))
+        changed = {}
+        for id in chunk:
+            merged = merge_top_k(current[id], candidates[id], k)
+            if merged != current[id]:
+                changed[id] = merged
+        if changed:
+            save_related(changed)
+    save_model(vocabulary, idf, int(new_ids.max()))
+    return len(new_ids)
+
+
+def get_related_articles(article_id):
+    """获取文章的相关文章，只查询一次(按文章id和排名走索引，关联查询标题)"""
+    return [item.related for item in RelatedArticle.objects.filter(article_id=article_id)
+            .select_related("related").only("related", "related__title").order_by("rank")]
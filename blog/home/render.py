@@ -0,0 +1,158 @@
+"""文章正文的预渲染
+
+文章保存时对ckeditor提交的HTML做一次白名单过滤，并用pygments在服务端完成代码高亮，
+结果保存到Article.content_html中，详情页直接输出，浏览器不再需要加载Prism高亮代码。
+"""
+from html import escape
+from html.parser import HTMLParser
+import re
+
+from pygments import highlight
+from pygments.formatters import HtmlFormatter
+from pygments.lexers import get_lexer_by_name, TextLexer
+from pygments.util import ClassNotFound
+
+# 允许的标签及其属性
+ALLOWED_TAGS = {
+    "a": ("href", "title", "target"),
+    "abbr": ("title",),
+    "b": (), "blockquote": (), "br": (), "code": ("class",), "del": (), "div": ("style",),
+    "em": (), "h1": (), "h2": (), "h3": (), "h4": (), "h5": (), "h6": (), "hr": (), "i": (),
+    "img": ("src", "alt", "title", "width", "height", "style"),
+    "li": (), "ol": (), "p": ("style",), "pre": ("class",), "s": (), "span": ("style", "class"),
+    "strong": (), "sub": (), "sup": (), "u": (), "ul": (),
+    "table": ("border", "cellpadding", "cellspacing", "style"), "thead": (), "tbody": (),
+    "tr": (), "th": ("colspan", "rowspan", "style"), "td": ("colspan", "rowspan", "style"), "caption": (),
+}
+# 不输出标签内的任何内容
+DROP_CONTENT_TAGS = ("script", "style", "iframe", "object", "embed", "template", "svg", "math")
+# 自闭合标签
+VOID_TAGS = ("br", "hr", "img")
+# 链接只允许http(s)、mailto和站内相对地址
+SAFE_URL = re.compile(r"^(https?:|mailto:|/|#|[^:/?#]*(?:[/?#]|$))", re.I)
+# 内联样式只允许颜色、对齐等简单声明，不允许url()和expression()
+SAFE_STYLE = re.compile(r"^(\s*[a-z-]+\s*:\s*[#\w\s.,%()-]+;?)*\s*$", re.I)
+UNSAFE_STYLE = re.compile(r"url|expression", re.I)
+# 代码块的语言 class="language-python"
+LANGUAGE_CLASS = re.compile(r"\blanguage-([\w+#-]+)")
+
+FORMATTER = HtmlFormatter(nowrap=True)
+
+
+def highlight_code(code, language):
+    """使用pygments高亮代码，不认识的语言按纯文本输出"""
+    try:
+        lexer = get_lexer_by_name(language) if language else TextLexer()
+    except ClassNotFound:
+        lexer = TextLexer()
+    return highlight(code, lexer, FORMATTER)
+
+
+class ContentRenderer(HTMLParser):
+    """过滤不在白名单中的标签和属性，并高亮<pre><code>代码块"""
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.output = []
+        # 当前所在的需要丢弃内容的标签层数
+        self.dropping = 0
+        # 当前打开的白名单标签
+        self.open_tags = []
+        # 正在收集的代码块 (语言, 代码片段列表)
+        self.code = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROP_CONTENT_TAGS:
+            self.dropping += 1
+            return
+        if self.dropping or tag not in ALLOWED_TAGS:
+            return
+        if self.code is not None:
+            # 代码块中的标签按文本处理
+            return
+        if tag == "code" and self.open_tags and self.open_tags[-1] == "pre":
+            match = LANGUAGE_CLASS.search(dict(attrs).get("class") or "")
+            self.code = (match.group(1).lower() if match else None, [])
+            return
+        self.output.append(self.format_tag(tag, attrs))
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in DROP_CONTENT_TAGS:
+            # 自闭合的<svg/>等没有内容，不能进入丢弃状态，否则之后的正文全部丢失
+            return
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS and tag in ALLOWED_TAGS and not self.dropping and self.code is None:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in DROP_CONTENT_TAGS:
+            self.dropping = max(0, self.dropping - 1)
+            return
+        if self.dropping:
+            return
+        if self.code is not None:
+            if tag == "code":
+                language, parts = self.code
+                self.code = None
+                css_class = ' class="language-%s"' % language if language else ""
+                self.output.append("<code%s>%s</code>" % (css_class, highlight_code("".join(parts), language)))
+                # 外层<pre>使用pygments的样式
+                self.mark_highlighted_pre()
+            return
+        if tag not in self.open_tags:
+            return
+        # 关闭未闭合的内层标签
+        while self.open_tags:
+            current = self.open_tags.pop()
+            self.output.append("</%s>" % current)
+            if current == tag:
+                break
+
+    def handle_data(self, data):
+        if self.dropping:
+            return
+        if self.code is not None:
+            self.code[1].append(data)
+        else:
+            self.output.append(escape(data, quote=False))
+
+    def format_tag(self, tag, attrs):
+        allowed = ALLOWED_TAGS[tag]
+        parts = [tag]
+        for name, value in attrs:
+            if name not in allowed or value is None:
+                continue
+            if name in ("href", "src") and not SAFE_URL.match(value.strip()):
+                continue
+            if name == "style" and (not SAFE_STYLE.match(value) or UNSAFE_STYLE.search(value)):
+                continue
+            parts.append('%s="%s"' % (name, escape(value)))
+        if tag == "a" and "target" in dict(attrs):
+            parts.append('rel="noopener noreferrer"')
+        return "<%s>" % " ".join(parts)
+
+    def mark_highlighted_pre(self):
+        for i in range(len(self.output) - 1, -1, -1):
+            if self.output[i].startswith("<pre"):
+                self.output[i] = '<pre class="highlight">'
+                break
+
+    def render(self, html):
+        self.feed(html)
+        self.close()
+        if self.code is not None:
+            # 未闭合的代码块
+            language, parts = self.code
+            self.output.append("<code>%s</code>" % highlight_code("".join(parts), language))
+            self.code = None
+        while self.open_tags:
+            self.output.append("</%s>" % self.open_tags.pop())
+        return "".join(self.output)
+
+
+def render_content(html):
+    """过滤并高亮文章正文，返回可以直接输出的HTML"""
+    if not html:
+        return ""
+    return ContentRenderer().render(html)
@@ -0,0 +1,206 @@
+"""文章全文检索
+
+在redis中维护文章标题、摘要和正文的倒排索引，文章保存或删除时由信号增量更新：
+    search:term:<词>   hash {文章id: 加权词频}
+    search:doc:<id>    set  文章包含的词，用于更新或删除文章时清理倒排表
+    search:doclen      hash {文章id: 文章长度(加权词数)}
+    search:stats       hash {docs: 文章数, length: 总长度}
+检索时读取查询词的倒排表，用numpy按BM25计算得分，不需要外部搜索服务。
+"""
+from collections import Counter
+import logging
+import math
+
+from django.conf import settings
+from django_redis import get_redis_connection
+import numpy as np
+
+from home.tokenizers import tokenize, html_text
+
+logger = logging.getLogger("django")
+
+# 各字段的词频权重：标题中的词比正文中的词更重要
+FIELD_WEIGHTS = (("title", 3), ("sumary", 2), ("content", 1))
+# 查询最多使用的词数
+MAX_QUERY_TERMS = 32
+
+
+def article_terms(article):
+    """计算文章的加权词频 {词: 词频}"""
+    terms = Counter()
+    for name, weight in FIELD_WEIGHTS:
+        text = getattr(article, name)
+        if name == "content":
+            text = html_text(text)
+        for term in tokenize(text):
+            terms[term] += weight
+    return terms
+
+
+class SearchIndex:
+    """redis中的倒排索引，prefix用于区分正式索引和压测索引"""
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.stats_key = prefix + ":stats"
+        self.doclen_key = prefix + ":doclen"
+
+    def term_key(self, term):
+        return "%s:term:%s" % (self.prefix, term)
+
+    def doc_key(self, id):
+        return "%s:doc:%s" % (self.prefix, id)
+
+    @property
+    def redis(self):
+        return get_redis_connection("default")
+
+    def index(self, id, terms):
+        """写入或更新一篇文章的索引
+
+        :param id: 文章id
+        :param terms: {词: 词频}
+        """
+        redis_conn = self.redis
+        old_terms = {term.decode() for term in redis_conn.smembers(self.doc_key(id))}
+        old_length = redis_conn.hget(self.doclen_key, id)
+        length = sum(terms.values())
+        pipeline = redis_conn.pipeline()
+        for term in old_terms - set(terms):
+            pipeline.hdel(self.term_key(term), id)
+        for term, tf in terms.items():
+            pipeline.hset(self.term_key(term), id, tf)
+        pipeline.delete(self.doc_key(id))
+        if terms:
+            pipeline.sadd(self.doc_key(id), *terms)
+        pipeline.hset(self.doclen_key, id, length)
+        if old_length is None:
+            pipeline.hincrby(self.stats_key, "docs", 1)
+        pipeline.hincrby(self.stats_key, "length", length - int(old_length or 0))
+        pipeline.execute()
+
+    def index_many(self, documents):
+        """批量写入新文章的索引，不清理旧数据，用于重建索引
+
+        :param documents: [(文章id, {词: 词频})]
+        """
+        pipeline = self.redis.pipeline(transaction=False)
+        total = 0
+        for id, terms in documents:
+            for term, tf in terms.items():
+                pipeline.hset(self.term_key(term), id, tf)
+            if terms:
+                pipeline.sadd(self.doc_key(id), *terms)
+            length = sum(terms.values())
+            pipeline.hset(self.doclen_key, id, length)
+            total += length
+        pipeline.hincrby(self.stats_key, "docs", len(documents))
+        pipeline.hincrby(self.stats_key, "length", total)
+        pipeline.execute()
+
+    def remove(self, id):
+        """删除一篇文章的索引"""
+        redis_conn = self.redis
+        terms = redis_conn.smembers(self.doc_key(id))
+        length = redis_conn.hget(self.doclen_key, id)
+        if length is None:
+            return
+        pipeline = redis_conn.pipeline()
+        for term in terms:
+            pipeline.hdel(self.term_key(term.decode()), id)
+        pipeline.delete(self.doc_key(id))
+        pipeline.hdel(self.doclen_key, id)
+        pipeline.hincrby(self.stats_key, "docs", -1)
+        pipeline.hincrby(self.stats_key, "length", -int(length))
+        pipeline.execute()
+
+    def clear(self):
+        """删除全部索引数据"""
+        redis_conn = self.redis
+        keys = []
+        for key in redis_conn.scan_iter(match=self.prefix + ":*", count=1000):
+            keys.append(key)
+            if len(keys) >= 1000:
+                redis_conn.delete(*keys)
+                keys = []
+        if keys:
+            redis_conn.delete(*keys)
+
+    def search(self, query, limit):
+        """按BM25得分检索文章
+
+        :param query: 查询字符串
+        :param limit: 最多返回的文章数量
+        :return: 按得分从高到低排列的[(文章id, 得分)]
+        """
+        terms = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+        if not terms:
+            return []
+        redis_conn = self.redis
+        pipeline = redis_conn.pipeline(transaction=False)
+        pipeline.hmget(self.stats_key, "docs", "length")
+        for term in terms:
+            pipeline.hgetall(self.term_key(term))
+        (docs, length), *postings = pipeline.execute()
+        docs = int(docs or 0)
+        if not docs:
+            return []
+        avgdl = int(length or 0) / docs or 1
+        ids = []
+        tfs = []
+        idfs = []
+        for posting in postings:
+            if not posting:
+                continue
+            df = len(posting)
+            idf = math.log(1 + (docs - df + 0.5) / (df + 0.5))
+            ids.append(np.fromiter(map(int, posting.keys()), dtype=np.int64, count=df))
+            tfs.append(np.fromiter(map(int, posting.values()), dtype=np.float64, count=df))
+            idfs.append(np.full(df, idf))
+        if not ids:
+            return []
+        ids = np.concatenate(ids)
+        tfs = np.concatenate(tfs)
+        idfs = np.concatenate(idfs)
+        # 候选文章的长度
+        candidates, inverse = np.unique(ids, return_inverse=True)
+        lengths = np.array([float(value or avgdl) for value in redis_conn.hmget(self.doclen_key, candidates.tolist())])
+        k1 = settings.SEARCH_BM25_K1
+        b = settings.SEARCH_BM25_B
+        norm = k1 * (1 - b + b * lengths[inverse] / avgdl)
+        scores = np.zeros(len(candidates))
+        np.add.at(scores, inverse, idfs * tfs * (k1 + 1) / (tfs + norm))
+        # 只对得分最高的limit篇文章排序
+        if len(scores) > limit:
+            top = np.argpartition(-scores, limit - 1)[:limit]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(candidates[i]), float(scores[i])) for i in top]
+
+
+search_index = SearchIndex("search")
+
+
+def index_article(article):
+    """更新文章的索引，redis不可用时只记录日志"""
+    try:
+        search_index.index(article.id, article_terms(article))
+    except Exception as e:
+        logger.error(e)
+
+
+def remove_article(id):
+    """删除文章的索引，redis不可用时只记录日志"""
+    try:
+        search_index.remove(id)
+    except Exception as e:
+        logger.error(e)
+
+
+def search_articles(query, limit=None):
+    """检索文章，返回按得分排列的[(文章id, 得分)]，redis不可用时返回空列表"""
+    try:
+        return search_index.search(query, limit or settings.SEARCH_MAX_RESULTS)
+    except Exception as e:
+        logger.error(e)
+        return []
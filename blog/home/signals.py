@@ -0,0 +1,112 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+
+from home.categories import bump_category_version
+from home.models import ArticleCategory, Article
+from home.object_cache import invalidate_articles
+from home.page_cache import purge_tags, article_tag, category_tag, tag_tag
+from home.render import render_content
+from home import fragment_cache
+from home.tags import change_tag_count, TAG_CLOUD_KEY
+from home.search import index_article, remove_article, FIELD_WEIGHTS
+from home.suggest import update_suggestion, remove_suggestion
+
+
+@receiver(post_save, sender=ArticleCategory)
+@receiver(post_delete, sender=ArticleCategory)
+def category_changed(sender, instance, **kwargs):
+    """分类新增、修改或删除后使各进程的分类缓存失效
+
+    事务提交后才递增版本号：提交前递增时，并发请求可能读到新版本号和旧的分类数据，
+    并按新版本号缓存旧数据，直到下一次修改分类。
+    """
+    transaction.on_commit(bump_category_version)
+    purge_tags(category_tag(instance.id))
+
+
+def change_article_count(category_id, delta):
+    """使用F表达式原子地修改分类的文章数量"""
+    if category_id is None:
+        return
+    queryset = ArticleCategory.objects.filter(id=category_id)
+    if delta < 0:
+        # 避免无符号字段减为负数
+        queryset = queryset.filter(article_count__gte=-delta)
+    queryset.update(article_count=F("article_count") + delta)
+
+
+@receiver(pre_save, sender=Article)
+def remember_article_category(sender, instance, update_fields=None, **kwargs):
+    """修改文章前记录原来的分类，用于判断文章是否移动了分类"""
+    if instance._state.adding or (update_fields is not None and "category" not in update_fields):
+        return
+    instance._old_category_id = Article.objects.filter(pk=instance.pk).values_list("category_id", flat=True).first()
+
+
+@receiver(pre_save, sender=Article)
+def render_article_content(sender, instance, update_fields=None, **kwargs):
+    """保存文章时预渲染正文，指定update_fields时需要包含content_html才会重新渲染"""
+    if update_fields is not None and "content_html" not in update_fields:
+        return
+    instance.content_html = render_content(instance.content)
+
+
+@receiver(post_save, sender=Article)
+def update_search_index(sender, instance, update_fields=None, **kwargs):
+    """标题、摘要或正文变化后更新全文检索索引，事务提交后才写入，回滚时不写入"""
+    if update_fields is not None and not {name for name, _ in FIELD_WEIGHTS} & set(update_fields):
+        return
+    transaction.on_commit(lambda: index_article(instance))
+
+
+@receiver(post_save, sender=Article)
+def update_title_suggestion(sender, instance, update_fields=None, **kwargs):
+    """标题变化后更新自动补全索引，事务提交后才写入，回滚时不写入"""
+    if update_fields is not None and "title" not in update_fields:
+        return
+    article_id, title = instance.id, instance.title
+    transaction.on_commit(lambda: update_suggestion(article_id, title))
+
+
+@receiver(post_save, sender=Article)
+def article_saved(sender, instance, created, **kwargs):
+    """文章新增或移动分类后更新分类的文章数量"""
+    # 事务提交后清除文章对象缓存，提交前清除时并发请求可能把旧数据重新写入缓存
+    article_id = instance.id
+    transaction.on_commit(lambda: invalidate_articles(article_id))
+    # 清除文章详情页以及所在分类列表页的缓存
+    purge_tags(article_tag(instance.id), category_tag(instance.category_id))
+    if created:
+        change_article_count(instance.category_id, 1)
+        return
+    if not hasattr(instance, "_old_category_id"):
+        return
+    old_category_id = instance.__dict__.pop("_old_category_id")
+    if old_category_id != instance.category_id:
+        change_article_count(old_category_id, -1)
+        change_article_count(instance.category_id, 1)
+        purge_tags(category_tag(old_category_id))
+
+
+@receiver(pre_delete, sender=Article)
+def article_deleting(sender, instance, **kwargs):
+    """文章删除前减少其标签的文章数量，删除后索引表中的记录已不存在"""
+    tag_ids = list(instance.tag_set.values_list("id", flat=True))
+    if tag_ids:
+        change_tag_count(tag_ids, -1)
+        purge_tags(*[tag_tag(id) for id in tag_ids])
+        transaction.on_commit(lambda: fragment_cache.invalidate(TAG_CLOUD_KEY))
+
+
+@receiver(post_delete, sender=Article)
+def article_deleted(sender, instance, **kwargs):
+    """文章删除后更新分类的文章数量"""
+    change_article_count(instance.category_id, -1)
+    # 删除完成后instance.id会被置为None，先取出id
+    article_id = instance.id
+    transaction.on_commit(lambda: remove_article(article_id))
+    transaction.on_commit(lambda: remove_suggestion(article_id))
+    transaction.on_commit(lambda: invalidate_articles(article_id))
+    purge_tags(article_tag(article_id), category_tag(instance.category_id))
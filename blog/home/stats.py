@@ -0,0 +1,54 @@
+"""缓存命中率等运行统计
+
+统计先在进程内累计，超过汇总间隔后用一次pipeline写入redis的hash中，
+避免每次命中缓存都多一次redis请求。
+"""
+from collections import Counter
+import logging
+import threading
+import time
+
+from django_redis import get_redis_connection
+
+logger = logging.getLogger("django")
+
+
+class StatsCounter:
+    # 进程内统计的汇总间隔(秒)
+    flush_interval = 10
+
+    def __init__(self, key):
+        # 各进程汇总的统计 {event: count}
+        self.key = key
+        self._counter = Counter()
+        self._lock = threading.Lock()
+        self._flushed = time.time()
+
+    def incr(self, event):
+        """累计一次统计，超过汇总间隔时写入redis"""
+        with self._lock:
+            self._counter[event] += 1
+            if time.time() - self._flushed < self.flush_interval:
+                return
+            pending = dict(self._counter)
+            self._counter.clear()
+            self._flushed = time.time()
+        try:
+            pipeline = get_redis_connection("default").pipeline()
+            for event, value in pending.items():
+                pipeline.hincrby(self.key, event, value)
+            pipeline.execute()
+        except Exception as e:
+            logger.error(e)
+
+    def local(self):
+        """当前进程尚未汇总的统计"""
+        with self._lock:
+            return dict(self._counter)
+
+    def totals(self):
+        """所有进程汇总的统计(不含各进程尚未汇总的部分)"""
+        return {event.decode(): int(value) for event, value in get_redis_connection("default").hgetall(self.key).items()}
+
+    def reset(self):
+        get_redis_connection("default").delete(self.key)
@@ -0,0 +1,129 @@
+"""文章标题自动补全
+
+所有标题保存在redis的一个有序集合中，分数都为0，成员按字节序排列：
+    suggest:index   zset {"<小写的标题片段>\x00<文章id>\x00<标题>": 0}
+    suggest:title   hash {文章id: 标题}，修改或删除文章时用于找到原来的成员
+标题从开头以及每个空白、标点之后的位置各生成一个片段，输入标题中间的单词也能匹配。
+补全时用一次ZRANGEBYLEX取出以输入内容开头的成员，每次按键都不查询数据库。
+"""
+import logging
+import re
+
+from django.conf import settings
+from django_redis import get_redis_connection
+
+logger = logging.getLogger("django")
+
+SUGGEST_INDEX_KEY = "suggest:index"
+SUGGEST_TITLE_KEY = "suggest:title"
+# 标题中的分隔符，分隔符之后的位置作为片段的开头
+SEGMENT_SEPARATOR = re.compile(r"[\s,.:;!?/|()\[\]{}<>\"'，。：；！？、（）《》【】“”‘’-]+")
+# 片段最多保留的字符数，更长的输入只按前面的部分匹配
+MAX_PREFIX_LENGTH = 30
+
+
+def normalize(text):
+    return (text or "").strip().lower()
+
+
+def title_members(id, title):
+    """标题对应的有序集合成员"""
+    normalized = normalize(title)
+    starts = {0} | {match.end() for match in SEGMENT_SEPARATOR.finditer(normalized)}
+    members = set()
+    for start in starts:
+        segment = normalized[start:start + MAX_PREFIX_LENGTH]
+        if segment:
+            members.add("%s\x00%s\x00%s" % (segment, id, title))
+    return members
+
+
+def update_suggestion(id, title):
+    """写入或更新文章标题，redis不可用时只记录日志"""
+    try:
+        redis_conn = get_redis_connection("default")
+        old_title = redis_conn.hget(SUGGEST_TITLE_KEY, id)
+        if old_title is not None and old_title.decode() == title:
+            return
+        pipeline = redis_conn.pipeline()
+        if old_title is not None:
+            old_members = title_members(id, old_title.decode())
+            if old_members:
+                pipeline.zrem(SUGGEST_INDEX_KEY, *old_members)
+        members = title_members(id, title)
+        if members:
+            pipeline.zadd(SUGGEST_INDEX_KEY, dict.fromkeys(members, 0))
+        pipeline.hset(SUGGEST_TITLE_KEY, id, title)
+        pipeline.execute()
+    except Exception as e:
+        logger.error(e)
+
+
+def remove_suggestion(id):
+    """删除文章标题，redis不可用时只记录日志"""
+    try:
+        redis_conn = get_redis_connection("default")
+        old_title = redis_conn.hget(SUGGEST_TITLE_KEY, id)
+        if old_title is None:
+            return
+        pipeline = redis_conn.pipeline()
+        old_members = title_members(id, old_title.decode())
+        if old_members:
+            pipeline.zrem(SUGGEST_INDEX_KEY, *old_members)
+        pipeline.hdel(SUGGEST_TITLE_KEY, id)
+        pipeline.execute()
+    except Exception as e:
+        logger.error(e)
+
+
+def suggest(prefix, limit=None):
+    """返回标题片段以prefix开头的文章 [(文章id, 标题)]"""
+    limit = limit or settings.SUGGEST_LIMIT
+    prefix = normalize(prefix)[:MAX_PREFIX_LENGTH].encode()
+    if not prefix:
+        return []
+    # utf-8编码中不会出现0xff，"prefix\xff"大于所有以prefix开头的成员
+    # 同一篇文章可能有多个片段匹配，多取一些用于去重
+    members = get_redis_connection("default").zrangebylex(
+        SUGGEST_INDEX_KEY, b"[" + prefix, b"(" + prefix + b"\xff", start=0, num=limit * 3)
+    results = []
+    seen = set()
+    for member in members:
+        _, id, title = member.decode().split("\x00", 2)
+        if id in seen:
+            continue
+        seen.add(id)
+        results.append((int(id), title))
+        if len(results) >= limit:
+            break
+    return results
+
+
+def rebuild_suggestions(queryset, batch_size=1000):
+    """根据数据库中的文章标题重建补全索引
+
+    先写入临时key，完成后再重命名替换，重建过程中不影响读取。
+    :return: 写入的文章数量
+    """
+    redis_conn = get_redis_connection("default")
+    tmp_index = SUGGEST_INDEX_KEY + ":rebuild"
+    tmp_title = SUGGEST_TITLE_KEY + ":rebuild"
+    redis_conn.delete(tmp_index, tmp_title)
+    count = 0
+    pipeline = redis_conn.pipeline(transaction=False)
+    for id, title in queryset.values_list("id", "title").iterator():
+        members = title_members(id, title)
+        if members:
+            pipeline.zadd(tmp_index, dict.fromkeys(members, 0))
+        pipeline.hset(tmp_title, id, title)
+        count += 1
+        if count % batch_size == 0:
+            pipeline.execute()
+    pipeline.execute()
+    pipeline = redis_conn.pipeline()
+    pipeline.delete(SUGGEST_INDEX_KEY, SUGGEST_TITLE_KEY)
+    if count:
+        pipeline.rename(tmp_index, SUGGEST_INDEX_KEY)
+        pipeline.rename(tmp_title, SUGGEST_TITLE_KEY)
+    pipeline.execute()
+    return count
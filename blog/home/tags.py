@@ -0,0 +1,119 @@
+"""文章标签
+
+标签保存在tb_tag表中，文章与标签的对应关系保存在多对多的tb_article_tag表中，
+按标签浏览文章时通过索引表查询，不再对tb_article.tags做LIKE '%x%'扫描。
+每个标签记录文章数量，标签云和标签列表分页不需要执行COUNT(*)。
+"""
+from collections import namedtuple
+import math
+import re
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from home import fragment_cache
+from home.models import ArticleTag, Article
+from home.page_cache import purge_tags, tag_tag
+
+# 标签之间的分隔符：中英文逗号、分号、顿号和空白
+TAG_SEPARATOR = re.compile(r"[,，;；、\s]+")
+# 缓存的标签云
+TAG_CLOUD_KEY = "fragment:tag_cloud"
+
+TagItem = namedtuple("TagItem", ["name", "article_count", "weight"])
+
+
+def split_tags(text):
+    """将用户输入的标签字符串拆分为去重后的标签名称列表"""
+    names = []
+    seen = set()
+    max_length = ArticleTag._meta.get_field("name").max_length
+    for name in TAG_SEPARATOR.split(text or ""):
+        name = name.strip()[:max_length]
+        if not name or name.lower() in seen:
+            continue
+        seen.add(name.lower())
+        names.append(name)
+        if len(names) >= settings.ARTICLE_TAGS_MAX:
+            break
+    return names
+
+
+def join_tags(names):
+    """标签名称列表转换为保存在Article.tags中的字符串"""
+    return ",".join(names)
+
+
+def get_or_create_tags(names):
+    """按名称获取标签，不存在的标签批量创建"""
+    tags = {tag.name.lower(): tag for tag in ArticleTag.objects.filter(name__in=names)}
+    missing = [name for name in names if name.lower() not in tags]
+    if missing:
+        # 并发创建同名标签时忽略唯一索引冲突，之后重新查询
+        ArticleTag.objects.bulk_create([ArticleTag(name=name) for name in missing], ignore_conflicts=True)
+        tags.update({tag.name.lower(): tag for tag in ArticleTag.objects.filter(name__in=missing)})
+    return [tags[name.lower()] for name in names if name.lower() in tags]
+
+
+def set_article_tags(article, names):
+    """设置文章的标签，更新索引表和标签的文章数量，需要在事务中调用
+
+    :param article: 文章对象
+    :param names: split_tags返回的标签名称列表
+    """
+    tags = get_or_create_tags(names)
+    new_ids = {tag.id for tag in tags}
+    old_ids = set(article.tag_set.values_list("id", flat=True))
+    added = new_ids - old_ids
+    removed = old_ids - new_ids
+    if removed:
+        article.tag_set.remove(*removed)
+        change_tag_count(removed, -1)
+    if added:
+        article.tag_set.add(*added)
+        change_tag_count(added, 1)
+    tags_text = join_tags(tag.name for tag in tags)
+    if article.tags != tags_text:
+        article.tags = tags_text
+        Article.objects.filter(id=article.id).update(tags=tags_text)
+    if added or removed:
+        purge_tags(*[tag_tag(id) for id in added | removed])
+        transaction.on_commit(lambda: fragment_cache.invalidate(TAG_CLOUD_KEY))
+
+
+def change_tag_count(tag_ids, delta):
+    """使用F表达式原子地修改标签的文章数量"""
+    queryset = ArticleTag.objects.filter(id__in=tag_ids)
+    if delta < 0:
+        # 避免无符号字段减为负数
+        queryset = queryset.filter(article_count__gte=-delta)
+    queryset.update(article_count=F("article_count") + delta)
+
+
+def find_tag(name):
+    """按名称查询标签，不存在时返回None"""
+    name = (name or "").strip()
+    if not name:
+        return None
+    return ArticleTag.objects.filter(name=name).first()
+
+
+def get_tag_cloud():
+    """获取文章数量最多的标签，权重1~5用于标签云中的字号"""
+    return fragment_cache.get_or_build(TAG_CLOUD_KEY, load_tag_cloud, settings.TAG_CLOUD_CACHE_TIMEOUT)
+
+
+def load_tag_cloud():
+    tags = list(ArticleTag.objects.filter(article_count__gt=0).order_by("-article_count")
+                .values_list("name", "article_count")[:settings.TAG_CLOUD_SIZE])
+    if not tags:
+        return []
+    # 按文章数量的对数划分权重，避免少数热门标签使其他标签都变成最小字号
+    high = math.log(tags[0][1] + 1)
+    low = math.log(tags[-1][1] + 1)
+    items = []
+    for name, count in sorted(tags, key=lambda tag: tag[0].lower()):
+        weight = 1 if high == low else 1 + int(round(4 * (math.log(count + 1) - low) / (high - low)))
+        items.append(TagItem(name, count, weight))
+    return items
@@ -1,3 +1,804 @@
-from django.test import TestCase
+import datetime
+import math
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.contrib import admin
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db.models import QuerySet
+from django.http import HttpResponse
+from django.contrib.auth.models import AnonymousUser
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, TransactionTestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from home import categories, fragment_cache, object_cache
+from home.admin import ArticleCategoryAdmin
+from home.counters import PENDING_VIEWS_KEY, FLUSHING_VIEWS_KEY, FLUSHED_VIEWS_KEY, DAILY_VISITORS_KEY, \
+    DAILY_VISITED_KEY, TOTAL_VISITORS_KEY, record_view, pending_views, flush_views, rollup_unique_views, day_of, client_ip
+from home.fields import PLAIN, ZLIB, encode_text, decode_text
+from home.leaderboard import HOT_ARTICLES_KEY, load_hot_articles
+from home.models import ArticleCategory, ArticleTag, Article, Comment
+from home.page_cache import page_key, get_cached_page, cache_page_response, category_tag
+from home.pagination import InvalidCursor, parse_positive_int, encode_cursor, decode_cursor, keyset_page
+from home.related import compute_related, compute_related_incremental, get_related_articles, merge_top_k, \
+    product_rows, top_k
+from home.render import render_content
+from home.search import SearchIndex, search_index, index_article, search_articles
+from home.suggest import suggest
+from home.tags import find_tag, set_article_tags, split_tags
+from home.trending import TRENDING_KEY, compute_trending, decay_weights, get_trending_page, hour_key
+from users.models import User
+from utils.query_budget import QueryBudgetExceeded, query_budget
+from utils.testing import redis_test_settings
+
+
+class CacheMixin:
+    """每个测试前清空测试使用的redis库和进程内缓存"""
+    def setUp(self):
+        caches["session"].clear()
+        self.clear_caches()
+        self.user = User.objects.create_user(username="tester", mobile="13800000000", password="password",
+                                             avatar="avatar/test.jpg")
+        self.category = ArticleCategory.objects.create(title="测试分类")
+
+    def clear_caches(self):
+        caches["default"].clear()
+        categories._cached = (None, None)
+        object_cache._local.clear()
+
+    def create_article(self, **kwargs):
+        fields = {"author": self.user, "category": self.category, "title": "测试文章",
+                  "sumary": "摘要", "content": "正文", "avatar": "article/test.jpg"}
+        fields.update(kwargs)
+        return Article.objects.create(**fields)
+
+
+@redis_test_settings
+class RedisTestCase(CacheMixin, TestCase):
+    pass
+
+
+@redis_test_settings
+class RedisTransactionTestCase(CacheMixin, TransactionTestCase):
+    pass
+
+
+class UniqueViewsRollupTest(RedisTestCase):
+    def test_rollup_is_idempotent_and_keeps_today(self):
+        article = self.create_article()
+        now = timezone.now()
+        today, yesterday = day_of(now), day_of(now - datetime.timedelta(days=1))
+        redis_conn = get_redis_connection("default")
+        for day, visitors in ((yesterday, ["a", "b", "c"]), (today, ["c", "d"])):
+            redis_conn.pfadd(DAILY_VISITORS_KEY % (article.id, day), *visitors)
+            redis_conn.sadd(DAILY_VISITED_KEY % day, article.id)
+        with mock.patch("home.counters.timezone.now", return_value=now):
+            self.assertEqual(rollup_unique_views(), 2)
+            # 当天的数据可以反复合并，之前几天的数据已经删除
+            self.assertEqual(rollup_unique_views(), 1)
+        article.refresh_from_db()
+        self.assertEqual(article.unique_views, 4)
+        self.assertEqual(redis_conn.pfcount(TOTAL_VISITORS_KEY % article.id), 4)
+        self.assertFalse(redis_conn.exists(DAILY_VISITORS_KEY % (article.id, yesterday)))
+        self.assertFalse(redis_conn.exists(DAILY_VISITED_KEY % yesterday))
+        self.assertTrue(redis_conn.exists(DAILY_VISITORS_KEY % (article.id, today)))
+        self.assertTrue(redis_conn.sismember(DAILY_VISITED_KEY % today, article.id))
+
+
+class PaginationTest(RedisTestCase):
+    def test_cursor_round_trip(self):
+        article = self.create_article()
+        self.assertEqual(decode_cursor(encode_cursor(article)), (article.created, article.id))
+
+    def test_invalid_cursor(self):
+        for cursor in ("", "!!!", "bm90LWEtY3Vyc29y", "MjAyMC0wMS0wMXxhYmM"):
+            with self.assertRaises(InvalidCursor):
+                decode_cursor(cursor)
+
+    def test_keyset_page_walks_ties_once(self):
+        # 创建时间相同的文章按id决胜，翻页时既不重复也不遗漏
+        created = timezone.now()
+        ids = {self.create_article(created=created - datetime.timedelta(minutes=i // 3)).id for i in range(7)}
+        seen = []
+        cursor = None
+        while True:
+            page, cursor = keyset_page(Article.objects.all(), cursor, 3)
+            seen.extend(article.id for article in page)
+            if cursor is None:
+                break
+        self.assertEqual(len(seen), len(ids))
+        self.assertEqual(set(seen), ids)
+
+    def test_parse_positive_int(self):
+        self.assertEqual(parse_positive_int("3", 1), 3)
+        self.assertEqual(parse_positive_int("abc", 1), 1)
+        self.assertEqual(parse_positive_int("-2", 1), 1)
+        self.assertEqual(parse_positive_int(None, 10), 10)
+        self.assertEqual(parse_positive_int("500", 10, 50), 50)
+
+
+class ViewCounterTest(RedisTransactionTestCase):
+    """写回事务提交后才删除写回中的hash，需要真实提交事务"""
+    def setUp(self):
+        super().setUp()
+        self.articles = [self.create_article(title="文章%d" % i) for i in range(3)]
+        for i, article in enumerate(self.articles):
+            for _ in range(i + 1):
+                record_view(article.id, "visitor")
+
+    def total_views(self):
+        return [Article.objects.get(id=article.id).total_views for article in self.articles]
+
+    def test_flush_writes_deltas_and_clears_hashes(self):
+        self.assertEqual(pending_views(self.articles[2].id), 3)
+        self.assertEqual(flush_views(batch_size=2), 6)
+        self.assertEqual(self.total_views(), [1, 2, 3])
+        redis_conn = get_redis_connection("default")
+        self.assertFalse(redis_conn.exists(PENDING_VIEWS_KEY))
+        self.assertFalse(redis_conn.exists(FLUSHING_VIEWS_KEY))
+        self.assertEqual(pending_views(self.articles[2].id), 0)
+        # 没有新的浏览量时什么也不做
+        self.assertEqual(flush_views(), 0)
+
+    def test_views_during_flush_go_to_new_hash(self):
+        get_redis_connection("default").rename(PENDING_VIEWS_KEY, FLUSHING_VIEWS_KEY)
+        record_view(self.articles[0].id, "visitor")
+        # 写回中和待写回的增量都计入尚未写回的浏览量
+        self.assertEqual(pending_views(self.articles[0].id), 2)
+        self.assertEqual(flush_views(), 6)
+        self.assertEqual(self.total_views(), [1, 2, 3])
+        self.assertEqual(flush_views(), 1)
+        self.assertEqual(self.total_views(), [2, 2, 3])
+
+    def test_failed_batch_rolls_back_and_retries_once(self):
+        update = QuerySet.update
+        calls = []
+
+        def fail_second_batch(queryset, **kwargs):
+            calls.append(1)
+            if len(calls) == 2:
+                raise RuntimeError("database error")
+            return update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, "update", fail_second_batch):
+            with self.assertRaises(RuntimeError):
+                flush_views(batch_size=2)
+        # 第一批也已回滚，写回中的hash保留
+        self.assertEqual(self.total_views(), [0, 0, 0])
+        self.assertTrue(get_redis_connection("default").exists(FLUSHING_VIEWS_KEY))
+        self.assertEqual(flush_views(batch_size=2), 6)
+        self.assertEqual(self.total_views(), [1, 2, 3])
+
+    def test_replay_after_failed_finish_is_noop(self):
+        with mock.patch("home.counters.finish_flush", side_effect=RuntimeError("redis error")):
+            with self.assertRaises(RuntimeError):
+                flush_views()
+        # 浏览量已经提交，写回中的hash保留
+        self.assertEqual(self.total_views(), [1, 2, 3])
+        redis_conn = get_redis_connection("default")
+        self.assertTrue(redis_conn.exists(FLUSHING_VIEWS_KEY))
+        # 重新执行时只完成收尾，不重复累加
+        self.assertEqual(flush_views(), 0)
+        self.assertEqual(self.total_views(), [1, 2, 3])
+        self.assertFalse(redis_conn.exists(FLUSHING_VIEWS_KEY))
+        self.assertEqual(int(redis_conn.hget(FLUSHED_VIEWS_KEY, self.articles[2].id)), 3)
+        self.assertEqual(pending_views(self.articles[2].id), 0)
+
+    def test_cached_article_counts_views_flushed_after_caching(self):
+        article = self.articles[2]
+        path = "/detail/?id=%d" % article.id
+        self.client.force_login(self.user)
+        # 缓存文章对象时尚未写回，本次访问后共4次
+        self.assertEqual(self.client.get(path).context["article"].total_views, 4)
+        flush_views()
+        # 写回后不清除缓存，展示的浏览量不会减少
+        self.assertIsNotNone(object_cache._local.get(article.id))
+        self.assertEqual(self.client.get(path).context["article"].total_views, 5)
+        flush_views()
+        object_cache.invalidate_articles(article.id)
+        self.assertEqual(self.client.get(path).context["article"].total_views, 6)
+
+
+class TrendingListTest(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.article = self.create_article()
+
+    @override_settings(TRENDING_HALF_LIFE_HOURS=6, TRENDING_WINDOW_HOURS=48, TRENDING_COMMENT_WEIGHT=5)
+    def test_decayed_scores_and_order(self):
+        recent, old, commented, quiet = self.article, self.create_article(), self.create_article(), \
+            self.create_article()
+        for i in range(3):
+            Comment.objects.create(article=commented, user=self.user, content="评论%d" % i)
+        now = timezone.now()
+        starts, weights = decay_weights(now, 48)
+        redis_conn = get_redis_connection("default")
+        redis_conn.hset(hour_key(now), recent.id, 10)
+        redis_conn.hset(hour_key(starts[24]), old.id, 30)
+        with mock.patch("home.trending.timezone.now", return_value=now):
+            self.assertEqual(compute_trending(), 1)
+        # 刚发表的评论几乎没有衰减，24小时前的浏览量衰减为1/16左右
+        scores = dict((int(id), score) for id, score in
+                      redis_conn.zrevrange(TRENDING_KEY % self.category.id, 0, -1, withscores=True))
+        self.assertAlmostEqual(scores[recent.id], 10 * weights[0])
+        self.assertAlmostEqual(scores[old.id], 30 * weights[24])
+        self.assertAlmostEqual(scores[commented.id], 15, places=2)
+        self.assertNotIn(quiet.id, scores)
+        articles, total = get_trending_page(self.category.id, 1, 2)
+        self.assertEqual(([article.id for article in articles], total), ([commented.id, recent.id], 3))
+        articles, total = get_trending_page(self.category.id, 2, 2)
+        self.assertEqual([article.id for article in articles], [old.id])
+
+    def test_huge_page_num(self):
+        path = "/?cat_id=%d&sort=trending&page_num=99999999999999999999" % self.category.id
+        self.assertEqual(self.client.get(path).status_code, 404)
+
+    def test_redis_error_falls_back_to_category_listing(self):
+        with mock.patch("home.trending.get_redis_connection", side_effect=ConnectionError("redis down")):
+            response = self.client.get("/?cat_id=%d&sort=trending" % self.category.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([article.id for article in response.context["articles"]], [self.article.id])
+
+
+class ClientIpTest(TestCase):
+    def request(self):
+        return RequestFactory().get("/", REMOTE_ADDR="10.0.0.2", HTTP_X_FORWARDED_FOR="1.1.1.1, 2.2.2.2, 3.3.3.3")
+
+    def test_ignores_forwarded_for_without_trusted_proxy(self):
+        self.assertEqual(client_ip(self.request()), "10.0.0.2")
+
+    @override_settings(TRUSTED_PROXY_COUNT=2)
+    def test_uses_address_appended_by_first_trusted_proxy(self):
+        self.assertEqual(client_ip(self.request()), "2.2.2.2")
+
+    @override_settings(TRUSTED_PROXY_COUNT=5)
+    def test_more_proxies_than_addresses(self):
+        self.assertEqual(client_ip(self.request()), "1.1.1.1")
+
+
+class QueryBudgetTest(RedisTestCase):
+    """各视图在缓存全部失效时执行的SQL语句数量，视图的query_budget与登录用户的数量一致"""
+    def setUp(self):
+        super().setUp()
+        self.articles = [self.create_article(title="文章%d" % i) for i in range(12)]
+        article = self.articles[0]
+        for i in range(3):
+            Comment.objects.create(article=article, user=self.user, content="评论%d" % i)
+        Article.objects.filter(id=article.id).update(comments_count=3)
+
+    def get(self, path, queries):
+        self.clear_caches()
+        with self.assertNumQueries(queries):
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+
+    def test_index(self):
+        # 分类、文章总数、本页文章、标签云各1条，与每页条数无关
+        for page_size in (2, 10):
+            self.get("/?cat_id=%d&page_size=%d" % (self.category.id, page_size), 4)
+        self.client.force_login(self.user)
+        self.get("/?cat_id=%d" % self.category.id, 5)
+
+    def test_detail(self):
+        # 文章、最新评论时间、分类、初始化热门文章排行、热门文章、相关文章、本页评论各1条
+        path = "/detail/?id=%d" % self.articles[0].id
+        self.get(path, 7)
+        self.client.force_login(self.user)
+        self.get(path, 8)
+
+    def test_search(self):
+        # 检索只在redis中完成，清空缓存会删除索引，这里重建索引后再统计
+        self.clear_caches()
+        self.get("/search/?q=%s" % "文章", 1)
+        for article in self.articles:
+            index_article(article)
+        categories._cached = (None, None)
+        with self.assertNumQueries(2):
+            response = self.client.get("/search/?q=%s" % "文章")
+        self.assertEqual(len(response.context["articles"]), 10)
+
+    def test_strict_budget_raises(self):
+        @query_budget(1)
+        def view(request):
+            for _ in range(2):
+                User.objects.count()
+            return HttpResponse()
+
+        request = RequestFactory().get("/")
+        with override_settings(QUERY_BUDGET_STRICT=True):
+            with self.assertRaises(QueryBudgetExceeded):
+                view(request)
+        with override_settings(QUERY_BUDGET_STRICT=False):
+            self.assertEqual(view(request).status_code, 200)
+
+
+class PageCacheTest(RedisTransactionTestCase):
+    """文章写入的事务提交后才清除缓存页面，需要真实提交事务"""
+    def request(self, path, **params):
+        request = RequestFactory().get(path, params)
+        request.user = AnonymousUser()
+        return request
+
+    def test_page_key_normalizes_query(self):
+        key = page_key(self.request("/", cat_id="1"))
+        for params in ({"cat_id": "01"}, {"cat_id": " 1", "page_num": "abc"}, {"cat_id": "1", "page_size": "-3"}):
+            self.assertEqual(page_key(self.request("/", **params)), key)
+        self.assertEqual(page_key(self.request("/", page_num="02")), page_key(self.request("/", page_num="2")))
+        self.assertEqual(page_key(self.request("/", page_size="100000")), page_key(self.request("/", page_size="50")))
+        # 非法的分类或文章id不使用缓存，其他参数也不使用缓存
+        self.assertIsNone(page_key(self.request("/", cat_id="abc")))
+        self.assertIsNone(page_key(self.request("/", sort="trending")))
+
+    def test_purge_after_commit(self):
+        article = self.create_article()
+        path = "/detail/"
+        self.assertEqual(self.client.get(path, {"id": article.id}).status_code, 200)
+        request = self.request(path, id=article.id)
+        self.assertIsNotNone(get_cached_page(request))
+        # 回滚的修改不清除缓存
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                article.title = "回滚的标题"
+                article.save()
+                raise RuntimeError
+        self.assertIsNotNone(get_cached_page(request))
+        with transaction.atomic():
+            article.title = "新标题"
+            article.save()
+            self.assertIsNotNone(get_cached_page(request))
+        self.assertIsNone(get_cached_page(request))
+
+    def test_csrf_token_not_cached(self):
+        article = self.create_article()
+        response = self.client.get("/detail/", {"id": article.id})
+        self.assertNotContains(response, "csrfmiddlewaretoken")
+        self.assertIsNotNone(get_cached_page(self.request("/detail/", id=article.id)))
+        # 使用了CSRF令牌的页面不缓存
+        request = self.request("/", cat_id=str(self.category.id))
+        request.META["CSRF_COOKIE_USED"] = True
+        cache_page_response(request, HttpResponse("page"), [category_tag(self.category.id)])
+        self.assertIsNone(get_cached_page(request))
+        self.client.force_login(self.user)
+        self.assertContains(self.client.get("/detail/", {"id": article.id}), "csrfmiddlewaretoken")
+
+
+class DetailConditionalTest(RedisTestCase):
+    def test_etag_changes_after_login(self):
+        article = self.create_article()
+        path = "/detail/?id=%d" % article.id
+        response = self.client.get(path)
+        etag = response["ETag"]
+        self.assertEqual(set(response["Cache-Control"].split(", ")), {"public", "no-cache"})
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # 登录后页面包含评论表单，浏览器缓存的匿名页面不能再使用
+        self.client.force_login(self.user)
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(set(response["Cache-Control"].split(", ")), {"private", "no-cache"})
+        self.assertIn("Cookie", response["Vary"])
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+
+    def test_repeat_visit_with_csrf_cookie(self):
+        article = self.create_article()
+        path = "/detail/?id=%d" % article.id
+        etag = self.client.get(path)["ETag"]
+        # 其他页面设置了CSRF cookie之后，匿名访客仍然得到304
+        self.client.cookies["csrftoken"] = "a" * 64
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+class CategoryCountTest(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.other = ArticleCategory.objects.create(title="其他分类")
+
+    def counts(self):
+        return dict(ArticleCategory.objects.values_list("id", "article_count"))
+
+    def test_create_delete_and_move(self):
+        first = self.create_article()
+        self.create_article()
+        self.assertEqual(self.counts(), {self.category.id: 2, self.other.id: 0})
+        first.category = self.other
+        first.save()
+        self.assertEqual(self.counts(), {self.category.id: 1, self.other.id: 1})
+        # 只修改其他字段时分类数量不变
+        first.title = "新标题"
+        first.save(update_fields=["title"])
+        self.assertEqual(self.counts(), {self.category.id: 1, self.other.id: 1})
+        first.delete()
+        self.assertEqual(self.counts(), {self.category.id: 1, self.other.id: 0})
+
+    def test_count_never_negative(self):
+        article = self.create_article()
+        ArticleCategory.objects.filter(id=self.category.id).update(article_count=0)
+        article.delete()
+        self.assertEqual(self.counts()[self.category.id], 0)
+
+    def test_reconcile_command(self):
+        self.create_article()
+        self.create_article(category=self.other)
+        ArticleCategory.objects.filter(id=self.category.id).update(article_count=5)
+        ArticleCategory.objects.filter(id=self.other.id).update(article_count=0)
+        out = StringIO()
+        call_command("reconcile_article_counts", stdout=out)
+        self.assertEqual(self.counts(), {self.category.id: 1, self.other.id: 1})
+        self.assertIn("已修正分类数：2", out.getvalue())
+        out = StringIO()
+        call_command("reconcile_article_counts", stdout=out)
+        self.assertIn("已修正分类数：0", out.getvalue())
+
+    def test_admin_save_keeps_count(self):
+        model_admin = ArticleCategoryAdmin(ArticleCategory, admin.site)
+        request = RequestFactory().post("/admin/")
+        self.assertNotIn("article_count", model_admin.get_form(request, self.category).base_fields)
+        # 后台打开分类之后新增了文章，保存分类时不能覆盖文章数量
+        category = ArticleCategory.objects.get(id=self.category.id)
+        self.create_article()
+        category.title = "新分类"
+        model_admin.save_model(request, category, mock.Mock(changed_data=["title"]), True)
+        category.refresh_from_db()
+        self.assertEqual((category.title, category.article_count), ("新分类", 1))
+
+
+class CommentPostTest(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.article = self.create_article()
+        self.client.force_login(self.user)
+
+    def post(self, id):
+        return self.client.post("/detail/", {"id": id, "content": "评论"})
+
+    def test_increments_count_and_inserts_comment(self):
+        response = self.post(self.article.id)
+        self.assertRedirects(response, "/detail/?id=%d" % self.article.id, fetch_redirect_response=False)
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.comments_count, 1)
+        self.assertEqual(Comment.objects.filter(article=self.article, user=self.user).count(), 1)
+
+    def test_count_rolled_back_when_insert_fails(self):
+        with mock.patch.object(Comment.objects, "create", side_effect=IntegrityError):
+            with self.assertRaises(IntegrityError):
+                self.post(self.article.id)
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.comments_count, 0)
+
+    def test_keeps_concurrent_column_changes(self):
+        # 详情页已经缓存了文章对象，之后浏览量写回数据库，评论不能用旧对象覆盖浏览量
+        self.client.get("/detail/?id=%d" % self.article.id)
+        Article.objects.filter(id=self.article.id).update(total_views=42)
+        self.post(self.article.id)
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.total_views, 42)
+        self.assertEqual(self.article.comments_count, 1)
+
+    def test_invalid_id(self):
+        for id in ("", "abc", self.article.id + 1):
+            self.assertEqual(self.post(id).status_code, 404)
+        response = self.client.post("/detail/", {"content": "评论"})
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Comment.objects.exists())
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.comments_count, 0)
+
+    def test_pager_uses_stored_count(self):
+        for i in range(7):
+            self.post(self.article.id)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/detail/?id=%d&page_num=2&page_size=5" % self.article.id)
+        self.assertEqual(response.context["total_count"], 7)
+        self.assertEqual(response.context["total_page"], 2)
+        self.assertEqual(len(response.context["comments"]), 2)
+        self.assertFalse([query for query in queries if "COUNT(" in query["sql"].upper()])
+
+
+class HotArticlesTest(RedisTestCase):
+    def test_cold_start_seeds_leaderboard(self):
+        articles = [self.create_article(title="文章%d" % i) for i in range(3)]
+        for views, article in zip((5, 20, 10), articles):
+            Article.objects.filter(id=article.id).update(total_views=views)
+        expected = [articles[1].id, articles[2].id, articles[0].id]
+        self.assertEqual([article.id for article in load_hot_articles(9)], expected)
+        self.assertEqual(get_redis_connection("default").zcard(HOT_ARTICLES_KEY), 3)
+        # 排行已经初始化，文章不足9篇时也不再查询数据库排序
+        with self.assertNumQueries(1):
+            self.assertEqual([article.id for article in load_hot_articles(9)], expected)
+
+
+class FragmentCacheTest(RedisTestCase):
+    def test_lock_released_only_by_owner(self):
+        redis_conn = get_redis_connection("default")
+        lock_key = "fragment:lock:test:fragment"
+
+        def slow_builder():
+            # 重算超过锁的有效时间，锁过期后被其他进程获取
+            redis_conn.set(lock_key, "other")
+            return "value"
+
+        self.assertEqual(fragment_cache.get_or_build("test:fragment", slow_builder, 60), "value")
+        self.assertEqual(redis_conn.get(lock_key), b"other")
+        redis_conn.delete(lock_key)
+        fragment_cache.invalidate("test:fragment")
+        self.assertEqual(fragment_cache.get_or_build("test:fragment", lambda: "new", 60), "new")
+        self.assertFalse(redis_conn.exists(lock_key))
+
+
+class RenderContentTest(TestCase):
+    def test_unsafe_urls_removed(self):
+        for url in ("javascript:alert(1)", " JavaScript:alert(1)", "java&#x09;script:alert(1)",
+                    "data:text/html;base64,PHNjcmlwdD4=", "vbscript:msgbox(1)"):
+            html = render_content('<a href="%s">链接</a><img src="%s">' % (url, url))
+            self.assertEqual(html, "<a>链接</a><img>")
+        self.assertEqual(render_content('<a href="https://example.com/?a=1&amp;b=2">链接</a>'),
+                         '<a href="https://example.com/?a=1&amp;b=2">链接</a>')
+        self.assertEqual(render_content('<img src="/media/a.png">'), '<img src="/media/a.png">')
+
+    def test_event_handlers_removed(self):
+        html = render_content('<p onclick="alert(1)" style="color: red">文字</p>'
+                              '<img src="/a.png" onerror="alert(1)">')
+        self.assertEqual(html, '<p style="color: red">文字</p><img src="/a.png">')
+        self.assertEqual(render_content('<a href="/a" target="_blank">链接</a>'),
+                         '<a href="/a" target="_blank" rel="noopener noreferrer">链接</a>')
+
+    def test_dangerous_tags_dropped(self):
+        for tag in ("script", "style", "iframe", "svg"):
+            html = render_content("<p>前</p><%s>alert(1)<b>内容</b></%s><p>后</p>" % (tag, tag))
+            self.assertEqual(html, "<p>前</p><p>后</p>")
+        self.assertEqual(render_content('<svg onload="alert(1)"/><p>正文</p>'), "<p>正文</p>")
+        # 未知的标签去掉，文本保留并转义
+        self.assertEqual(render_content("<form><input>a &lt; b</form>"), "a &lt; b")
+
+    def test_unsafe_styles_removed(self):
+        for style in ("background: url(javascript:alert(1))", "width: expression(alert(1))",
+                      "background-image: URL(/a.png)", 'color: red" onclick="alert(1)'):
+            self.assertEqual(render_content('<span style="%s">文字</span>' % style.replace('"', "&quot;")),
+                             "<span>文字</span>")
+        self.assertEqual(render_content('<span style="color: #f00; text-align: center">文字</span>'),
+                         '<span style="color: #f00; text-align: center">文字</span>')
+
+    def test_code_highlighted(self):
+        html = render_content('<pre><code class="language-python">def main():\n    return 1</code></pre>')
+        self.assertTrue(html.startswith('<pre class="highlight"><code class="language-python">'))
+        self.assertIn('<span class="k">def</span>', html)
+        self.assertIn('<span class="nf">main</span>', html)
+        # 代码块中转义的标签按文本输出，不认识的语言按纯文本高亮
+        html = render_content('<pre><code class="language-nosuchlang">'
+                              '&lt;script&gt;alert(1)&lt;/script&gt;</code></pre>')
+        self.assertEqual(html, '<pre class="highlight"><code class="language-nosuchlang">'
+                               '&lt;script&gt;alert(1)&lt;/script&gt;\n</code></pre>')
+
+
+class ObjectCacheTest(RedisTestCase):
+    def test_author_password_not_cached(self):
+        article = self.create_article()
+        cached = object_cache.get_article(article.id)
+        self.assertEqual(cached.author.username, self.user.username)
+        self.assertNotIn(self.user.password.encode(), object_cache._local.get(article.id))
+        self.assertNotIn(self.user.password.encode(), caches["default"].get(object_cache.ARTICLE_KEY % article.id))
+
+    def test_invalidation_between_read_and_local_set(self):
+        article = self.create_article()
+        get = caches["default"].get
+
+        def get_then_invalidate(key, *args, **kwargs):
+            # 读取redis之后、写入本地缓存之前收到失效通知
+            value = get(key, *args, **kwargs)
+            object_cache.invalidate_articles(article.id)
+            return value
+
+        with mock.patch.object(object_cache.cache, "get", get_then_invalidate):
+            self.assertEqual(object_cache.get_article(article.id).id, article.id)
+        self.assertIsNone(object_cache._local.get(article.id))
+        object_cache.get_article(article.id)
+        self.assertIsNotNone(object_cache._local.get(article.id))
+
+    def test_local_entries_expire(self):
+        local = object_cache.LRUCache(10, 1024, 30)
+        with mock.patch("home.object_cache.time.monotonic", return_value=100):
+            local.set(1, b"article")
+        with mock.patch("home.object_cache.time.monotonic", return_value=129):
+            self.assertEqual(local.get(1), b"article")
+        with mock.patch("home.object_cache.time.monotonic", return_value=130):
+            self.assertIsNone(local.get(1))
+        self.assertEqual((len(local), local.size), (0, 0))
+
+
+class CompressedTextFieldTest(RedisTestCase):
+    def stored(self, article):
+        return bytes(Article.objects.filter(id=article.id).values_list("content", flat=True).get()[:1])
+
+    def test_round_trip(self):
+        short = "短文"
+        long = "def main():\n    print('代码')\n" * 200
+        for text, marker in ((short, PLAIN), (long, ZLIB), ("", PLAIN)):
+            article = self.create_article(content=text)
+            self.assertEqual(self.stored(article), marker)
+            self.assertEqual(Article.objects.get(id=article.id).content, text)
+            self.assertEqual(decode_text(encode_text(text)), text)
+
+    def test_unaccessed_value_saved_unchanged(self):
+        article = self.create_article(content="正文" * 1000)
+        loaded = Article.objects.get(id=article.id)
+        loaded.title = "新标题"
+        loaded.save(update_fields=["title", "content"])
+        self.assertEqual(Article.objects.get(id=article.id).content, "正文" * 1000)
+
+    def test_legacy_unmarked_value(self):
+        self.assertEqual(decode_text("旧文本".encode("utf-8")), "旧文本")
+
+
+class TagTest(RedisTestCase):
+    def tag_counts(self):
+        return dict(ArticleTag.objects.values_list("name", "article_count"))
+
+    def test_split_tags(self):
+        self.assertEqual(split_tags("Redis, redis；缓存 、Django\tpython"), ["Redis", "缓存", "Django", "python"])
+        self.assertEqual(split_tags("x" * 30), ["x" * 20])
+        self.assertEqual(split_tags(" ,, "), [])
+        self.assertEqual(split_tags(None), [])
+        with override_settings(ARTICLE_TAGS_MAX=2):
+            self.assertEqual(split_tags("a b c"), ["a", "b"])
+
+    def test_set_article_tags_updates_counts(self):
+        first, second = self.create_article(), self.create_article()
+        set_article_tags(first, ["redis", "django"])
+        set_article_tags(second, ["redis"])
+        self.assertEqual(self.tag_counts(), {"redis": 2, "django": 1})
+        set_article_tags(first, ["django", "python"])
+        self.assertEqual(self.tag_counts(), {"redis": 1, "django": 1, "python": 1})
+        self.assertEqual(Article.objects.get(id=first.id).tags, "django,python")
+        self.assertEqual(sorted(first.tag_set.values_list("name", flat=True)), ["django", "python"])
+        second.delete()
+        self.assertEqual(self.tag_counts(), {"redis": 0, "django": 1, "python": 1})
+
+    def test_tag_listing(self):
+        article = self.create_article()
+        set_article_tags(article, ["redis"])
+        self.assertIsNone(find_tag(" "))
+        self.assertEqual(find_tag(" redis ").name, "redis")
+        response = self.client.get("/", {"tag": "redis"})
+        self.assertEqual([item.id for item in response.context["articles"]], [article.id])
+        self.assertEqual(self.client.get("/", {"tag": "不存在"}).status_code, 404)
+
+
+class SearchIndexTest(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.index = SearchIndex("test:search")
+
+    def test_bm25_score(self):
+        self.index.index_many([(1, {"redis": 2, "cache": 2}), (2, {"cache": 1, "django": 3}), (3, {"django": 4})])
+        # 只有文章1包含redis：idf = ln(1 + (3 - 1 + 0.5) / (1 + 0.5))，文章长度4，平均长度4
+        k1, b = 1.2, 0.75
+        idf = math.log(1 + 2.5 / 1.5)
+        expected = idf * 2 * (k1 + 1) / (2 + k1 * (1 - b + b * 4 / 4))
+        with override_settings(SEARCH_BM25_K1=k1, SEARCH_BM25_B=b):
+            results = dict(self.index.search("redis", 10))
+        self.assertEqual(list(results), [1])
+        self.assertAlmostEqual(results[1], expected)
+
+    def test_ranking_and_updates(self):
+        self.index.index_many([(1, {"cache": 1, "django": 3}), (2, {"cache": 3, "django": 1})])
+        self.assertEqual([id for id, _ in self.index.search("cache", 10)], [2, 1])
+        # 更新后旧词从倒排表中删除
+        self.index.index(2, {"django": 1})
+        self.assertEqual([id for id, _ in self.index.search("cache", 10)], [1])
+        self.index.remove(1)
+        self.assertEqual(self.index.search("cache", 10), [])
+        self.assertEqual([id for id, _ in self.index.search("django", 10)], [2])
+
+
+class SearchIndexCommitTest(RedisTransactionTestCase):
+    """文章的索引在事务提交后才写入"""
+    def test_index_after_commit(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                self.create_article(title="rollback")
+                raise RuntimeError
+        self.assertEqual(search_articles("rollback"), [])
+        with transaction.atomic():
+            article = self.create_article(title="committed")
+            self.assertEqual(search_articles("committed"), [])
+        self.assertEqual([id for id, _ in search_articles("committed")], [article.id])
+        article_id = article.id
+        article.delete()
+        self.assertEqual(search_articles("committed"), [])
+        self.assertIsNone(get_redis_connection("default").hget(search_index.doclen_key, article_id))
+
+
+class SuggestCommitTest(RedisTransactionTestCase):
+    """标题补全索引在事务提交后才写入"""
+    def test_suggest_after_commit(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                self.create_article(title="Rollback title")
+                raise RuntimeError
+        self.assertEqual(suggest("rollback"), [])
+        with transaction.atomic():
+            article = self.create_article(title="Redis 缓存")
+            self.assertEqual(suggest("redis"), [])
+        self.assertEqual(suggest("redis"), [(article.id, "Redis 缓存")])
+        self.assertEqual(suggest("缓存"), [(article.id, "Redis 缓存")])
+        article.delete()
+        self.assertEqual(suggest("redis"), [])
+
+
+class CategoryVersionCommitTest(RedisTransactionTestCase):
+    """分类数据版本号在事务提交后才递增"""
+    def version(self):
+        return int(get_redis_connection("default").get(categories.CATEGORY_VERSION_KEY) or 0)
+
+    def test_bump_after_commit(self):
+        version = self.version()
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                ArticleCategory.objects.create(title="回滚的分类")
+                raise RuntimeError
+        self.assertEqual(self.version(), version)
+        with transaction.atomic():
+            ArticleCategory.objects.create(title="新分类")
+            self.assertEqual(self.version(), version)
+        self.assertEqual(self.version(), version + 1)
+
+
+class ObjectCacheCommitTest(RedisTransactionTestCase):
+    """文章修改的事务提交后才清除文章对象缓存"""
+    def test_invalidate_after_commit(self):
+        article = self.create_article()
+        object_cache.get_article(article.id)
+        with transaction.atomic():
+            article.title = "新标题"
+            article.save()
+            self.assertIsNotNone(object_cache._local.get(article.id))
+        self.assertIsNone(object_cache._local.get(article.id))
+        self.assertIsNone(caches["default"].get(object_cache.ARTICLE_KEY % article.id))
+        self.assertEqual(object_cache.get_article(article.id).title, "新标题")
+
+
+class RelatedArticlesTest(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        contents = ["redis cache redis cache", "redis cache cluster", "django orm query",
+                    "django orm model", "numpy array", "numpy array vector"]
+        self.articles = [self.create_article(content=content) for content in contents]
+
+    def related_ids(self, article):
+        return [related.id for related in get_related_articles(article.id)]
+
+    def test_product_rows_bounded(self):
+        with override_settings(RELATED_PRODUCT_MAX_ENTRIES=len(self.articles) * 2):
+            self.assertEqual(product_rows(len(self.articles)), 2)
+            self.assertEqual(compute_related(batch_size=4), len(self.articles))
+        bounded = [self.related_ids(article) for article in self.articles]
+        compute_related()
+        self.assertEqual([self.related_ids(article) for article in self.articles], bounded)
+        a = self.articles
+        self.assertEqual(bounded, [[a[1].id], [a[0].id], [a[3].id], [a[2].id], [a[5].id], [a[4].id]])
+
+    def test_top_k(self):
+        ids = np.array([1, 2, 3, 4])
+        scores = np.array([0.1, 0.9, 0.0, 0.5])
+        self.assertEqual(top_k(ids, scores, 2, exclude=2), [(4, 0.5), (1, 0.1)])
+        self.assertEqual(top_k(ids, scores, 1), [(2, 0.9)])
+        # 得分为0的文章不算相关
+        self.assertEqual(len(top_k(ids, scores, 10)), 3)
+        self.assertEqual(merge_top_k([(1, 0.5), (2, 0.3)], [(3, 0.4), (2, 0.6)], 2), [(2, 0.6), (1, 0.5)])
+
+    def test_incremental(self):
+        compute_related()
+        a = self.articles
+        new = self.create_article(content="redis cache")
+        self.assertEqual(compute_related_incremental(), 1)
+        self.assertEqual(set(self.related_ids(new)), {a[0].id, a[1].id})
+        # 新文章插入到相似的已有文章的相关列表中，其他文章不变
+        self.assertEqual(set(self.related_ids(a[0])), {a[1].id, new.id})
+        self.assertEqual(set(self.related_ids(a[1])), {a[0].id, new.id})
+        self.assertEqual(self.related_ids(a[2]), [a[3].id])
+        self.assertEqual(compute_related_incremental(), 0)
@@ -0,0 +1,46 @@
+"""文章分词
+
+中文没有空格分词，这里使用不依赖词典的二元分词(bigram)：连续的汉字两两组成一个词，
+单独的汉字作为一个词；英文和数字按单词切分并转换为小写。
+全文检索和相关文章计算通过settings.SEARCH_TOKENIZER指定分词函数，可以替换为基于词典的分词。
+"""
+from html import unescape
+import re
+
+from django.conf import settings
+from django.utils.html import strip_tags
+from django.utils.module_loading import import_string
+
+# 连续的汉字，或连续的英文字母、数字
+TOKEN_RUN = re.compile(r"[㐀-䶿一-鿿豈-﫿]+|[a-z0-9]+(?:[._+#-][a-z0-9]+)*")
+# 过长的英文单词(如编码后的数据)不参与索引
+MAX_WORD_LENGTH = 40
+
+_tokenizer = None
+
+
+def bigram_tokenize(text):
+    """二元分词，返回词的列表(包含重复的词)"""
+    tokens = []
+    for run in TOKEN_RUN.findall((text or "").lower()):
+        if run[0] < "㐀":
+            if len(run) <= MAX_WORD_LENGTH:
+                tokens.append(run)
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def tokenize(text):
+    """使用settings.SEARCH_TOKENIZER指定的分词函数分词"""
+    global _tokenizer
+    if _tokenizer is None:
+        _tokenizer = import_string(settings.SEARCH_TOKENIZER)
+    return _tokenizer(text)
+
+
+def html_text(html):
+    """去掉HTML标签并还原字符实体，只保留文本"""
+    return unescape(strip_tags(html or ""))
@@ -0,0 +1,141 @@
+"""文章趋势排行
+
+按小时记录文章浏览量，由compute_trending命令定时计算带时间衰减的趋势分数：
+    score = Σ (浏览量 + 评论权重 × 评论数) × 0.5 ^ (距今小时数 / 半衰期)
+计算时按批次把文章的逐小时浏览量组织成矩阵，用numpy一次完成整批文章的加权求和，
+每个分类的前N篇文章发布到redis的有序集合中，首页?sort=trending直接读取。
+"""
+import datetime
+import logging
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from home.models import Article, Comment
+
+logger = logging.getLogger("django")
+
+# 每小时浏览量 {article_id: views}
+HOURLY_VIEWS_KEY = "article:views:hour:%s"
+# 分类趋势排行 {article_id: score}
+TRENDING_KEY = "article:trending:%s"
+
+
+def hour_key(moment):
+    """获取某一时刻所在小时的浏览量key"""
+    return HOURLY_VIEWS_KEY % moment.astimezone(datetime.timezone.utc).strftime("%Y%m%d%H")
+
+
+def hourly_views_ttl():
+    """小时浏览量只需要保留到超出统计窗口"""
+    return (settings.TRENDING_WINDOW_HOURS + 1) * 3600
+
+
+def decay_weights(now, hours):
+    """计算统计窗口内每个小时的衰减系数，返回(小时起始时间列表, 系数数组)"""
+    current = now.replace(minute=0, second=0, microsecond=0)
+    starts = [current - datetime.timedelta(hours=i) for i in range(hours)]
+    # 以小时的中点计算距今时间
+    ages = np.array([(now - start).total_seconds() / 3600.0 for start in starts]) - 0.5
+    ages = np.clip(ages, 0, None)
+    return starts, np.power(0.5, ages / settings.TRENDING_HALF_LIFE_HOURS)
+
+
+def comment_scores(now, since):
+    """统计窗口内的评论按时间衰减后的加权分数 {article_id: score}"""
+    rows = Comment.objects.filter(created__gte=since, article__isnull=False).values_list("article_id", "created")
+    if not rows:
+        return {}
+    article_ids, created = zip(*rows)
+    ages = np.array([(now - c).total_seconds() / 3600.0 for c in created])
+    scores = np.power(0.5, ages / settings.TRENDING_HALF_LIFE_HOURS) * settings.TRENDING_COMMENT_WEIGHT
+    ids, inverse = np.unique(np.array(article_ids), return_inverse=True)
+    totals = np.zeros(len(ids))
+    np.add.at(totals, inverse, scores)
+    return dict(zip(ids.tolist(), totals.tolist()))
+
+
+def compute_trending(batch_size=None, top_n=None):
+    """计算所有文章的趋势分数，发布每个分类的前top_n篇文章
+
+    :return: 发布了排行的分类数量
+    """
+    batch_size = batch_size or settings.TRENDING_BATCH_SIZE
+    top_n = top_n or settings.TRENDING_TOP_N
+    now = timezone.now()
+    starts, weights = decay_weights(now, settings.TRENDING_WINDOW_HOURS)
+    keys = [hour_key(start) for start in starts]
+    comments = comment_scores(now, starts[-1])
+    redis_conn = get_redis_connection("default")
+
+    # 每个分类的候选文章 {category_id: (ids数组, scores数组)}
+    candidates = {}
+    queryset = Article.objects.filter(category__isnull=False).order_by("id").values_list("id", "category_id")
+    last_id = 0
+    while True:
+        batch = list(queryset.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            break
+        last_id = batch[-1][0]
+        ids = np.array([row[0] for row in batch])
+        categories = np.array([row[1] for row in batch])
+        # 浏览量矩阵：每行一篇文章，每列一个小时
+        pipeline = redis_conn.pipeline()
+        for key in keys:
+            pipeline.hmget(key, ids.tolist())
+        views = np.array([[int(v or 0) for v in column] for column in pipeline.execute()], dtype=np.float64).T
+        scores = views.dot(weights)
+        scores += np.array([comments.get(id, 0.0) for id in ids.tolist()])
+        # 每个分类只保留当前分数最高的top_n篇文章作为候选
+        for category_id in np.unique(categories).tolist():
+            mask = (categories == category_id) & (scores > 0)
+            if not mask.any():
+                continue
+            old_ids, old_scores = candidates.get(category_id, (np.array([], dtype=ids.dtype), np.array([])))
+            merged_ids = np.concatenate([old_ids, ids[mask]])
+            merged_scores = np.concatenate([old_scores, scores[mask]])
+            if len(merged_ids) > top_n:
+                keep = np.argpartition(-merged_scores, top_n - 1)[:top_n]
+                merged_ids, merged_scores = merged_ids[keep], merged_scores[keep]
+            candidates[category_id] = (merged_ids, merged_scores)
+
+    # 发布排行：先写入临时key再重命名，读取方不会读到写了一半的排行
+    published = set()
+    pipeline = redis_conn.pipeline()
+    for category_id, (ids, scores) in candidates.items():
+        key = TRENDING_KEY % category_id
+        pipeline.delete(key + ":tmp")
+        pipeline.zadd(key + ":tmp", dict(zip(ids.tolist(), scores.tolist())))
+        pipeline.rename(key + ":tmp", key)
+        published.add(category_id)
+    # 没有趋势数据的分类清空旧排行
+    for category_id in Article.objects.filter(category__isnull=False).order_by().values_list("category_id", flat=True).distinct():
+        if category_id not in published:
+            pipeline.delete(TRENDING_KEY % category_id)
+    pipeline.execute()
+    return len(published)
+
+
+def get_trending_page(category_id, page_num, page_size):
+    """获取分类趋势排行的一页文章，返回(文章列表, 排行中的文章总数)
+
+    排行最多只有TRENDING_TOP_N篇文章，超出范围的页码按排行之后的第一页处理，返回空列表。
+    redis不可用时返回None，由调用方改用普通的分类列表。
+    """
+    key = TRENDING_KEY % category_id
+    page_num = min(page_num, settings.TRENDING_TOP_N // page_size + 1)
+    start = (page_num - 1) * page_size
+    try:
+        redis_conn = get_redis_connection("default")
+        pipeline = redis_conn.pipeline()
+        pipeline.zrevrange(key, start, start + page_size - 1)
+        pipeline.zcard(key)
+        ids, total = pipeline.execute()
+    except Exception as e:
+        logger.error(e)
+        return None
+    ids = [int(id) for id in ids]
+    articles = {article.id: article for article in Article.objects.listing().filter(id__in=ids).order_by()}
+    return [articles[id] for id in ids if id in articles], total
@@ -1,8 +1,10 @@
 from django.urls import path
-from home.views import IndexView,DetailView
+from home.views import IndexView,DetailView,SearchView,SuggestView
 
 
 urlpatterns = [
     path("", IndexView.as_view(), name="index"),
-    path("detail/", DetailView.as_view(), name='detail')
+    path("detail/", DetailView.as_view(), name='detail'),
+    path("search/", SearchView.as_view(), name="search"),
+    path("suggest/", SuggestView.as_view(), name="suggest"),
 ]
\ No newline at end of file
@@ -1,13 +1,41 @@
+import hashlib
+import logging
+import math
 from django.shortcuts import render, redirect
 from django.urls import reverse
 from django.views import View
+from django.utils.decorators import method_decorator
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe
 from home.models import ArticleCategory, Article, Comment
-from django.http import HttpResponseNotFound
+from home.categories import get_categories, find_category
+from home.counters import record_view, visitor_hash
+from home.leaderboard import get_hot_articles
+from home.trending import get_trending_page
+from home.object_cache import get_article, invalidate_articles
+from home.page_cache import get_cached_page, cache_page_response, purge_tags, article_tag, category_tag, tag_tag
+from home.tags import find_tag, get_tag_cloud
+from home.search import search_articles
+from home.suggest import suggest
+from home.related import get_related_articles
+from utils.response_code import RETCODE
+from home.pagination import CountedPaginator, InvalidCursor, parse_positive_int, encode_cursor, keyset_order, keyset_page
+from django.http import HttpResponseNotFound, HttpResponseBadRequest, JsonResponse
 from django.core.paginator import Paginator, EmptyPage
+from utils.query_budget import query_budget
+
+logger = logging.getLogger("django")
 
 
 class IndexView(View):
     """首页"""
+    # 无论page_size多大，首页执行的SQL语句数量固定
+    # (包含分类缓存失效时重新加载分类、登录用户查询用户信息和标签云缓存失效时重新查询的各1条)
+    @method_decorator(query_budget(5))
     def get(self, request):
         """提供首页界面
         1.获取所有的分类信息
@@ -19,30 +47,75 @@ class IndexView(View):
         7.进行分页处理
         8.组织数据传递给模板
         """
-        # 1.获取所有的分类信息
-        categories = ArticleCategory.objects.all()
-        # 2.接收用户点击的分类id  ?cat_id=xxx&page_num=xxx&page_size=xxx
+        # 0.未登录用户直接返回缓存的页面
+        response = get_cached_page(request)
+        if response is not None:
+            return response
+        # 1.获取所有的分类信息(进程内缓存)
+        categories = get_categories()
+        # 2.接收用户点击的分类id或标签  ?cat_id=xxx&tag=xxx&page_num=xxx&page_size=xxx&after=xxx&sort=trending
         cat_id = request.GET.get("cat_id", 1)
-        page_num = request.GET.get("page_num", 1)
-        page_size = request.GET.get("page_size", 10)
-        # 3.根据分类id进行分类的查询
-        try:
-            category = ArticleCategory.objects.get(id=cat_id)
-        except ArticleCategory.DoesNotExist:
-            return HttpResponseNotFound("没有此分类")
-        # 4.根据分类信息查询文章数据
-        articles = Article.objects.filter(category=category)
-        # 5.创建分页器 参数1：所有文章 参数2：每页n条数据
-        paginator = Paginator(articles, page_size)
-        # 6.进行分页处理
-        try:
-            # 获取指定页的数据
-            page_articles = paginator.page(page_num)
-        except EmptyPage:
-            # 如果没有分页数据，默认给用户404
-            return HttpResponseNotFound("empty page")
-        # 7.获取列表页总页数
-        total_page = paginator.num_pages
+        tag_name = request.GET.get("tag")
+        page_num = parse_positive_int(request.GET.get("page_num"), 1)
+        # page_size由客户端传入，需要限制上限
+        page_size = parse_positive_int(request.GET.get("page_size"), 10, settings.ARTICLE_PAGE_SIZE_MAX)
+        after = request.GET.get("after")
+        sort = request.GET.get("sort")
+        # 3.根据分类id或标签名称进行分类/标签的查询
+        # 列表页只展示摘要，不加载正文，并关联查询分类避免模板中逐条查询
+        if tag_name:
+            # 按标签浏览：通过标签索引表查询文章，文章总数使用标签中记录的数量
+            tag = find_tag(tag_name)
+            if tag is None:
+                return HttpResponseNotFound("没有此标签")
+            category = None
+            articles = Article.objects.listing().filter(tag_set=tag)
+        else:
+            tag = None
+            category = find_category(categories, cat_id)
+            if category is None:
+                return HttpResponseNotFound("没有此分类")
+            # 4.根据分类信息查询文章数据
+            articles = Article.objects.listing().filter(category_id=category.id)
+        next_cursor = None
+        # 趋势排行模式：从定时任务预先计算好的排行中读取一页文章，redis不可用时使用普通的分类列表
+        trending = get_trending_page(category.id, page_num, page_size) \
+            if sort == "trending" and category is not None else None
+        if trending is not None:
+            # 5.趋势排行模式
+            page_articles, count = trending
+            if not page_articles and page_num > 1:
+                return HttpResponseNotFound("empty page")
+            total_page = max(1, int(math.ceil(count / page_size)))
+        elif after:
+            # 5.游标分页模式：只查询游标之后的一页数据，不执行COUNT和OFFSET
+            try:
+                page_articles, next_cursor = keyset_page(articles, after, page_size)
+            except InvalidCursor:
+                return HttpResponseBadRequest("分页参数错误")
+            if not page_articles:
+                return HttpResponseNotFound("empty page")
+            # 总页数使用缓存的近似值，保证不小于当前页
+            if category is not None:
+                total_page = approximate_page_count(category.id, page_size)
+            else:
+                total_page = max(1, int(math.ceil(tag.article_count / page_size)))
+            total_page = max(total_page, page_num + 1 if next_cursor else page_num)
+        else:
+            # 5.创建分页器 参数1：所有文章 参数2：每页n条数据 参数3：分类或标签中记录的文章总数
+            count = category_article_count(category.id) if category is not None else tag.article_count
+            paginator = CountedPaginator(keyset_order(articles), page_size, count)
+            # 6.进行分页处理
+            try:
+                # 获取指定页的数据
+                page_articles = paginator.page(page_num)
+            except EmptyPage:
+                # 如果没有分页数据，默认给用户404
+                return HttpResponseNotFound("empty page")
+            # 生成下一页游标，之后的翻页可以切换为游标分页
+            next_cursor = encode_cursor(page_articles[-1]) if page_articles.has_next() else None
+            # 7.获取列表页总页数
+            total_page = paginator.num_pages
         # 8.组织数据传递给模板
         context = {
             "categories": categories,
@@ -51,12 +124,101 @@ class IndexView(View):
             "page_size": page_size,
             "total_page": total_page,
             "page_num": page_num,
+            "next_cursor": next_cursor,
+            "sort": sort,
+            "tag": tag,
+            "tag_cloud": get_tag_cloud(),
+        }
+        response = render(request, "index.html", context=context)
+        # 缓存页面，分类或标签下新增文章或页面中的文章变化时清除
+        list_tag = category_tag(category.id) if category is not None else tag_tag(tag.id)
+        cache_page_response(request, response, [list_tag] + [article_tag(article.id) for article in page_articles])
+        return response
+
+
+def category_article_count(category_id):
+    """获取分类中记录的文章总数，按主键查询，不执行COUNT(*)"""
+    return ArticleCategory.objects.filter(id=category_id).values_list("article_count", flat=True).first() or 0
+
+
+def approximate_page_count(category_id, page_size):
+    """获取分类文章的近似总页数
+
+    文章总数缓存在redis中，游标分页模式下不再每次查询数据库
+    """
+    key = "article:count:%s" % category_id
+    count = cache.get(key)
+    if count is None:
+        count = category_article_count(category_id)
+        cache.set(key, count, settings.ARTICLE_COUNT_CACHE_TIMEOUT)
+    return max(1, int(math.ceil(count / page_size)))
+
+
+class SearchView(View):
+    """全文检索"""
+    # 检索在redis的倒排索引中完成，数据库只按id查询本页文章
+    # (包含分类缓存失效时重新加载分类和登录用户查询用户信息的各1条)
+    @method_decorator(query_budget(3))
+    def get(self, request):
+        """
+        1.接收查询词和分页参数
+        2.从倒排索引中按BM25得分检索文章id
+        3.对检索结果分页
+        4.按id查询本页文章
+        5.组织数据传递给模板
+        """
+        # 1.接收查询词和分页参数  search/?q=xxx&page_num=xxx&page_size=xxx
+        q = request.GET.get("q", "").strip()[:100]
+        page_num = parse_positive_int(request.GET.get("page_num"), 1)
+        page_size = parse_positive_int(request.GET.get("page_size"), 10, settings.ARTICLE_PAGE_SIZE_MAX)
+        categories = get_categories()
+        # 2.从倒排索引中按BM25得分检索文章id
+        results = search_articles(q) if q else []
+        # 3.对检索结果分页
+        paginator = Paginator(results, page_size)
+        try:
+            page_results = paginator.page(page_num)
+        except EmptyPage:
+            return HttpResponseNotFound("empty page")
+        # 4.按id查询本页文章，保持得分顺序
+        ids = [id for id, _ in page_results]
+        articles = Article.objects.listing().in_bulk(ids) if ids else {}
+        page_articles = [articles[id] for id in ids if id in articles]
+        # 5.组织数据传递给模板
+        context = {
+            "categories": categories,
+            "q": q,
+            "articles": page_articles,
+            "total_count": paginator.count,
+            "page_size": page_size,
+            "total_page": paginator.num_pages,
+            "page_num": page_num,
         }
-        return render(request, "index.html", context=context)
+        return render(request, "search.html", context=context)
+
+
+class SuggestView(View):
+    """文章标题自动补全"""
+    # 只读取redis中的补全索引，不访问request.user，不执行任何SQL
+    @method_decorator(query_budget(0))
+    def get(self, request):
+        # suggest/?q=xxx
+        q = request.GET.get("q", "").strip()
+        if not q:
+            return JsonResponse({"code": RETCODE.NECESSARYPARAMERR, "errmsg": "缺少必传参数"})
+        try:
+            results = suggest(q)
+        except Exception as e:
+            logger.error(e)
+            results = []
+        suggestions = [{"id": id, "title": title} for id, title in results]
+        return JsonResponse({"code": RETCODE.OK, "errmsg": "OK", "suggestions": suggestions})
 
 
 class DetailView(View):
     """"详情页面展示"""
+    # 包含热门文章排行冷启动时初始化排行的1条和登录用户查询用户信息的1条
+    @method_decorator(query_budget(8))
     def get(self, request):
         """
         1.接收文章的id信息
@@ -73,30 +235,59 @@ class DetailView(View):
         #  detail/?id=xxx&page_num=xxx&page_size=xxx
         # 1.接收文章的id信息
         id = request.GET.get("id")
+        # 未登录用户直接返回缓存的页面，只有存在的文章才会被缓存，浏览量照常记录
+        response = get_cached_page(request)
+        if response is not None:
+            record_view(int(id), visitor_hash(request))
+            # 缓存的页面带有验证头，客户端缓存仍然有效时返回304
+            return get_conditional_response(request, etag=response.get("ETag"),
+                                            last_modified=parse_http_date_safe(response.get("Last-Modified", "")),
+                                            response=response)
         # 2.根据文章id 进行文章数据的查询
         try:
-            article = Article.objects.get(id=id)
-        except Article.DoesNotExist:
+            # 文章对象缓存：进程内缓存 -> redis缓存 -> 数据库
+            article = get_article(id)
+        except (Article.DoesNotExist, ValueError, TypeError):
             return render(request, '404.html')
         else:
             # 浏览量：每次请求文章详情时给浏览量＋1
-            article.total_views += 1
-            article.save()
-        # 3.查询分类数据
-        categories = ArticleCategory.objects.all()
+            # 浏览量先累加到redis中，由flush_article_views命令批量写回数据库
+            # 页面展示的浏览量为数据库中的值加上尚未写回的增量
+            pending, flushed, unique = record_view(article.id, visitor_hash(request))
+            # 缓存的文章对象不包含缓存之后写回数据库的浏览量
+            if flushed is not None:
+                pending += flushed - getattr(article, "flushed_views", flushed)
+            article.total_views += pending
+            # 独立访客数使用redis中的实时统计值
+            if unique is not None:
+                article.unique_views = max(article.unique_views, unique)
+        # 4.获取评论分页请求参数
+        page_num = parse_positive_int(request.GET.get("page_num"), 1)
+        page_size = parse_positive_int(request.GET.get("page_size"), 5, settings.ARTICLE_PAGE_SIZE_MAX)
+        # 条件请求：根据文章修改时间、最新评论时间和请求的评论页生成验证头
+        # 客户端或反向代理的缓存仍然有效时直接返回304，不再渲染模板(浏览量已经记录)
+        etag, last_modified = detail_validators(request, article, page_num, page_size)
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is not None:
+            set_detail_validators(request, response, etag, last_modified)
+            return response
+        # 3.查询分类数据(进程内缓存)
+        categories = get_categories()
 
         # 获取热点文章：查询浏览量前10的文章数据
-        hot_articles = Article.objects.order_by("-total_views")[:9]
+        # 热门文章排行保存在redis的有序集合中，只按id查询标题
+        hot_articles = get_hot_articles(9)
+        # 相关文章：离线计算的结果，按文章id一次查询
+        related_articles = get_related_articles(article.id)
 
-        # 4.获取评论分页请求参数
-        page_num = request.GET.get("page_num", 1)
-        page_size = request.GET.get("page_size", 5)
         # 5.根据文章信息查询评论数据
-        comments = Comment.objects.filter(article=article).order_by("-created")
-        # 获取评论总数
-        total_count = comments.count()
+        # 关联查询评论用户，只加载模板中用到的字段
+        comments = Comment.objects.filter(article_id=article.id).select_related("user")\
+            .only("content", "created", "user", "user__username").order_by("-created")
+        # 获取评论总数：使用文章中记录的评论数量，不执行COUNT(*)
+        total_count = article.comments_count
         # 6.创建分页器:每页N条记录
-        paginator = Paginator(comments, page_size)
+        paginator = CountedPaginator(comments, page_size, total_count)
         # 7.进行分页处理
         try:
             page_comments = paginator.page(page_num)
@@ -112,13 +303,18 @@ class DetailView(View):
             'category': article.category,
             'article': article,
             "hot_articles": hot_articles,
+            "related_articles": related_articles,
             "total_count": total_count,
             "comments": page_comments,
             "page_size": page_size,
             "total_page": total_page,
             "page_num": page_num
         }
-        return render(request, "detail.html", context=context)
+        response = render(request, "detail.html", context=context)
+        set_detail_validators(request, response, etag, last_modified)
+        # 缓存页面，文章修改或有新评论时清除
+        cache_page_response(request, response, [article_tag(article.id)])
+        return response
 
     def post(self, request):
         # 1.先接收用户信息
@@ -129,33 +325,56 @@ class DetailView(View):
             # 3.1接收评论数据
             id = request.POST.get("id")
             content = request.POST.get("content")
-            # 3.2验证文章是否存在
             try:
-                article = Article.objects.get(id=id)
-            except Article.DoesNotExist:
+                with transaction.atomic():
+                    # 3.2修改文章的评论数量：只更新comments_count字段，文章不存在时更新0行
+                    updated = Article.objects.filter(id=id).update(comments_count=F("comments_count") + 1)
+                    if not updated:
+                        return HttpResponseNotFound("没有此文章")
+                    # 3.3保存评论数据
+                    Comment.objects.create(
+                        content=content,
+                        article_id=id,
+                        user=user
+                    )
+            except ValueError:
                 return HttpResponseNotFound("没有此文章")
-            # 3.3保存评论数据
-            Comment.objects.create(
-                content=content,
-                article=article,
-                user=user
-            )
-            # 3.4修改文章的评论数量
-            article.comments_count += 1
-            article.save()
+            # 3.4清除文章对象缓存、文章详情页以及包含该文章的列表页缓存
+            invalidate_articles(id)
+            purge_tags(article_tag(id))
             # 刷新当前页面（页面重定向）拼接跳转路由
-            path = reverse("home:detail") + "?id={}".format(article.id)
+            path = reverse("home:detail") + "?id={}".format(id)
             return redirect(path)
         # 4.未登录用户则跳转到登陆页面
         else:
             return redirect(reverse("users:login"))
 
 
+def detail_validators(request, article, page_num, page_size):
+    """生成文章详情页的强验证ETag和最后修改时间戳
 
+    只有文章修改、新增评论或请求的评论页不同时页面内容才会变化。
+    登录用户的页面包含评论表单，ETag中加入用户id，避免浏览器登录后继续使用匿名页面。
+    ETag只由页面内容决定，匿名访客第二次访问时CSRF cookie已经设置，也能得到304
+    """
+    latest_comment = Comment.objects.filter(article_id=article.id).order_by("-created")\
+        .values_list("created", flat=True).first()
+    last_modified = max(filter(None, [article.updated, latest_comment]))
+    raw = "%s:%s:%s:%s:%s:%s:%s" % (article.id, article.updated.timestamp(),
+                                    latest_comment.timestamp() if latest_comment else 0,
+                                    article.comments_count, page_num, page_size, request.user.pk)
+    etag = '"%s"' % hashlib.md5(raw.encode()).hexdigest()
+    return etag, int(last_modified.timestamp())
 
 
-
-
-
-
-
+def set_detail_validators(request, response, etag, last_modified):
+    """设置详情页的验证头和缓存策略"""
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    if request.user.is_authenticated:
+        # 登录用户的页面包含其CSRF令牌：只允许浏览器保存，每次使用前都要重新验证，共享缓存不能保存
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ("Cookie",))
+    else:
+        # 匿名访客的页面对所有人相同：共享缓存可以保存，每次使用前都要重新验证
+        patch_cache_control(response, public=True, no_cache=True)
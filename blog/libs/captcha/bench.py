@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Captcha micro-benchmark: caches, PIL vs NumPy stages, batch mode, output formats.
+
+Usage (from the blog directory):
+    python -m libs.captcha.bench --count 500 --workers 4
+"""
+import argparse
+import os
+import time
+
+from PIL import Image
+
+from libs.captcha.captcha import (load_font, glyph_mask, get_backend, render, render_executor, render_many,
+                                  encode, RenderSpec)
+
+# (format, quality, colors) combinations compared by run_formats
+FORMAT_CASES = (
+    ('JPEG', 75, None),
+    ('JPEG', 50, None),
+    ('JPEG', 35, None),
+    ('WEBP', 50, None),
+    ('WEBP', 35, None),
+    ('PNG', None, 32),
+    ('PNG', None, 16),
+    ('PNG', None, 8),
+)
+
+
+def clear_caches():
+    load_font.cache_clear()
+    glyph_mask.cache_clear()
+
+
+def run(count, before=None, backend='pil'):
+    """ Generate `count` captchas, calling `before` ahead of each one.
+
+    Returns captchas per second.
+    """
+    spec = RenderSpec(backend=backend)
+    start = time.perf_counter()
+    for _ in range(count):
+        if before is not None:
+            before()
+        render(spec)
+    return count / (time.perf_counter() - start)
+
+
+def run_stage(backend, stage, count):
+    """ Run one drawing stage `count` times on a fresh image.
+
+    Returns calls per second.
+    """
+    engine = get_backend(backend)
+    color = (40, 80, 120, 255)
+    image = Image.new('RGB', (200, 75), (255, 255, 255))
+    draw = getattr(engine, stage)
+    call = lambda: draw(image.copy(), color=color)
+    start = time.perf_counter()
+    for _ in range(count):
+        call()
+    return count / (time.perf_counter() - start)
+
+
+def run_batch(count, workers):
+    """ Generate `count` captchas with render_many on a warm pool.
+
+    Returns captchas per second.
+    """
+    with render_executor(workers) as executor:
+        # start the workers and warm their caches
+        render_many(workers * 20, executor=executor, chunk_size=20)
+        start = time.perf_counter()
+        render_many(count, executor=executor)
+        return count / (time.perf_counter() - start)
+
+
+def run_formats(count):
+    """ Encode the same `count` drawn captchas in every FORMAT_CASES combination.
+
+    Returns [(format, quality, colors, average bytes, encodes per second)].
+    """
+    images = [get_backend().draw()[1] for _ in range(count)]
+    results = []
+    for fmt, quality, colors in FORMAT_CASES:
+        start = time.perf_counter()
+        size = sum(len(encode(image, fmt, quality, colors)) for image in images)
+        results.append((fmt, quality, colors, size / count, count / (time.perf_counter() - start)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=300, help='captchas per run')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='processes for batch mode')
+    args = parser.parse_args()
+
+    # without caches: fonts are loaded and glyphs rendered for every captcha
+    uncached = run(args.count, before=clear_caches)
+    # warm the caches, then measure
+    clear_caches()
+    run(20)
+    cached = run(args.count)
+    print('uncached: %8.1f captchas/sec' % uncached)
+    print('cached:   %8.1f captchas/sec' % cached)
+    print('speedup:  %8.2fx' % (cached / uncached))
+    info = glyph_mask.cache_info()
+    print('glyph cache: %d entries, %d hits, %d misses' % (info.currsize, info.hits, info.misses))
+    for stage in ('noise', 'curve'):
+        pil = run_stage('pil', stage, args.count * 10)
+        vectorized = run_stage('numpy', stage, args.count * 10)
+        print('%-6s pil %9.1f/sec  numpy %9.1f/sec  %5.2fx' % (stage, pil, vectorized, vectorized / pil))
+    print('numpy backend: %8.1f captchas/sec' % run(args.count, backend='numpy'))
+    batch = run_batch(args.count, args.workers)
+    print('batch (%d workers): %8.1f captchas/sec' % (args.workers, batch))
+    for fmt, quality, colors, size, speed in run_formats(args.count):
+        option = 'quality %d' % quality if quality else '%d colors' % colors
+        print('%-4s %-10s %7.0f bytes  %8.1f encodes/sec' % (fmt, option, size, speed))
+
+
+if __name__ == '__main__':
+    main()
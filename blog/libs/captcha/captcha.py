@@ -6,6 +6,9 @@
 import random
 import string
 import os.path
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from io import BytesIO
 
 from PIL import Image
@@ -14,6 +17,48 @@ from PIL.ImageDraw import Draw
 from PIL.ImageFont import truetype
 
 
+CHARSET = string.ascii_uppercase + string.ascii_uppercase + '3456789'
+FONT_DIR = os.path.join(os.path.dirname(__file__), 'fonts')
+DEFAULT_FONTS = tuple(os.path.join(FONT_DIR, font) for font in ['Arial.ttf', 'Georgia.ttf', 'actionj.ttf'])
+
+# Everything one captcha needs; fields left as None are chosen at random.
+# backend: 'pil', or 'numpy' for the vectorised stages in libs.captcha.vectorized.
+# quality: JPEG / WEBP quality, colors: PNG palette size, None for the defaults below.
+# seed: draw from a private random.Random(seed) instead of the shared `random`
+# module, the same spec then gives the same image in any thread.
+RenderSpec = namedtuple('RenderSpec', ['width', 'height', 'text', 'color', 'fonts', 'fmt', 'backend',
+                                       'quality', 'colors', 'seed'],
+                        defaults=(200, 75, None, None, None, 'JPEG', 'pil', None, None, None))
+
+# Output formats and their content types.
+FORMATS = {'JPEG': 'image/jpeg', 'PNG': 'image/png', 'WEBP': 'image/webp'}
+# A captcha is a few flat colours, it stays legible well below PIL's
+# default JPEG quality of 75 and with a small PNG palette.
+DEFAULT_QUALITY = {'JPEG': 50, 'WEBP': 50}
+DEFAULT_COLORS = 16
+
+
+@lru_cache(maxsize=64)
+def load_font(name, size):
+    """ Load a TrueType font once per (name, size)
+    """
+    return truetype(name, size)
+
+
+@lru_cache(maxsize=4096)
+def glyph_mask(name, size, char):
+    """ Render a character once per (font, size) as a cropped 'L' mask.
+
+    The mask is independent of the text colour, it is colourised per
+    captcha with a single paste. Callers must not modify the result.
+    """
+    font = load_font(name, size)
+    mask = Image.new('L', font.getsize(char), 0)
+    Draw(mask).text((0, 0), char, font=font, fill=255)
+    bbox = mask.getbbox()
+    return mask.crop(bbox) if bbox else mask
+
+
 class Bezier:
     def __init__(self):
         self.tsequence = tuple([t / 20.0 for t in range(21)])
@@ -26,7 +71,7 @@ class Bezier:
         x, numerator = 1, n
         for denominator in range(1, n // 2 + 1):
             x *= numerator
-            x /= denominator
+            x //= denominator
             result.append(x)
             numerator -= 1
         if n & 1 == 0:
@@ -68,36 +113,35 @@ class Captcha(object):
 
     def initialize(self, width=200, height=75, color=None, text=None, fonts=None):
         # self.image = Image.new('RGB', (width, height), (255, 255, 255))
-        self._text = text if text else random.sample(string.ascii_uppercase + string.ascii_uppercase + '3456789', 4)
-        self.fonts = fonts if fonts else \
-            [os.path.join(self._dir, 'fonts', font) for font in ['Arial.ttf', 'Georgia.ttf', 'actionj.ttf']]
+        self._text = text if text else random.sample(CHARSET, 4)
+        self.fonts = fonts if fonts else list(DEFAULT_FONTS)
         self.width = width
         self.height = height
         self._color = color if color else self.random_color(0, 200, random.randint(220, 255))
 
     @staticmethod
-    def random_color(start, end, opacity=None):
-        red = random.randint(start, end)
-        green = random.randint(start, end)
-        blue = random.randint(start, end)
+    def random_color(start, end, opacity=None, rng=random):
+        red = rng.randint(start, end)
+        green = rng.randint(start, end)
+        blue = rng.randint(start, end)
         if opacity is None:
             return red, green, blue
         return red, green, blue, opacity
 
     # draw image
 
-    def background(self, image):
-        Draw(image).rectangle([(0, 0), image.size], fill=self.random_color(238, 255))
+    def background(self, image, rng=random):
+        Draw(image).rectangle([(0, 0), image.size], fill=self.random_color(238, 255, rng=rng))
         return image
 
     @staticmethod
     def smooth(image):
         return image.filter(ImageFilter.SMOOTH)
 
-    def curve(self, image, width=4, number=6, color=None):
+    def curve(self, image, width=4, number=6, color=None, rng=random):
         dx, height = image.size
         dx /= number
-        path = [(dx * i, random.randint(0, height))
+        path = [(dx * i, rng.randint(0, height))
                 for i in range(1, number)]
         bcoefs = self._bezier.make_bezier(number - 1)
         points = []
@@ -107,7 +151,7 @@ class Captcha(object):
         Draw(image).line(points, fill=color if color else self._color, width=width)
         return image
 
-    def noise(self, image, number=50, level=2, color=None):
+    def noise(self, image, number=50, level=2, color=None, rng=random):
         width, height = image.size
         dx = width / 10
         width -= dx
@@ -115,28 +159,27 @@ class Captcha(object):
         height -= dy
         draw = Draw(image)
         for i in range(number):
-            x = int(random.uniform(dx, width))
-            y = int(random.uniform(dy, height))
+            x = int(rng.uniform(dx, width))
+            y = int(rng.uniform(dy, height))
             draw.line(((x, y), (x + level, y)), fill=color if color else self._color, width=level)
         return image
 
-    def text(self, image, fonts, font_sizes=None, drawings=None, squeeze_factor=0.75, color=None):
+    def text(self, image, fonts, font_sizes=None, drawings=None, squeeze_factor=0.75, color=None, chars=None,
+             rng=random):
         color = color if color else self._color
-        fonts = tuple([truetype(name, size)
+        chars = chars if chars else self._text
+        fonts = tuple([(name, size)
                        for name in fonts
                        for size in font_sizes or (65, 70, 75)])
-        draw = Draw(image)
         char_images = []
-        for c in self._text:
-            font = random.choice(fonts)
-            c_width, c_height = draw.textsize(c, font=font)
-            char_image = Image.new('RGB', (c_width, c_height), (0, 0, 0))
-            char_draw = Draw(char_image)
-            char_draw.text((0, 0), c, font=font, fill=color)
-            char_image = char_image.crop(char_image.getbbox())
+        for c in chars:
+            name, size = rng.choice(fonts)
+            mask = glyph_mask(name, size, c)
+            char_image = Image.new('RGB', mask.size, (0, 0, 0))
+            char_image.paste(color[:3], (0, 0) + mask.size, mask)
             for drawing in drawings:
                 d = getattr(self, drawing)
-                char_image = d(char_image)
+                char_image = d(char_image, rng=rng)
             char_images.append(char_image)
         width, height = image.size
         offset = int((width - sum(int(i.size[0] * squeeze_factor)
@@ -153,14 +196,14 @@ class Captcha(object):
 
     # draw text
     @staticmethod
-    def warp(image, dx_factor=0.27, dy_factor=0.21):
+    def warp(image, dx_factor=0.27, dy_factor=0.21, rng=random):
         width, height = image.size
         dx = width * dx_factor
         dy = height * dy_factor
-        x1 = int(random.uniform(-dx, dx))
-        y1 = int(random.uniform(-dy, dy))
-        x2 = int(random.uniform(-dx, dx))
-        y2 = int(random.uniform(-dy, dy))
+        x1 = int(rng.uniform(-dx, dx))
+        y1 = int(rng.uniform(-dy, dy))
+        x2 = int(rng.uniform(-dx, dx))
+        y2 = int(rng.uniform(-dy, dy))
         image2 = Image.new('RGB',
                            (width + abs(x1) + abs(x2),
                             height + abs(y1) + abs(y2)))
@@ -174,45 +217,147 @@ class Captcha(object):
              width2 - x2, -y1))
 
     @staticmethod
-    def offset(image, dx_factor=0.1, dy_factor=0.2):
+    def offset(image, dx_factor=0.1, dy_factor=0.2, rng=random):
         width, height = image.size
-        dx = int(random.random() * width * dx_factor)
-        dy = int(random.random() * height * dy_factor)
+        dx = int(rng.random() * width * dx_factor)
+        dy = int(rng.random() * height * dy_factor)
         image2 = Image.new('RGB', (width + dx, height + dy))
         image2.paste(image, (dx, dy))
         return image2
 
     @staticmethod
-    def rotate(image, angle=25):
+    def rotate(image, angle=25, rng=random):
         return image.rotate(
-            random.uniform(-angle, angle), Image.BILINEAR, expand=1)
+            rng.uniform(-angle, angle), Image.BILINEAR, expand=1)
 
     def captcha(self, path=None, fmt='JPEG'):
         """Create a captcha.
 
         Args:
             path: save path, default None.
-            fmt: image format, PNG / JPEG.
+            fmt: image format, JPEG / PNG / WEBP.
         Returns:
             A tuple, (text, StringIO.value).
             For example:
                 ('JGW9', '\x89PNG\r\n\x1a\n\x00\x00\x00\r...')
 
         """
-        image = Image.new('RGB', (self.width, self.height), (255, 255, 255))
-        image = self.background(image)
-        image = self.text(image, self.fonts, drawings=['warp', 'rotate', 'offset'])
-        image = self.curve(image)
-        image = self.noise(image)
+        return self.render(RenderSpec(self.width, self.height, self._text, self._color, self.fonts, fmt))
+
+    def render(self, spec=None):
+        """Create a captcha from a render spec.
+
+        Nothing is stored on the instance, so this is safe to call from
+        several threads at once.
+
+        Args:
+            spec: RenderSpec, default RenderSpec().
+        Returns:
+            A tuple, (text, image bytes).
+        """
+        spec = spec or RenderSpec()
+        text, image = self.draw(spec)
+        return text, encode(image, spec.fmt, spec.quality, spec.colors)
+
+    def draw(self, spec=None):
+        """Draw a captcha from a render spec without encoding it.
+
+        Returns:
+            A tuple, (text, RGB image).
+        """
+        spec = spec or RenderSpec()
+        rng = random if spec.seed is None else random.Random(spec.seed)
+        chars = spec.text or rng.sample(CHARSET, 4)
+        color = spec.color or self.random_color(0, 200, rng.randint(220, 255), rng=rng)
+        image = Image.new('RGB', (spec.width, spec.height), (255, 255, 255))
+        image = self.background(image, rng=rng)
+        image = self.text(image, spec.fonts or DEFAULT_FONTS, drawings=['warp', 'rotate', 'offset'],
+                          color=color, chars=chars, rng=rng)
+        image = self.curve(image, color=color, rng=rng)
+        image = self.noise(image, color=color, rng=rng)
         image = self.smooth(image)
-        text = "".join(self._text)
-        out = BytesIO()
-        image.save(out, format=fmt)
-        return text, out.getvalue()
+        return "".join(chars), image
 
     def generate_captcha(self):
-        self.initialize()
-        return self.captcha("")
+        return self.render()
+
+
+def encode(image, fmt='JPEG', quality=None, colors=None):
+    """Encode a rendered captcha.
+
+    Args:
+        image: RGB image.
+        fmt: JPEG / PNG / WEBP.
+        quality: JPEG / WEBP quality, default DEFAULT_QUALITY.
+        colors: PNG palette size, default DEFAULT_COLORS.
+    Returns:
+        The image bytes.
+    """
+    fmt = fmt.upper()
+    out = BytesIO()
+    if fmt == 'PNG':
+        image = image.quantize(colors or DEFAULT_COLORS, method=Image.FASTOCTREE)
+        image.save(out, format=fmt, optimize=True)
+    elif fmt == 'JPEG':
+        image.save(out, format=fmt, quality=quality or DEFAULT_QUALITY[fmt], optimize=True)
+    elif fmt == 'WEBP':
+        image.save(out, format=fmt, quality=quality or DEFAULT_QUALITY[fmt], method=4)
+    else:
+        raise ValueError('unknown captcha format: %r' % fmt)
+    return out.getvalue()
+
+
+def get_backend(name='pil'):
+    """The Captcha instance rendering with the named backend."""
+    if name == 'numpy':
+        from libs.captcha.vectorized import captcha as backend
+        return backend
+    if name != 'pil':
+        raise ValueError('unknown captcha backend: %r' % name)
+    return captcha
+
+
+def render(spec=None):
+    """Stateless, thread-safe captcha rendering, see Captcha.render."""
+    spec = spec or RenderSpec()
+    return get_backend(spec.backend).render(spec)
+
+
+def _seed_worker():
+    # forked workers inherit the parent's random state
+    random.seed()
+
+
+def _render_chunk(args):
+    count, spec = args
+    return [render(spec) for _ in range(count)]
+
+
+def render_executor(workers=None):
+    """A process pool for render_many, reuse it across batches."""
+    return ProcessPoolExecutor(max_workers=workers, initializer=_seed_worker)
+
+
+def render_many(count, spec=None, workers=None, chunk_size=50, executor=None):
+    """Render `count` captchas in parallel across processes.
+
+    Args:
+        count: number of captchas.
+        spec: RenderSpec shared by all captchas, random fields stay random
+            (leave seed as None, a seeded spec gives `count` copies).
+        workers: number of processes, default os.cpu_count().
+        chunk_size: captchas rendered per task.
+        executor: pool from render_executor(), a temporary one is
+            created when omitted.
+    Returns:
+        A list of (text, image bytes).
+    """
+    chunks = [(min(chunk_size, count - start), spec) for start in range(0, count, chunk_size)]
+    if executor is None:
+        with render_executor(workers) as executor:
+            return [item for chunk in executor.map(_render_chunk, chunks) for item in chunk]
+    return [item for chunk in executor.map(_render_chunk, chunks) for item in chunk]
+
 
 captcha = Captcha.instance()
 
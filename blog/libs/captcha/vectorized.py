@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""NumPy backend for the captcha engine.
+
+Same pipeline and output as Captcha, with two stages moved to NumPy:
+
+    noise  the dot positions are still drawn one by one from `random`,
+           then all dots are placed with one fancy-indexed assignment
+    curve  Bezier points come from cached Bernstein coefficients, summed
+           term by term (one array op per control point, not per step)
+
+Measured with libs.captcha.bench (median of 7 interleaved rounds): curve
+is about 2.1x faster than Captcha.curve and noise about 1.05x, but both
+are a small part of a full captcha, so whole captchas render at the same
+rate as the PIL backend (about 395/sec here), and CAPTCHA_BACKEND
+defaults to 'pil'.
+
+warp stays on Captcha.warp. Sampling the warp grid in NumPy was measured
+at about 5x slower than PIL's C quad transform on glyph-sized images.
+Skipping the padded copy by shifting the quad was also slower once the
+corners went through NumPy, and it rounded differently at the glyph edges.
+
+Random values come from the same source (the `random` module or the
+spec's seeded Random) in the same order as Captcha, so both backends draw
+the same captcha for a given seed.
+"""
+import random
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image
+from PIL.ImageDraw import Draw
+
+from libs.captcha.captcha import Bezier, Captcha
+
+
+@lru_cache(maxsize=16)
+def bezier_matrix(n, steps=20):
+    """ (steps + 1) x n Bernstein coefficients, same values as Bezier.make_bezier.
+    """
+    t = (np.arange(steps + 1) / steps)[:, None]
+    i = np.arange(n)
+    return np.array(Bezier().pascal_row(n - 1), dtype=np.float64) * t ** i * (1 - t) ** (n - 1 - i)
+
+
+@lru_cache(maxsize=8)
+def dot_offsets(level):
+    """ Pixels covered by Draw.line(((x, y), (x + level, y)), width=level).
+    """
+    image = Image.new('L', (level * 3 + 1, level * 3 + 1), 0)
+    Draw(image).line(((level, level), (level * 2, level)), fill=255, width=level)
+    dy, dx = np.nonzero(np.asarray(image))
+    return dy - level, dx - level
+
+
+class NumpyCaptcha(Captcha):
+
+    def curve(self, image, width=4, number=6, color=None, rng=random):
+        dx, height = image.size
+        dx /= number
+        path = np.empty((number - 1, 2))
+        path[:, 0] = dx * np.arange(1, number)
+        path[:, 1] = [rng.randint(0, height) for _ in range(1, number)]
+        coefs = bezier_matrix(number - 1)
+        # accumulate term by term like Captcha.curve so the points match exactly
+        points = np.zeros((len(coefs), 2))
+        for i in range(number - 1):
+            points += coefs[:, i:i + 1] * path[i]
+        Draw(image).line(points.ravel().tolist(), fill=color if color else self._color, width=width)
+        return image
+
+    def noise(self, image, number=50, level=2, color=None, rng=random):
+        width, height = image.size
+        dx = width / 10
+        dy = height / 10
+        width -= dx
+        height -= dy
+        dots = np.array([(rng.uniform(dx, width), rng.uniform(dy, height)) for _ in range(number)])
+        xs, ys = dots.astype(np.intp).T
+        offset_y, offset_x = dot_offsets(level)
+        xs = (xs[:, None] + offset_x).ravel()
+        ys = (ys[:, None] + offset_y).ravel()
+        inside = (xs < image.width) & (ys < image.height)
+        pixels = np.array(image)
+        pixels[ys[inside], xs[inside]] = (color if color else self._color)[:3]
+        return Image.fromarray(pixels)
+
+
+captcha = NumpyCaptcha()
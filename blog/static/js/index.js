@@ -6,7 +6,9 @@ var vm = new Vue({
         host,
         show_menu:false,
         is_login:true,
-        username:''
+        username:'',
+        suggestions:[],
+        suggest_timer:null
     },
     mounted(){
         this.username=getCookie('username');
@@ -18,5 +20,32 @@ var vm = new Vue({
         show_menu_click:function(){
             this.show_menu = !this.show_menu ;
         },
+        //输入搜索内容时补全文章标题，停止输入100毫秒后再请求
+        suggest_input:function(event){
+            var q = event.target.value.trim();
+            clearTimeout(this.suggest_timer);
+            if (!q) {
+                this.suggestions = [];
+                return;
+            }
+            this.suggest_timer = setTimeout(() => {
+                var url = this.host + '/suggest/?q=' + encodeURIComponent(q);
+                axios.get(url, {
+                    responseType: 'json'
+                })
+                    .then(response => {
+                        if (response.data.code == '0') {
+                            this.suggestions = response.data.suggestions;
+                        }
+                    })
+                    .catch(error => {
+                        console.log(error.response);
+                    })
+            }, 100);
+        },
+        //输入框失去焦点时隐藏补全列表
+        hide_suggestions:function(){
+            this.suggestions = [];
+        },
     }
 });
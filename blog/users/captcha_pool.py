@@ -0,0 +1,130 @@
+"""预先生成的图片验证码池
+
+生成验证码需要加载字体、扭曲旋转、滤波和图片编码，是最慢的匿名接口，也容易被用来消耗CPU。
+fill_captcha_pool命令在单独的进程中持续生成验证码，每种图片格式保存在redis的一个列表中：
+    captcha:pool:<格式>   list ["<验证码文本>\x00<图片数据>"]
+ImageCodeView按请求头Accept选择图片格式，从对应的列表中取出一个验证码使用，列表为空时才在请求中现场生成。
+取出(hit)、现场生成(miss)、生产(produced)的次数通过StatsCounter汇总到redis中。
+"""
+import logging
+
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from home.stats import StatsCounter
+from libs.captcha.captcha import render, render_many, RenderSpec, FORMATS
+
+logger = logging.getLogger("django")
+
+CAPTCHA_POOL_KEY = "captcha:pool:%s"
+
+# 取出(hit)、现场生成(miss)、生产(produced)的次数
+counter = StatsCounter("captcha:pool:stats")
+
+
+def pool_key(fmt):
+    return CAPTCHA_POOL_KEY % fmt.lower()
+
+
+def pool_formats():
+    """需要预先生成的图片格式：Accept中可以选择的格式和默认格式"""
+    return list(dict.fromkeys(settings.CAPTCHA_FORMATS + (settings.CAPTCHA_FORMAT,)))
+
+
+def negotiate_format(accept):
+    """根据请求头Accept选择图片格式
+
+    按settings.CAPTCHA_FORMATS的顺序选择浏览器明确声明支持的格式，
+    只有image/*或*/*时使用所有浏览器都支持的settings.CAPTCHA_FORMAT。
+    """
+    accepted = set()
+    for item in (accept or "").split(","):
+        media_type, *params = item.split(";")
+        quality = 1
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    pass
+        # q=0表示不接受该格式
+        if quality > 0:
+            accepted.add(media_type.strip().lower())
+    for fmt in settings.CAPTCHA_FORMATS:
+        if FORMATS[fmt] in accepted:
+            return fmt
+    return settings.CAPTCHA_FORMAT
+
+
+def render_spec(fmt):
+    """按settings中的绘制方式和编码参数生成指定格式验证码的RenderSpec"""
+    return RenderSpec(fmt=fmt, backend=settings.CAPTCHA_BACKEND,
+                      quality={"JPEG": settings.CAPTCHA_JPEG_QUALITY, "WEBP": settings.CAPTCHA_WEBP_QUALITY}.get(fmt),
+                      colors=settings.CAPTCHA_PNG_COLORS)
+
+
+def pop_captcha(fmt):
+    """从验证码池中取出一个指定格式的验证码，池为空或redis不可用时返回None"""
+    try:
+        item = get_redis_connection("default").lpop(pool_key(fmt))
+    except Exception as e:
+        logger.error(e)
+        return None
+    if item is None:
+        return None
+    text, image = item.split(b"\x00", 1)
+    return text.decode(), image
+
+
+def get_captcha(fmt=None):
+    """获取一个验证码(文本, 图片数据)，优先使用验证码池
+
+    :param fmt: 图片格式，默认settings.CAPTCHA_FORMAT
+    """
+    fmt = fmt or settings.CAPTCHA_FORMAT
+    result = pop_captcha(fmt)
+    if result is not None:
+        counter.incr("hit")
+        return result
+    counter.incr("miss")
+    return render(render_spec(fmt))
+
+
+def pool_depth(fmt=None):
+    """验证码池中剩余的验证码数量，不指定格式时返回所有格式的总数"""
+    redis_conn = get_redis_connection("default")
+    if fmt is not None:
+        return redis_conn.llen(pool_key(fmt))
+    return sum(redis_conn.llen(pool_key(fmt)) for fmt in pool_formats())
+
+
+def fill_pool(limit, executor=None, fmt=None):
+    """向验证码池补充验证码，每种格式池中数量不超过settings.CAPTCHA_POOL_SIZE
+
+    :param limit: 本次每种格式最多生成的数量
+    :param executor: render_executor()创建的进程池，指定时在多个进程中并行生成
+    :param fmt: 图片格式，默认补充pool_formats()中的所有格式
+    :return: 本次生成的数量
+    """
+    if fmt is None:
+        return sum(fill_pool(limit, executor, fmt) for fmt in pool_formats())
+    redis_conn = get_redis_connection("default")
+    key = pool_key(fmt)
+    count = min(limit, settings.CAPTCHA_POOL_SIZE - redis_conn.llen(key))
+    if count <= 0:
+        return 0
+    spec = render_spec(fmt)
+    if executor is not None:
+        results = render_many(count, spec, executor=executor)
+    else:
+        results = [render(spec) for _ in range(count)]
+    items = [text.encode() + b"\x00" + image for text, image in results]
+    pipeline = redis_conn.pipeline()
+    pipeline.rpush(key, *items)
+    # 多个生产进程同时补充时避免超出上限，丢弃最新生成的部分
+    pipeline.ltrim(key, 0, settings.CAPTCHA_POOL_SIZE - 1)
+    pipeline.execute()
+    for _ in range(count):
+        counter.incr("produced")
+    return count
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from users.captcha_pool import counter, pool_depth, pool_formats
+
+
+class Command(BaseCommand):
+    help = "查看验证码池的剩余数量和命中统计(各进程每10秒汇总一次)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reset", action="store_true", help="查看后清空统计")
+
+    def handle(self, *args, **options):
+        result = counter.totals()
+        for fmt in pool_formats():
+            self.stdout.write("池中数量(%s): %d" % (fmt, pool_depth(fmt)))
+        for name in ("hit", "miss", "produced"):
+            self.stdout.write("%s: %d" % (name, result.get(name, 0)))
+        total = result.get("hit", 0) + result.get("miss", 0)
+        if total:
+            self.stdout.write("命中率: %.2f%%" % (result.get("hit", 0) * 100.0 / total))
+        if options["reset"]:
+            counter.reset()
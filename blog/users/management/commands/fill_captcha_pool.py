@@ -0,0 +1,55 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from libs.captcha.captcha import render_executor
+from users.captcha_pool import fill_pool, pool_depth
+
+logger = logging.getLogger("django")
+
+
+class Command(BaseCommand):
+    help = "持续向redis中的验证码池补充预先生成的验证码，可以启动多个进程"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="补满一次后退出，用于crontab")
+        parser.add_argument("--rate", type=int, default=settings.CAPTCHA_POOL_REFILL_RATE,
+                            help="每种图片格式每秒最多生成的验证码数量")
+        parser.add_argument("--workers", type=int, default=settings.CAPTCHA_POOL_WORKERS,
+                            help="并行生成验证码的进程数，1表示在当前进程中生成")
+
+    def handle(self, *args, **options):
+        executor = render_executor(options["workers"]) if options["workers"] > 1 else None
+        try:
+            self.fill(max(1, options["rate"]), options["once"], executor)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    def fill(self, rate, once, executor):
+        if once:
+            total = 0
+            while True:
+                count = fill_pool(rate, executor)
+                if not count:
+                    break
+                total += count
+            self.stdout.write("已生成验证码：%d，池中数量：%d" % (total, pool_depth()))
+            return
+        self.stdout.write("开始补充验证码池，上限：%d，每秒最多生成：%d" % (settings.CAPTCHA_POOL_SIZE, rate))
+        backoff = settings.CAPTCHA_POOL_CHECK_INTERVAL
+        while True:
+            start = time.time()
+            try:
+                fill_pool(rate, executor)
+            except Exception as e:
+                # redis不可用或生成失败时记录日志，等待时间逐次翻倍，不退出生产进程
+                logger.error(e)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, settings.CAPTCHA_POOL_MAX_BACKOFF)
+                continue
+            backoff = settings.CAPTCHA_POOL_CHECK_INTERVAL
+            # 每秒最多生成rate个，池已满时等待下一次检查
+            time.sleep(max(settings.CAPTCHA_POOL_CHECK_INTERVAL - (time.time() - start), 0))
@@ -1,3 +1,215 @@
-from django.test import TestCase
+import random
+from io import StringIO
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 
-# Create your tests here.
+from PIL import Image
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django_redis import get_redis_connection
+
+from libs.captcha.captcha import DEFAULT_FONTS, RenderSpec, get_backend, glyph_mask, load_font, render
+from users.captcha_pool import counter, fill_pool, get_captcha, negotiate_format, pool_key
+from users.management.commands.fill_captcha_pool import Command as FillCaptchaPoolCommand
+from utils.testing import redis_test_settings
+
+
+class NegotiateFormatTest(TestCase):
+    """按请求头Accept选择验证码图片格式"""
+    def test_explicit_type(self):
+        self.assertEqual(negotiate_format("image/avif,image/webp,*/*"), "WEBP")
+        self.assertEqual(negotiate_format("image/webp;q=0.8, image/png"), "WEBP")
+
+    def test_wildcard_uses_default(self):
+        self.assertEqual(negotiate_format("*/*"), "JPEG")
+        self.assertEqual(negotiate_format("image/*"), "JPEG")
+        self.assertEqual(negotiate_format(""), "JPEG")
+        self.assertEqual(negotiate_format(None), "JPEG")
+
+    def test_zero_quality_rejected(self):
+        self.assertEqual(negotiate_format("image/webp;q=0,image/*"), "JPEG")
+        self.assertEqual(negotiate_format("image/webp;q=0.0"), "JPEG")
+        self.assertEqual(negotiate_format("image/webp;q=abc"), "WEBP")
+
+    @override_settings(CAPTCHA_FORMATS=("PNG",))
+    def test_configured_formats(self):
+        self.assertEqual(negotiate_format("image/png"), "PNG")
+        self.assertEqual(negotiate_format("image/webp"), "JPEG")
+
+
+@redis_test_settings
+class ImageCodeViewTest(TestCase):
+    """验证码响应按Accept变化且不能被缓存"""
+    def setUp(self):
+        self.redis = get_redis_connection("default")
+        for fmt in ("JPEG", "WEBP"):
+            self.redis.delete(pool_key(fmt))
+            self.redis.rpush(pool_key(fmt), b"ABCD\x00" + fmt.encode())
+
+    def tearDown(self):
+        self.redis.delete(pool_key("JPEG"), pool_key("WEBP"), "img:test")
+
+    def get(self, accept):
+        return self.client.get(reverse("users:imagecode"), {"uuid": "test"}, HTTP_ACCEPT=accept)
+
+    def test_negotiated_response(self):
+        response = self.get("image/webp,*/*")
+        self.assertEqual(response["Content-Type"], "image/webp")
+        self.assertEqual(response.content, b"WEBP")
+        self.assertIn("no-store", response["Cache-Control"])
+        self.assertIn("Accept", response["Vary"])
+        self.assertEqual(self.redis.get("img:test"), b"ABCD")
+
+        response = self.get("*/*")
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+        self.assertEqual(response.content, b"JPEG")
+
+    def test_missing_uuid(self):
+        response = self.client.get(reverse("users:imagecode"))
+        self.assertEqual(response.status_code, 400)
+
+
+@redis_test_settings
+@override_settings(CAPTCHA_POOL_SIZE=5, CAPTCHA_POOL_CHECK_INTERVAL=1, CAPTCHA_POOL_MAX_BACKOFF=3)
+class CaptchaPoolTest(TestCase):
+    """验证码池的补充上限、取出和现场生成"""
+    def setUp(self):
+        self.redis = get_redis_connection("default")
+        self.key = pool_key("JPEG")
+        self.redis.delete(self.key)
+
+    def tearDown(self):
+        self.redis.delete(self.key)
+
+    def test_fill_capped_per_format(self):
+        self.redis.rpush(self.key, b"OLD\x00old")
+        self.assertEqual(fill_pool(2, fmt="JPEG"), 2)
+        self.assertEqual(self.redis.llen(self.key), 3)
+        # 每种格式池中数量不超过CAPTCHA_POOL_SIZE
+        self.assertEqual(fill_pool(10, fmt="JPEG"), 2)
+        self.assertEqual(fill_pool(10, fmt="JPEG"), 0)
+        self.assertEqual(self.redis.llen(self.key), 5)
+        self.assertEqual(self.redis.lindex(self.key, 0), b"OLD\x00old")
+
+    def test_fill_trims_concurrent_producers(self):
+        # 生成期间其他生产进程补满了验证码池，丢弃本次生成的部分
+        def render(spec):
+            self.redis.rpush(self.key, b"OTHER\x00other")
+            return "ABCD", b"image"
+        with mock.patch("users.captcha_pool.render", side_effect=render):
+            self.assertEqual(fill_pool(10, fmt="JPEG"), 5)
+        self.assertEqual(self.redis.lrange(self.key, 0, -1), [b"OTHER\x00other"] * 5)
+
+    def test_get_captcha_pops_then_renders(self):
+        self.redis.rpush(self.key, b"ABCD\x00image")
+        before = counter.local()
+        self.assertEqual(get_captcha("JPEG"), ("ABCD", b"image"))
+        self.assertEqual(self.redis.llen(self.key), 0)
+        text, image = get_captcha("JPEG")
+        self.assertEqual(len(text), 4)
+        self.assertEqual(Image.open(BytesIO(image)).format, "JPEG")
+        after = counter.local()
+        self.assertEqual(after.get("hit", 0) - before.get("hit", 0), 1)
+        self.assertEqual(after.get("miss", 0) - before.get("miss", 0), 1)
+
+    def test_get_captcha_without_redis(self):
+        with mock.patch("users.captcha_pool.get_redis_connection", side_effect=ConnectionError("down")), \
+                self.assertLogs("django", "ERROR"):
+            text, image = get_captcha("JPEG")
+        self.assertEqual(len(text), 4)
+        self.assertEqual(Image.open(BytesIO(image)).format, "JPEG")
+
+    def test_fill_loop_survives_errors(self):
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            if len(sleeps) == 5:
+                raise KeyboardInterrupt
+        results = [ConnectionError("down")] * 3 + [3, ConnectionError("down")]
+        with mock.patch("users.management.commands.fill_captcha_pool.fill_pool", side_effect=results), \
+                mock.patch("users.management.commands.fill_captcha_pool.time.sleep", side_effect=sleep), \
+                self.assertLogs("django", "ERROR") as logs:
+            with self.assertRaises(KeyboardInterrupt):
+                FillCaptchaPoolCommand(stdout=StringIO()).fill(10, False, None)
+        self.assertEqual(len(logs.output), 4)
+        # 失败后等待时间逐次翻倍，不超过CAPTCHA_POOL_MAX_BACKOFF，成功后恢复
+        self.assertEqual(sleeps[:3], [1, 2, 3])
+        self.assertLessEqual(sleeps[3], 1)
+        self.assertEqual(sleeps[4], 1)
+
+
+class GlyphCacheTest(TestCase):
+    """字形只渲染一次，缓存不影响生成的验证码"""
+    def test_glyph_mask_cached_and_cropped(self):
+        glyph_mask.cache_clear()
+        mask = glyph_mask(DEFAULT_FONTS[0], 70, "A")
+        self.assertIs(glyph_mask(DEFAULT_FONTS[0], 70, "A"), mask)
+        self.assertEqual(glyph_mask.cache_info().hits, 1)
+        self.assertEqual(mask.mode, "L")
+        self.assertEqual(mask.getbbox(), (0, 0) + mask.size)
+
+    def test_cached_render_unchanged(self):
+        results = []
+        for _ in range(2):
+            glyph_mask.cache_clear()
+            load_font.cache_clear()
+            for _ in range(2):
+                random.seed(7)
+                results.append(render(RenderSpec(text="AB3C", fmt="PNG")))
+        self.assertEqual(len(set(results)), 1)
+
+
+class RenderSpecTest(TestCase):
+    """按RenderSpec无状态地生成验证码"""
+    def test_spec_fields(self):
+        text, data = render(RenderSpec(width=120, height=40, text="AB3C", fmt="PNG"))
+        self.assertEqual(text, "AB3C")
+        image = Image.open(BytesIO(data))
+        self.assertEqual((image.format, image.size), ("PNG", (120, 40)))
+        text, data = render()
+        self.assertEqual(len(text), 4)
+        self.assertEqual(Image.open(BytesIO(data)).format, "JPEG")
+        with self.assertRaises(ValueError):
+            render(RenderSpec(fmt="GIF"))
+
+    def test_render_does_not_touch_instance(self):
+        engine = get_backend("pil")
+        engine.initialize(text="WXYZ")
+        render(RenderSpec(text="AB3C"))
+        self.assertEqual(engine.captcha()[0], "WXYZ")
+
+    def test_seeded_spec(self):
+        spec = RenderSpec(fmt="PNG", seed=7)
+        self.assertEqual(render(spec), render(spec))
+        self.assertNotEqual(render(spec)[1], render(spec._replace(seed=8))[1])
+
+    def test_concurrent_renders(self):
+        # 每个spec使用自己的种子，多线程同时生成的图片与单线程逐个生成的完全相同
+        specs = [RenderSpec(fmt="PNG", backend=backend, seed=seed)
+                 for seed in range(20) for backend in ("pil", "numpy")]
+        expected = [render(spec) for spec in specs]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            self.assertEqual(list(executor.map(render, specs)), expected)
+        self.assertEqual(len({image for _, image in expected}), len(specs) // 2)
+
+
+class NumpyCaptchaTest(TestCase):
+    """NumPy后端与PIL后端使用相同的随机数，同一个种子生成相同的验证码"""
+    def test_same_output_as_pil(self):
+        for seed in range(20):
+            results = []
+            for backend in ("pil", "numpy"):
+                random.seed(seed)
+                results.append(render(RenderSpec(backend=backend, fmt="PNG")))
+            self.assertEqual(results[0], results[1])
+
+    def test_stages_match_pil(self):
+        for stage in ("noise", "curve"):
+            images = []
+            for engine in (get_backend("pil"), get_backend("numpy")):
+                random.seed(1)
+                image = Image.new("RGB", (200, 75), (255, 255, 255))
+                images.append(getattr(engine, stage)(image, color=(40, 80, 120, 255)).tobytes())
+            self.assertEqual(images[0], images[1], stage)
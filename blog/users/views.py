@@ -1,7 +1,9 @@
 from django.shortcuts import render, redirect
 from django.views import View
 from django.http import HttpResponseBadRequest, HttpResponse, JsonResponse
-from libs.captcha.captcha import captcha
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from users.captcha_pool import get_captcha, negotiate_format
+from libs.captcha.captcha import FORMATS
 from django_redis import get_redis_connection
 from utils.response_code import RETCODE
 import logging
@@ -10,11 +12,13 @@ from random import randint
 from libs.yuntongxun.sms import CCP
 import re
 from users.models import User
-from django.db import DatabaseError
+from django.db import DatabaseError, transaction
 from django.urls import reverse
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.mixins import LoginRequiredMixin
 from home.models import ArticleCategory, Article
+from home.categories import get_categories
+from home.tags import split_tags, join_tags, set_article_tags
 
 
 class RegisterView(View):
@@ -83,14 +87,19 @@ class ImageCodeView(View):
         if uuid is None:
             return HttpResponseBadRequest("请求参数错误")
         # 3.处理数据：
-        # 3.1 获取验证码内容和验证码图片二进制数据
-        text, image = captcha.generate_captcha()
+        # 3.1 获取验证码内容和验证码图片二进制数据：按请求头Accept选择图片格式，
+        # 优先使用预先生成的验证码池，池为空时现场生成
+        fmt = negotiate_format(request.META.get("HTTP_ACCEPT"))
+        text, image = get_captcha(fmt)
         # 3.2 将图片内容保存到redis中，并设置过期时间
         redis_conn = get_redis_connection("default")
         # setex(键key,过期时间seconds,值value)
         redis_conn.setex("img:%s" % uuid, 300, text)
-        # 4.返回响应：将生成的图片以content_type为image/jpeg的形式返回请求
-        return HttpResponse(image, content_type="image/jpeg")
+        # 4.返回响应：每次请求都是新的验证码，禁止缓存；图片格式取决于Accept
+        response = HttpResponse(image, content_type=FORMATS[fmt])
+        patch_cache_control(response, no_store=True)
+        patch_vary_headers(response, ("Accept",))
+        return response
 
 
 class SmsCodeView(View):
@@ -301,8 +310,8 @@ class WriteBlogView(LoginRequiredMixin, View):
     """写博客"""
     def get(self, request):
         """写博客页面展示"""
-        # 获取博客分类信息
-        categories = ArticleCategory.objects.all()
+        # 获取博客分类信息(进程内缓存)
+        categories = get_categories()
         context = {
             "categories": categories
         }
@@ -313,7 +322,8 @@ class WriteBlogView(LoginRequiredMixin, View):
         avatar = request.FILES.get("avatar")
         title = request.POST.get("title")
         category_id = request.POST.get("category")
-        tags = request.POST.get("tags")
+        # 标签规范化为去重后的名称列表
+        tags = split_tags(request.POST.get("tags"))
         sumary = request.POST.get("sumary")
         content = request.POST.get("content")
         user = request.user
@@ -328,15 +338,19 @@ class WriteBlogView(LoginRequiredMixin, View):
             return HttpResponseBadRequest("没有此分类信息")
         # 3.处理数据--保存到数据库
         try:
-            article = Article.objects.create(
-                author=user,
-                avatar=avatar,
-                category=article_category,
-                tags=tags,
-                title=title,
-                sumary=sumary,
-                content=content
-            )
+            # 文章保存和分类文章数量的更新(post_save信号)在同一个事务中完成
+            with transaction.atomic():
+                article = Article.objects.create(
+                    author=user,
+                    avatar=avatar,
+                    category=article_category,
+                    tags=join_tags(tags),
+                    title=title,
+                    sumary=sumary,
+                    content=content
+                )
+                # 写入标签索引表并更新标签的文章数量
+                set_article_tags(article, tags)
         except Exception as e:
             logger.error(e)
             return HttpResponseBadRequest("发布失败，请稍后再试")
@@ -0,0 +1,45 @@
+from functools import wraps
+import logging
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger("django")
+
+
+class QueryBudgetExceeded(AssertionError):
+    """视图执行的SQL语句数量超出预算"""
+    pass
+
+
+class QueryCounter:
+    """通过connection.execute_wrapper统计执行的SQL语句数量"""
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def query_budget(max_queries):
+    """限制视图执行的SQL语句数量
+
+    用于防止N+1查询等问题回归：settings.QUERY_BUDGET_STRICT开启时(测试时开启，见utils.testing)
+    超出预算直接抛出异常，否则只记录警告日志，不影响用户访问。
+    :param max_queries: 允许执行的最大SQL语句数量
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            counter = QueryCounter()
+            with connection.execute_wrapper(counter):
+                response = view_func(request, *args, **kwargs)
+            if counter.count > max_queries:
+                message = "%s 执行了%d条SQL语句，超出预算%d条" % (request.path, counter.count, max_queries)
+                if settings.QUERY_BUDGET_STRICT:
+                    raise QueryBudgetExceeded(message)
+                logger.warning(message)
+            return response
+        return wrapper
+    return decorator
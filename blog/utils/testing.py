@@ -0,0 +1,23 @@
+"""测试使用的设置
+
+测试会清空redis库中的数据。使用redis的测试类统一用redis_test_settings装饰，
+改用单独的redis库并开启严格的SQL预算检查，不依赖测试的启动方式(manage.py test、pytest或IDE)。
+"""
+from copy import deepcopy
+
+from django.conf import settings
+from django.test import override_settings
+
+# 测试使用的redis库 {缓存配置项: 库编号}
+TEST_REDIS_DBS = {"default": 14, "session": 15}
+
+
+def redis_test_caches():
+    """将缓存配置中的redis库替换为测试使用的库"""
+    caches = deepcopy(settings.CACHES)
+    for alias, db in TEST_REDIS_DBS.items():
+        caches[alias]["LOCATION"] = "%s/%d" % (caches[alias]["LOCATION"].rsplit("/", 1)[0], db)
+    return caches
+
+
+redis_test_settings = override_settings(CACHES=redis_test_caches(), QUERY_BUDGET_STRICT=True)